@@ -17,5 +17,5 @@ def highest_access_level_for_user_and_resource(user, resource):
     return None
 
 def log_action(actor, action, resource=None, ip=None, metadata=None):
-    from users.models import AuditLog  
-    AuditLog.objects.create(actor=actor, action=action, resource=resource, ip_address=ip, metadata=metadata or {})
+    from users.audit import log_action as record
+    record(actor, action, resource=resource, ip=ip, metadata=metadata)
@@ -4,6 +4,7 @@ from monitoring import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/alerts/?$', consumers.AlertConsumer.as_asgi()),
+    re_path(r'ws/audit/?$', consumers.AuditTailConsumer.as_asgi()),
 ]
 
 from channels.auth import AuthMiddlewareStack
@@ -77,6 +77,8 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+# paginated lists announce the next page in a Link header
+CORS_EXPOSE_HEADERS = ['Link']
 
 ROOT_URLCONF = 'insiderbackend.urls'
 
@@ -110,7 +112,7 @@ WSGI_APPLICATION = 'insiderbackend.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -179,6 +181,9 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# seconds a token's user is cached instead of queried per request (see users.authentication)
+AUTH_USER_CACHE_TTL = 60
+
 SESSION_COOKIE_AGE = 60 * 60 * 3  # 3 hours in seconds
 SESSION_SAVE_EVERY_REQUEST = True  # optional: refresh expiry on every request
 
@@ -188,6 +193,16 @@ CSRF_TRUSTED_ORIGINS = [
     # Add other origins if needed
 ]
 
+# 'monitoring' holds the dashboard analytics cache; it must be shared by the web and Celery
+# processes so the invalidations done by the rollup task reach every server
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'monitoring': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/4',
+    },
+}
+
 CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Redis broker URL
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'  # Redis result backend
 CELERY_ACCEPT_CONTENT = ['json']
@@ -209,6 +224,72 @@ CHANNEL_LAYERS = {
     },
 }
 
+# detection engine: detectors run concurrently, each abandoned after the timeout (seconds)
+MONITORING_DETECTION_WORKERS = 4
+MONITORING_DETECTOR_TIMEOUT = 30
+
+# write-time detection windows: 'memory' is per process, use 'redis' with several workers
+MONITORING_STREAM_DETECTION = True
+MONITORING_STREAM_BACKEND = 'memory'
+MONITORING_STREAM_REDIS_URL = 'redis://127.0.0.1:6379/2'
+
+# dashboard summary counters ('redis', or 'memory' for a single process), reconciled against the database
+MONITORING_KPI_BACKEND = 'redis'
+MONITORING_KPI_REDIS_URL = 'redis://127.0.0.1:6379/5'
+MONITORING_KPI_RECONCILE_SECONDS = 300
+
+# alerts for a user at most this many seconds apart are grouped into one incident
+MONITORING_INCIDENT_CORRELATION = True
+MONITORING_INCIDENT_WINDOW = 1800
+
+# websocket events are sent after commit, batched per burst: at most this many seconds late
+MONITORING_BROADCAST_INTERVAL = 0.25
+MONITORING_BROADCAST_BATCH = 500
+
+# filtered websocket subscriptions: registry of active filter groups ('memory' only when the
+# consumers and every alert writer share one process), and events queued per slow socket
+MONITORING_SUBSCRIPTION_BACKEND = 'redis'
+MONITORING_SUBSCRIPTION_REDIS_URL = 'redis://127.0.0.1:6379/6'
+MONITORING_WS_MAX_PENDING = 1000
+
+# the newest alert events are kept so reconnecting sockets get only what they missed
+MONITORING_EVENT_LOG_BACKEND = 'redis'
+MONITORING_EVENT_LOG_REDIS_URL = 'redis://127.0.0.1:6379/7'
+MONITORING_EVENT_LOG_SIZE = 10000
+
+# live audit tail (ws/audit/): a summary per interval, at most SAMPLE events per filter from a
+# reservoir of BUFFER rows, then at most RATE events a second per socket
+MONITORING_AUDIT_TAIL = True
+MONITORING_AUDIT_TAIL_INTERVAL = 1.0
+MONITORING_AUDIT_TAIL_BUFFER = 20000
+MONITORING_AUDIT_TAIL_SAMPLE = 200
+MONITORING_AUDIT_TAIL_RATE = 50
+
+# audit events are queued and bulk-inserted off the request path ('sync', 'memory' or 'redis');
+# events that cannot be written are spooled to AUDIT_SPOOL_PATH and replayed later
+AUDIT_WRITER = 'memory'
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 1.0
+AUDIT_REDIS_URL = 'redis://127.0.0.1:6379/3'
+
+# action names past this many distinct ones (or malformed ones) are recorded as 'unknown'
+AUDIT_MAX_ACTIONS = 1000
+AUDIT_SPOOL_PATH = BASE_DIR / 'audit-spool.ndjson'
+# events per bulk insert on the NDJSON ingestion endpoint (api/audit/ingest/)
+AUDIT_INGEST_BATCH_SIZE = 2000
+# ingested events older than this are rejected; None falls back to AUDIT_RETENTION_DAYS
+AUDIT_INGEST_MAX_AGE_DAYS = None
+# files followed by `manage.py tail_audit_logs`, e.g. {'path': '/var/log/auth.log', 'parser': 'syslog'}
+AUDIT_LOG_SOURCES = []
+# domain appended to the unix usernames in tailed syslog lines to match user emails, e.g. 'corp.com'
+AUDIT_LOG_USER_DOMAIN = None
+
+# raw audit rows are rolled up hourly and archived to AUDIT_ARCHIVE_DIR after the retention period;
+# AUDIT_ARCHIVE_FORMAT is 'ndjson' (gzip) or 'parquet' (needs pyarrow)
+AUDIT_RETENTION_DAYS = 90
+AUDIT_ARCHIVE_DIR = BASE_DIR / 'audit-archive'
+AUDIT_ARCHIVE_FORMAT = 'ndjson'
+
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
@@ -216,5 +297,21 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'monitoring.run_all_detections',
         'schedule': 60.0,  # every 60s; adjust as needed
     },
+    'rollup-audit-logs-hourly': {
+        'task': 'monitoring.rollup_audit_logs',
+        'schedule': crontab(minute=10),
+    },
+    'archive-audit-logs-daily': {
+        'task': 'monitoring.archive_audit_logs',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'reconcile-kpis': {
+        'task': 'monitoring.reconcile_kpis',
+        'schedule': crontab(minute='*/5'),
+    },
+    'ensure-auditlog-partitions-daily': {
+        'task': 'users.ensure_auditlog_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
 }
 
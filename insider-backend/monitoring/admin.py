@@ -1,3 +1,34 @@
 from django.contrib import admin
+from .models import AuditArchive, DetectorCheckpoint, DetectorRun, Incident, LogSourceCheckpoint
 
-# Register your models here.
+
+@admin.register(DetectorCheckpoint)
+class DetectorCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('detector', 'last_log_id', 'last_timestamp')
+    exclude = ('state',)
+
+
+@admin.register(DetectorRun)
+class DetectorRunAdmin(admin.ModelAdmin):
+    list_display = ('detector', 'started_at', 'status', 'wall_ms', 'rows_scanned', 'alerts_created')
+    list_filter = ('detector', 'status')
+    date_hierarchy = 'started_at'
+
+
+@admin.register(AuditArchive)
+class AuditArchiveAdmin(admin.ModelAdmin):
+    list_display = ('day', 'rows', 'format', 'path', 'created_at')
+    date_hierarchy = 'day'
+
+
+@admin.register(LogSourceCheckpoint)
+class LogSourceCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('path', 'offset', 'inode', 'updated_at')
+
+
+@admin.register(Incident)
+class IncidentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'severity', 'status', 'alert_count', 'first_seen', 'last_seen')
+    list_filter = ('status', 'severity')
+    date_hierarchy = 'first_seen'
+    raw_id_fields = ('user',)
@@ -0,0 +1,98 @@
+# monitoring/alerts.py
+"""
+Alert write path shared by the detection engine, the streaming detectors and
+ML inference.
+
+Every generated alert carries a deterministic dedup key
+    <action>:<user id>:<window bucket start epoch>
+backed by a unique index. Writers insert with ON CONFLICT DO NOTHING, so a
+second finding for the same user inside the same bucket is dropped by the
+database while a new incident in the next bucket gets its own alert. The
+insert RETURNs the ids it actually wrote, so of two concurrent writers of one
+key only the one that inserted it counts, correlates and broadcasts it.
+
+clear_alerts() clears a whole filtered set with a single UPDATE and tells the
+websocket clients with one 'alerts.cleared' event instead of one per alert.
+Everything sent to the websocket goes through monitoring.broadcast.
+"""
+from django.db import connection, transaction
+from django.db.models import Count
+from monitoring import broadcast, incidents, kpis
+from monitoring.models import Alert
+
+# a bulk-clear event lists the cleared ids only up to this many
+BROADCAST_IDS = 500
+INSERT_BATCH = 500
+
+
+def bucket_start(at, window):
+    """Start epoch of the dedup bucket holding `at` (an epoch or datetime); `window` is a timedelta."""
+    epoch = at.timestamp() if hasattr(at, 'timestamp') else at
+    span = max(int(window.total_seconds()), 1)
+    return int(epoch // span) * span
+
+
+def dedup_key(action, user_id, at, window):
+    return f"{action}:{user_id}:{bucket_start(at, window)}"
+
+
+def upsert_alerts(alerts):
+    """
+    Insert unsaved Alert objects that carry a dedup_key; return the ones actually
+    inserted (with their user loaded) after attaching them to incidents.
+    Costs one INSERT per INSERT_BATCH alerts plus one SELECT, and the correlation writes.
+    """
+    unique = {}
+    for alert in alerts:
+        unique.setdefault(alert.dedup_key, alert)
+    if not unique:
+        return []
+    ids = _insert_new(list(unique.values()))
+    inserted = list(Alert.objects.filter(id__in=ids).select_related('user')) if ids else []
+    kpis.alerts_created(inserted)
+    incidents.correlate(inserted)
+    return inserted
+
+
+def _insert_new(alerts):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING id (PostgreSQL, SQLite): the ids this call wrote."""
+    meta = Alert._meta
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(f.column) for f in fields)
+    row = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(alerts), INSERT_BATCH):
+            batch = alerts[start:start + INSERT_BATCH]
+            params = [f.get_db_prep_save(f.pre_save(alert, True), connection) for alert in batch for f in fields]
+            cursor.execute(f"INSERT INTO {qn(meta.db_table)} ({columns}) VALUES {', '.join([row] * len(batch))} "
+                           f"ON CONFLICT DO NOTHING RETURNING {qn(meta.pk.column)}", params)
+            ids.extend(r[0] for r in cursor.fetchall())
+    return ids
+
+
+def broadcast_new_alerts(alerts):
+    # bulk_create does not send post_save, so queue new alerts for the websocket here;
+    # alerts that joined an existing incident are sent as one update per incident
+    joined = set()
+    for alert in alerts:
+        if alert.incident_id and not getattr(alert, 'opened_incident', False):
+            joined.add(alert.incident_id)
+        else:
+            broadcast.alert_created(alert)
+    if joined:
+        broadcast.incidents_updated(joined)
+
+
+def clear_alerts(qs):
+    """Clear every open alert in qs with one UPDATE and announce it with one event; return the count."""
+    qs = qs.filter(cleared=False)
+    with transaction.atomic():
+        groups = list(qs.values_list('severity', 'user_id').annotate(n=Count('id')).order_by())
+        ids = list(qs.values_list('id', flat=True)[:BROADCAST_IDS + 1]) if groups else []
+        cleared = qs.update(cleared=True)
+        kpis.alerts_cleared(groups, cleared)
+        if cleared:
+            broadcast.alerts_cleared(cleared, ids if len(ids) <= BROADCAST_IDS else None)
+    return cleared
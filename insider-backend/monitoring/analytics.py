@@ -0,0 +1,228 @@
+# monitoring/analytics.py
+"""
+Bucketed counts of audit events and alerts for the dashboard charts.
+
+series() returns one count per time bucket (hour, day or week) and group
+(action category or name, alert severity, department or user). The database
+does the grouping, so the payload is a few numbers per bucket no matter how
+many rows sit behind them.
+
+Events are counted from the hourly AuditRollup rows; only the hours after the
+last rollup are counted from the raw AuditLog. Alerts are counted from Alert.
+
+Every bucket that is already closed is cached per (metric, grouping column,
+granularity, bucket start), so a request only aggregates the buckets it has
+not seen and the still-open bucket at the end. Closed event buckets change
+only when rollup() recomputes their hours, and rollup() calls
+invalidate_events() for exactly those hours. Closed alert buckets change only
+when alerts are deleted, and the post_delete signal calls invalidate_alerts().
+The cache is the 'monitoring' alias when configured, so every web and Celery
+process sees the same entries. A cache outage only makes requests slower.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Sum
+from django.db.models.functions import Trunc
+
+from monitoring.models import Alert, AuditRollup
+from users import actions
+from users.models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {'hour': timedelta(hours=1), 'day': timedelta(days=1), 'week': timedelta(weeks=1)}
+MAX_BUCKETS = 2000
+CACHE_TIMEOUT = 7 * 24 * 3600
+
+# grouping -> column, per metric; category and action share the action_type_id column
+EVENT_GROUPS = {
+    'category': 'action_type_id',
+    'action': 'action_type_id',
+    'department': 'actor__department__name',
+    'user': 'actor__email',
+}
+ALERT_GROUPS = {
+    'severity': 'severity',
+    'action': 'action',
+    'department': 'user__department__name',
+    'user': 'user__email',
+}
+METRICS = {'events': EVENT_GROUPS, 'alerts': ALERT_GROUPS}
+
+EPOCH_MONDAY = datetime(1970, 1, 5, tzinfo=dt_timezone.utc)   # weeks start on Monday, as in TruncWeek
+
+
+def _cache():
+    return caches['monitoring' if 'monitoring' in settings.CACHES else 'default']
+
+
+def floor(when, granularity):
+    when = when.astimezone(dt_timezone.utc)
+    if granularity == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return day
+    return day - timedelta(days=(day - EPOCH_MONDAY).days % 7)
+
+
+def buckets(since, until, granularity):
+    step = GRANULARITIES[granularity]
+    start = floor(since, granularity)
+    out = []
+    while start < until:
+        out.append(start)
+        start += step
+    return out
+
+
+def _key(metric, column, granularity, bucket):
+    return f'analytics:{metric}:{column}:{granularity}:{int(bucket.timestamp())}'
+
+
+def _cache_get(keys):
+    try:
+        return _cache().get_many(keys)
+    except Exception:
+        logger.warning("Analytics cache unavailable", exc_info=True)
+        return {}
+
+
+def _cache_set(values):
+    try:
+        _cache().set_many(values, timeout=CACHE_TIMEOUT)
+    except Exception:
+        logger.warning("Analytics cache unavailable", exc_info=True)
+
+
+def _invalidate(metric, columns, start, end):
+    keys = []
+    for granularity in GRANULARITIES:
+        for bucket in buckets(start, end, granularity):
+            keys += [_key(metric, column, granularity, bucket) for column in columns]
+    try:
+        _cache().delete_many(keys)
+    except Exception:
+        logger.warning("Analytics cache unavailable, could not invalidate %s..%s", start, end, exc_info=True)
+
+
+def invalidate_events(start, end):
+    """Forget cached event buckets overlapping [start, end); rollup() calls this."""
+    _invalidate('events', set(EVENT_GROUPS.values()), start, end)
+
+
+def invalidate_alerts(when):
+    _invalidate('alerts', set(ALERT_GROUPS.values()), when, when + timedelta(microseconds=1))
+
+
+def _aggregate(qs, time_field, column, granularity, total):
+    """{bucket start: {group: count}} for one queryset."""
+    out = {}
+    rows = (qs.annotate(bucket=Trunc(time_field, granularity, tzinfo=dt_timezone.utc))
+            .values('bucket', column).annotate(n=total).order_by())
+    for row in rows:
+        group = out.setdefault(row['bucket'], {})
+        group[row[column]] = group.get(row[column], 0) + row['n']
+    return out
+
+
+def _merge(into, counts):
+    for bucket, groups in counts.items():
+        target = into.setdefault(bucket, {})
+        for group, n in groups.items():
+            target[group] = target.get(group, 0) + n
+
+
+def _event_counts(column, granularity, start, end, rolled_until):
+    """Event counts for [start, end): rollups before rolled_until, raw rows after it."""
+    counts = {}
+    split = min(max(start, rolled_until or start), end)
+    if split > start:
+        _merge(counts, _aggregate(AuditRollup.objects.filter(hour__gte=start, hour__lt=split),
+                                  'hour', column, granularity, Sum('count')))
+    if end > split:
+        _merge(counts, _aggregate(AuditLog.objects.filter(timestamp__gte=split, timestamp__lt=end),
+                                  'timestamp', column, granularity, Count('id')))
+    return counts
+
+
+def _alert_counts(column, granularity, start, end):
+    return _aggregate(Alert.objects.filter(timestamp__gte=start, timestamp__lt=end),
+                      'timestamp', column, granularity, Count('id'))
+
+
+def _counts(metric, column, granularity, since, until, now):
+    """{bucket: {raw group: count}} for every bucket in [since, until), cached where closed."""
+    from monitoring.rollups import rolled_up_until
+
+    step = GRANULARITIES[granularity]
+    all_buckets = buckets(since, until, granularity)
+    closed_until = rolled_up_until() if metric == 'events' else now
+    closed = [b for b in all_buckets if closed_until and b + step <= closed_until]
+    open_ = all_buckets[len(closed):]
+
+    keys = {_key(metric, column, granularity, b): b for b in closed}
+    cached = _cache_get(list(keys))
+    result = {keys[k]: v for k, v in cached.items()}
+    missing = [b for b in closed if b not in result]
+
+    def compute(start, end):
+        if metric == 'events':
+            return _event_counts(column, granularity, start, end, closed_until)
+        return _alert_counts(column, granularity, start, end)
+
+    if missing:
+        fresh = compute(missing[0], missing[-1] + step)
+        _cache_set({_key(metric, column, granularity, b): fresh.get(b, {}) for b in missing})
+        for b in missing:
+            result[b] = fresh.get(b, {})
+    if open_:
+        fresh = compute(open_[0], open_[-1] + step)
+        for b in open_:
+            result[b] = fresh.get(b, {})
+    return result
+
+
+def _label(by, value):
+    if value is None:
+        return 'unknown'
+    if by == 'action' and isinstance(value, int):
+        return actions.name(value)
+    if by == 'category':
+        return actions.category(actions.name(value))
+    return value
+
+
+def series(metric, by, granularity, since, until, top=None, now=None):
+    """
+    {'buckets': [iso start, ...], 'series': {group: [count per bucket]}, 'totals': {group: count}}.
+    With top, only the top groups by total are kept and the rest are summed into 'other'.
+    """
+    column = METRICS[metric][by]
+    all_buckets = buckets(since, until, granularity)
+    counts = _counts(metric, column, granularity, since, until, now or datetime.now(dt_timezone.utc))
+
+    series_ = {}
+    for i, bucket in enumerate(all_buckets):
+        for value, n in counts.get(bucket, {}).items():
+            label = _label(by, value)
+            series_.setdefault(label, [0] * len(all_buckets))[i] += n
+    totals = {label: sum(values) for label, values in series_.items()}
+
+    if top and len(series_) > top:
+        keep = sorted(totals, key=totals.get, reverse=True)[:top]
+        other = [0] * len(all_buckets)
+        for label in set(series_) - set(keep):
+            other = [a + b for a, b in zip(other, series_.pop(label))]
+            totals.pop(label)
+        series_['other'] = other
+        totals['other'] = sum(other)
+
+    return {
+        'buckets': [b.isoformat() for b in all_buckets],
+        'series': series_,
+        'totals': totals,
+    }
@@ -0,0 +1,215 @@
+# monitoring/audit_tail.py
+"""
+Live tail of the audit log for the ws/audit/ websocket (AuditTailConsumer).
+
+Every path that writes AuditLog rows (the buffered writer and bulk ingest)
+hands the rows to events_written(), which queues them once the transaction
+commits. Nothing is sent per event: a daemon thread wakes at most every
+MONITORING_AUDIT_TAIL_INTERVAL seconds and sends each watching filter group
+one summary of the interval:
+
+    {"events": [...], "matched": 48210, "sent": 200, "by_category": {"auth": 40110, ...}}
+
+The interval's rows are held in a reservoir of at most
+MONITORING_AUDIT_TAIL_BUFFER rows (a uniform sample once more arrive), so a
+burst of any size costs bounded memory. Per group the matching rows are
+counted, scaled up to the full interval, and sampled down to at most
+MONITORING_AUDIT_TAIL_SAMPLE events, so the sampling rate adapts to the
+volume: a quiet filter gets every event, a flood gets a fixed-size sample plus
+exact-in-expectation counts. The consumer then applies its own per-connection
+rate limit.
+
+A client filters by user ids, department names and action categories (see
+users.actions). Filter groups are registered like the alert subscriptions
+(monitoring.subscriptions, stream 'audit'), and when no one is watching, the
+queued rows are simply discarded.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from monitoring import subscriptions
+from monitoring.subscriptions import InvalidFilter, _values
+from users import actions
+
+logger = logging.getLogger(__name__)
+
+FILTER_KEYS = ('user', 'department', 'category')
+BASE_GROUP = 'audit'
+
+
+def normalize(raw):
+    """A client filter (dict of strings or lists) -> canonical filter dict, empty keys dropped."""
+    unknown = set(raw) - set(FILTER_KEYS)
+    if unknown:
+        raise InvalidFilter(f"Unknown filter: {', '.join(sorted(unknown))}.")
+    spec = {}
+    departments = _values(raw.get('department'))
+    if departments:
+        spec['department'] = departments
+    categories = _values(raw.get('category'))
+    if categories:
+        known = {c for c, _ in actions.CATEGORY_CHOICES}
+        if set(categories) - known:
+            raise InvalidFilter(f"category must be among {', '.join(sorted(known))}.")
+        spec['category'] = categories
+    users = _values(raw.get('user'))
+    if users:
+        try:
+            spec['user'] = sorted(int(u) for u in users)
+        except ValueError:
+            raise InvalidFilter('user must be a list of user ids.')
+    return spec
+
+
+def group_name(spec):
+    return subscriptions.group_name(spec, base=BASE_GROUP)
+
+
+def matches(spec, context):
+    for key, field in (('department', 'department'), ('category', 'category'), ('user', 'user_id')):
+        if key in spec and context.get(field) not in spec[key]:
+            return False
+    return True
+
+
+class Tail:
+    """Per-process reservoir of recently written rows, summarized to the watching groups."""
+
+    def __init__(self, interval, buffer_size, sample):
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.sample = sample
+        self._lock = threading.Lock()
+        self._rows = []
+        self._seen = 0
+        self._pending = threading.Event()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # start lazily, and again in a forked child where the parent's thread does not exist
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='audit-tail', daemon=True).start()
+
+    def add(self, rows):
+        self._ensure_thread()
+        with self._lock:
+            for row in rows:
+                self._seen += 1
+                if len(self._rows) < self.buffer_size:
+                    self._rows.append(row)
+                else:
+                    j = random.randrange(self._seen)   # reservoir sampling, algorithm R
+                    if j < self.buffer_size:
+                        self._rows[j] = row
+        self._pending.set()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            time.sleep(self.interval)
+            self._pending.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit tail flush failed")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._lock:
+            rows, seen = self._rows, self._seen
+            self._rows, self._seen = [], 0
+        if not rows:
+            return
+        active = subscriptions.get_registry(BASE_GROUP).active()
+        if not active:
+            return
+        messages = summarize(rows, seen, active, self.sample)
+        if messages:
+            async_to_sync(_send)(messages)
+
+
+def summarize(rows, seen, groups, sample):
+    """[(group, message)] for the groups with matching rows; rows are a uniform sample of `seen` rows."""
+    from users.models import User
+
+    actors = {pk: (email, department) for pk, email, department in
+              User.objects.filter(pk__in={r[0] for r in rows if r[0] is not None})
+              .values_list('pk', 'email', 'department__name')}
+    scale = seen / len(rows)
+    contexts = []
+    for row in rows:
+        email, department = actors.get(row[0], (None, None))
+        name = actions.name(row[1])
+        contexts.append((row, {'user_id': row[0], 'email': email, 'department': department,
+                               'action': name, 'category': actions.category(name)}))
+
+    messages = []
+    for group, spec in groups.items():
+        matched = [(row, ctx) for row, ctx in contexts if matches(spec, ctx)]
+        if not matched:
+            continue
+        by_category = Counter(ctx['category'] for _, ctx in matched)
+        picked = matched if len(matched) <= sample else random.sample(matched, sample)
+        picked.sort(key=lambda item: item[0][4])
+        messages.append((group, {
+            'type': 'audit_batch',
+            'events': [_event(row, ctx) for row, ctx in picked],
+            'matched': round(len(matched) * scale),
+            'sent': len(picked),
+            'by_category': {c: round(n * scale) for c, n in by_category.items()},
+        }))
+    return messages
+
+
+def _event(row, ctx):
+    actor_id, _, resource_id, ip, timestamp = row
+    return {
+        'user': ctx['email'], 'actor_id': actor_id, 'action': ctx['action'], 'category': ctx['category'],
+        'resource_id': resource_id, 'ip': ip, 'timestamp': timestamp.isoformat(),
+    }
+
+
+async def _send(messages):
+    layer = get_channel_layer()
+    for group, message in messages:
+        await layer.group_send(group, message)
+
+
+_tail = None
+_tail_lock = threading.Lock()
+
+
+def get_tail():
+    global _tail
+    if _tail is None:
+        with _tail_lock:
+            if _tail is None:
+                _tail = Tail(getattr(settings, 'MONITORING_AUDIT_TAIL_INTERVAL', 1.0),
+                             getattr(settings, 'MONITORING_AUDIT_TAIL_BUFFER', 20000),
+                             getattr(settings, 'MONITORING_AUDIT_TAIL_SAMPLE', 200))
+    return _tail
+
+
+def events_written(rows):
+    """rows: (actor id, action code, resource id, ip, timestamp) of committed AuditLog inserts."""
+    if rows and getattr(settings, 'MONITORING_AUDIT_TAIL', True):
+        transaction.on_commit(lambda: _safely(get_tail().add, rows))
+
+
+def _safely(fn, *args):
+    # the tail is best effort: a failure here must never break the write it follows
+    try:
+        fn(*args)
+    except Exception:
+        logger.warning("Audit tail update failed", exc_info=True)
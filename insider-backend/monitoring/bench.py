@@ -0,0 +1,275 @@
+# monitoring/bench.py
+"""
+Synthetic audit data and the benchmarks run by `manage.py benchmark_detection`.
+
+generate() bulk-loads departments, roles, users, resources and AuditLog rows
+with a realistic shape: department sizes are skewed, activity follows office
+hours, most actions touch the actor's own department, and about 1% of users
+are simulated insiders that produce the bursts the detectors look for.
+Everything it creates is tagged with BENCH_DOMAIN / BENCH_PREFIX so clear()
+can remove it again.
+
+The benchmark functions return plain dicts so the command can dump them as
+JSON and compare one version against another.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from users.models import AuditLog, Department, Resource, Role, User
+
+BENCH_DOMAIN = 'bench.local'
+BENCH_PREFIX = 'bench-'
+BENCH_ADMIN = f'{BENCH_PREFIX}admin@{BENCH_DOMAIN}'
+
+ACTIONS = {
+    'view_resource': 30,
+    'list_department_resources': 10,
+    'download_resource': 12,
+    'login': 10,
+    'otp_verified': 9,
+    'logout': 8,
+    'update_resource': 5,
+    'create_resource': 3,
+    'list_users': 3,
+    'access_resource': 3,
+    'otp_failed': 3,
+    'delete_resource': 2,
+    'assign_role_access_create': 1,
+    'assign_user_access_update': 1,
+}
+# relative activity per hour of day, office hours dominate
+HOURS = [1, 1, 1, 1, 1, 2, 4, 10, 18, 20, 20, 18, 14, 18, 20, 20, 18, 12, 6, 4, 3, 2, 2, 1]
+ROLES = [('Employee', 1), ('Analyst', 2), ('Manager', 3), ('System Admin', 4)]
+THREAT_BURSTS = [
+    ['otp_failed'] * 8,
+    ['download_resource'] * 12,
+    ['login', 'delete_resource', 'logout'],
+    ['download_resource'] * 3 + ['assign_user_access_update', 'logout'],
+    ['access_resource', 'delete_resource'],
+]
+
+
+def generate(rows, users=500, departments=8, resources=2000, days=30, batch=10_000, seed=0, stdout=None):
+    """Load `rows` synthetic AuditLog rows spread over the last `days` days; return counts."""
+    rng = random.Random(seed)
+    started = time.monotonic()
+    offset = User.objects.filter(email__endswith='@' + BENCH_DOMAIN).exclude(email=BENCH_ADMIN).count()
+
+    depts = [Department.objects.get_or_create(name=f'{BENCH_PREFIX}dept-{i}')[0] for i in range(departments)]
+    roles = {}
+    for dept in depts:
+        for name, level in ROLES:
+            roles[dept.pk, level] = Role.objects.get_or_create(name=name, department=dept, defaults={'level': level})[0]
+
+    # a handful of large departments and a long tail of small ones
+    dept_weights = [1 / (i + 1) for i in range(len(depts))]
+    password = make_password(None)
+    new_users = []
+    for i in range(offset, offset + users):
+        dept = rng.choices(depts, dept_weights)[0]
+        level = rng.choices([1, 2, 3, 4], [70, 15, 12, 3])[0]
+        new_users.append(User(email=f'{BENCH_PREFIX}{i}@{BENCH_DOMAIN}', full_name=f'Bench User {i}',
+                              password=password, department=dept, role=roles[dept.pk, level],
+                              is_simulated_threat=rng.random() < 0.01))
+    if not User.objects.filter(email=BENCH_ADMIN).exists():
+        new_users.append(User(email=BENCH_ADMIN, full_name='Bench Admin', password=password,
+                              is_staff=True, is_superuser=True))
+    User.objects.bulk_create(new_users, batch_size=batch)
+    people = list(User.objects.filter(email__endswith='@' + BENCH_DOMAIN).exclude(email=BENCH_ADMIN).only('id', 'department_id', 'is_simulated_threat'))
+
+    Resource.objects.bulk_create([
+        Resource(name=f'{BENCH_PREFIX}file-{i}', path=f'/bench/{i}', department=rng.choice(depts),
+                 created_by=rng.choice(people))
+        for i in range(resources)
+    ], batch_size=batch)
+    by_dept = {}
+    for res_id, dept_id in Resource.objects.filter(name__startswith=BENCH_PREFIX).values_list('id', 'department_id'):
+        by_dept.setdefault(dept_id, []).append(res_id)
+    all_resources = [r for ids in by_dept.values() for r in ids]
+
+    # a few heavy users produce most of the traffic
+    activity = [rng.paretovariate(1.5) for _ in people]
+    threats = [p for p in people if p.is_simulated_threat] or people[:1]
+    action_names, action_weights = list(ACTIONS), list(ACTIONS.values())
+
+    def resource_for(actor):
+        own = by_dept.get(actor.department_id)
+        if own and rng.random() < 0.85:
+            return rng.choice(own)
+        return rng.choice(all_resources)
+
+    end = timezone.now()
+    start = end - timedelta(days=days)
+    per_day = max(rows // days, 1)
+    written = 0
+    for day in range(days):
+        day_start = start + timedelta(days=day)
+        remaining = per_day if day < days - 1 else rows - written
+        while remaining > 0:
+            n = min(batch, remaining)
+            hours = rng.choices(range(24), HOURS, k=n)
+            stamps = sorted(h * 3600 + rng.random() * 3600 for h in hours)
+            actors = rng.choices(people, activity, k=n)
+            actions = rng.choices(action_names, action_weights, k=n)
+            logs = [AuditLog(actor_id=a.pk, action=act, resource_id=resource_for(a),
+                             ip_address=f'10.{a.department_id % 256}.{a.pk // 256 % 256}.{a.pk % 256}',
+                             metadata={}, timestamp=day_start + timedelta(seconds=s))
+                    for a, act, s in zip(actors, actions, stamps)]
+            # simulated insiders act up about once per 2000 rows
+            for _ in range(max(n // 2000, 1) if threats else 0):
+                actor = rng.choice(threats)
+                at = day_start + timedelta(seconds=rng.choice(stamps))
+                for k, act in enumerate(rng.choice(THREAT_BURSTS)):
+                    logs.append(AuditLog(actor_id=actor.pk, action=act, resource_id=resource_for(actor),
+                                         metadata={}, timestamp=at + timedelta(seconds=20 * k)))
+            AuditLog.objects.bulk_create(logs, batch_size=batch)
+            written += len(logs)
+            remaining -= n
+        if stdout is not None and (day + 1) % max(days // 10, 1) == 0:
+            elapsed = time.monotonic() - started
+            stdout.write(f"  day {day + 1}/{days}: {written} rows, {written / max(elapsed, 1e-9):,.0f} rows/s")
+
+    return {'users': len(people), 'departments': len(depts), 'resources': len(all_resources), 'rows': written}
+
+
+def clear():
+    """Remove everything generate() created."""
+    bench_users = User.objects.filter(email__endswith='@' + BENCH_DOMAIN)
+    deleted, _ = AuditLog.objects.filter(actor__in=bench_users).delete()
+    bench_users.delete()
+    Department.objects.filter(name__startswith=BENCH_PREFIX).delete()   # cascades to roles and resources
+    return deleted
+
+
+def measure(name, func, repeat=3, **extra):
+    """Run func `repeat` times; report wall time (ms) and the queries of the last run."""
+    timings = []
+    queries = 0
+    result = None
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    for _ in range(repeat):
+        queries = 0
+        with connection.execute_wrapper(count):
+            began = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - began) * 1000)
+    row = {'name': name, 'repeat': repeat, 'queries': queries,
+           'min_ms': round(min(timings), 3), 'median_ms': round(statistics.median(timings), 3),
+           'max_ms': round(max(timings), 3)}
+    row.update(extra)
+    if isinstance(result, dict):
+        row.update(result)
+    return row
+
+
+@contextmanager
+def rolled_back():
+    """Run a benchmark that writes (alerts, checkpoints, anomalies) without keeping its writes."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def bench_detectors(span, repeat):
+    from monitoring.detectors import REGISTRY
+    from monitoring.engine import run_detectors, scan_range
+    from monitoring.models import DetectorCheckpoint
+
+    end = timezone.now()
+    results = []
+    for name, detector in sorted(REGISTRY.items()):
+        def run(detector=detector):
+            findings, rows = scan_range(detector, end - span, end)
+            return {'rows_scanned': rows, 'findings': len(findings)}
+        results.append(measure(f'detector.{name}', run, repeat, span_s=span.total_seconds()))
+
+    def full_pass():
+        with rolled_back():
+            DetectorCheckpoint.objects.all().delete()
+            return {'alerts': len(run_detectors(workers=1, broadcast=False))}
+    # one pass from fresh checkpoints, as the scheduled task runs after a deploy
+    results.append(measure('engine.run_detectors', full_pass, repeat))
+    return results
+
+
+def bench_ml(window_minutes, repeat):
+    from monitoring.ml import infer
+
+    results = [measure('ml.build_features', lambda: {
+        'feature_rows': len(infer.build_feature_df_for_recent_window(window_minutes=window_minutes))
+    }, repeat, window_minutes=window_minutes)]
+    try:
+        infer.load_model()
+    except FileNotFoundError:
+        results.append({'name': 'ml.infer_and_record', 'skipped': 'no trained model'})
+        return results
+
+    def run():
+        with rolled_back():
+            return {'scored': len(infer.infer_and_record(window_minutes=window_minutes))}
+    results.append(measure('ml.infer_and_record', run, repeat, window_minutes=window_minutes))
+    return results
+
+
+def bench_rbac(samples, repeat, seed=0):
+    from rest_framework.test import APIRequestFactory
+    from users.permissions import RoleEnforcer
+
+    rng = random.Random(seed)
+    users = list(User.objects.filter(email__endswith='@' + BENCH_DOMAIN, is_superuser=False).select_related('role', 'department')[:1000])
+    resource_ids = list(Resource.objects.filter(name__startswith=BENCH_PREFIX).values_list('id', flat=True)[:5000])
+    if not users or not resource_ids:
+        return [{'name': 'rbac.has_object_permission', 'skipped': 'no benchmark data'}]
+    resources = Resource.objects.select_related('department').in_bulk(rng.sample(resource_ids, min(samples, len(resource_ids))))
+    factory = APIRequestFactory()
+    checks = []
+    for res in resources.values():
+        for method in ('get', 'put', 'delete'):
+            request = getattr(factory, method)('/')
+            request.user = rng.choice(users)
+            checks.append((request, res))
+    enforcer = RoleEnforcer()
+
+    def run():
+        allowed = sum(enforcer.has_object_permission(req, None, res) for req, res in checks)
+        return {'checks': len(checks), 'allowed': allowed}
+    return [measure('rbac.has_object_permission', run, repeat)]
+
+
+def bench_endpoints(repeat):
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from monitoring.views import AlertListView
+    from users import views
+
+    admin = User.objects.filter(email=BENCH_ADMIN).first() or User.objects.filter(is_superuser=True).first()
+    if admin is None:
+        return [{'name': 'endpoints', 'skipped': 'no admin user to authenticate as'}]
+    factory = APIRequestFactory()
+    endpoints = [
+        ('endpoint.audit_logs', views.audit_logs, '/api/users/audit/logs/'),
+        ('endpoint.list_users', views.list_users, '/api/users/'),
+        ('endpoint.list_resources', views.list_resources, '/api/users/resources/'),
+        ('endpoint.alerts', AlertListView.as_view(), '/api/monitoring/alerts/'),
+    ]
+    results = []
+    for name, view, path in endpoints:
+        def run(view=view, path=path):
+            request = factory.get(path)
+            force_authenticate(request, user=admin)
+            response = view(request)
+            response.render()
+            return {'status': response.status_code, 'bytes': len(response.content)}
+        results.append(measure(name, run, repeat))
+    return results
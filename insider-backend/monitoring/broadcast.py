@@ -0,0 +1,220 @@
+# monitoring/broadcast.py
+"""
+Websocket events for the 'alerts' group, published after commit and coalesced.
+
+Writers call alert_created(), incidents_updated() or alerts_cleared(). Nothing
+is sent from inside a transaction: each call only registers an on_commit hook,
+so a rolled back detector run or inference announces nothing. Once committed,
+the event joins a per-process queue. A daemon thread drains the queue at most
+MONITORING_BROADCAST_INTERVAL seconds after the first event of a burst, or
+immediately once MONITORING_BROADCAST_BATCH events wait, and sends the batch
+as one group_send, which the consumer writes as one websocket frame:
+
+    {"type": "batch", "events": [{"id": "...", "type": "alert.created", "alert": {...}}, ...]}
+
+Each event is numbered in the replay log first (monitoring.event_log), so a
+reconnecting client can resume from the last id it saw.
+
+The whole batch goes to the plain 'alerts' group. Each filtered subscription
+group (see monitoring.subscriptions) gets one message holding only the events
+that pass its filter; bulk clears go to every group.
+
+Serialization happens in the flush: the users behind the batched alerts and
+the incidents behind the batched updates are read with one query each, and
+an incident updated several times in a burst is sent once, in its latest state.
+A detection run that creates hundreds of alerts thus costs one channel layer
+round trip per subscription group. Whatever is still queued is flushed when
+the process exits.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from monitoring import event_log, subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    def __init__(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._queue = deque()
+        self._pending = threading.Event()   # set by the first event of a burst
+        self._full = threading.Event()      # set once batch_size events wait
+        self._flush_lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # start lazily, and again in a forked child where the parent's thread does not exist
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='alert-broadcast', daemon=True).start()
+
+    def add(self, item):
+        self._ensure_thread()
+        self._queue.append(item)
+        self._pending.set()
+        if len(self._queue) >= self.batch_size:
+            self._full.set()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._full.wait(self.interval)
+            self._pending.clear()
+            self._full.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Alert broadcast failed")
+            finally:
+                close_old_connections()
+
+    def flush(self, at_exit=False):
+        with self._flush_lock:
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                items = _serialize(batch)
+                if items:
+                    _log(items)
+                    messages = _fan_out(items)
+                    if at_exit:
+                        # by now async_to_sync's executor is shut down, so use a loop of our own
+                        asyncio.run(_send(messages))
+                    else:
+                        async_to_sync(_send)(messages)
+
+
+def _log(items):
+    """Number the events in the replay log, see monitoring.event_log."""
+    try:
+        ids = event_log.get_event_log().append(items)
+    except Exception:
+        logger.warning("Alert event log unavailable, sending events without ids", exc_info=True)
+        return
+    for (event, _), event_id in zip(items, ids):
+        event['id'] = event_id
+
+
+def _fan_out(items):
+    """[(group, message)]: every event for the base group, the matching ones for each filtered group."""
+    messages = [(subscriptions.BASE_GROUP, {'type': 'alerts_batch', 'events': [e for e, _ in items]})]
+    try:
+        active = subscriptions.get_registry().active()
+    except Exception:
+        logger.warning("Subscription registry unavailable, sending to unfiltered sockets only", exc_info=True)
+        active = {}
+    for group, spec in active.items():
+        if group == subscriptions.BASE_GROUP:
+            continue
+        events = [e for e, context in items if context is None or subscriptions.matches(spec, context)]
+        if events:
+            messages.append((group, {'type': 'alerts_batch', 'events': events}))
+    return messages
+
+
+async def _send(messages):
+    layer = get_channel_layer()
+    for group, message in messages:
+        await layer.group_send(group, message)
+
+
+def _serialize(batch):
+    """
+    Queued (kind, payload) items -> [(client event, filter context or None)],
+    with one query per kind of related row.
+    """
+    from monitoring.models import Incident
+    from monitoring.serializers import AlertSerializer, IncidentSerializer
+    from users.models import Department, User
+
+    alerts = [payload for kind, payload in batch if kind == 'alert']
+    user_field = alerts[0]._meta.get_field('user') if alerts else None
+    missing = {a.user_id for a in alerts if not user_field.is_cached(a)}
+    users = User.objects.in_bulk(missing) if missing else {}
+    for alert in alerts:
+        if alert.user_id in users:
+            alert.user = users[alert.user_id]
+
+    incident_ids = {pk for kind, payload in batch if kind == 'incidents' for pk in payload}
+    incidents = Incident.objects.select_related('user').in_bulk(incident_ids) if incident_ids else {}
+
+    department_ids = {a.user.department_id for a in alerts} | {i.user.department_id for i in incidents.values()}
+    department_ids.discard(None)
+    departments = (dict(Department.objects.filter(pk__in=department_ids).values_list('pk', 'name'))
+                   if department_ids else {})
+
+    def context(row, action):
+        return {'severity': row.severity, 'action': action, 'user_id': row.user_id,
+                'department': departments.get(row.user.department_id)}
+
+    items, sent = [], set()
+    for kind, payload in batch:
+        if kind == 'alert':
+            items.append(({'type': 'alert.created', 'alert': AlertSerializer(payload).data},
+                          context(payload, payload.action)))
+        elif kind == 'incidents':
+            for pk in payload:
+                if pk in incidents and pk not in sent:
+                    sent.add(pk)
+                    items.append(({'type': 'incident.updated', 'incident': IncidentSerializer(incidents[pk]).data},
+                                  context(incidents[pk], None)))
+        else:
+            items.append(({'type': 'alerts.cleared', **payload}, None))
+    return items
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = Coalescer(getattr(settings, 'MONITORING_BROADCAST_INTERVAL', 0.25),
+                                       getattr(settings, 'MONITORING_BROADCAST_BATCH', 500))
+                atexit.register(_flush_at_exit)
+    return _coalescer
+
+
+def flush():
+    """Send everything this process has queued."""
+    if _coalescer is not None:
+        _coalescer.flush()
+
+
+def _flush_at_exit():
+    try:
+        _coalescer.flush(at_exit=True)
+    except Exception:
+        logger.exception("Alert broadcast at exit failed")
+
+
+def _publish(kind, payload):
+    transaction.on_commit(lambda: get_coalescer().add((kind, payload)))
+
+
+def alert_created(alert):
+    _publish('alert', alert)
+
+
+def incidents_updated(ids):
+    _publish('incidents', list(ids))
+
+
+def alerts_cleared(count, ids=None):
+    """ids is None when too many alerts were cleared to list them."""
+    _publish('cleared', {'count': count, 'ids': ids})
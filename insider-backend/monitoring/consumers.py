@@ -1,29 +1,258 @@
-# monitoring/consumers.py
+import asyncio
 import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import AnonymousUser
-from channels.auth import login, logout
+from django.conf import settings
+
+from . import audit_tail, event_log, subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+class FilteredConsumer(AsyncWebsocketConsumer):
+    """
+    A socket in one filter group of a stream. The filter comes from the query
+    string and may be replaced with {"type": "subscribe", "filters": {...}}.
+    Subclasses name the stream, its filter module (normalize, group_name,
+    FILTER_KEYS) and whether the unfiltered group is registered too.
+    """
+    stream = None
+    filters = None
+    register_base = False
+    staff_only = False
+
+    def authorized(self, user):
+        return user is not None and not user.is_anonymous and (user.is_staff or not self.staff_only)
+
+    def filter_params(self, params):
+        return {k: v for k, v in params.items() if k in self.filters.FILTER_KEYS}
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or '')
+        except ValueError:
+            return
+        if not isinstance(message, dict) or message.get('type') != 'subscribe':
+            return
+        try:
+            spec = self.filters.normalize(message.get('filters') or {})
+        except subscriptions.InvalidFilter as exc:
+            await self.send(text_data=json.dumps({'type': 'error', 'detail': str(exc)}))
+            return
+        await self.subscribe(spec)
+        await self.send(text_data=json.dumps({'type': 'subscribed', 'filters': spec}))
+
+    async def subscribe(self, spec):
+        group = self.filters.group_name(spec)
+        if group == self.group:
+            return
+        if self.group:
+            await self.leave()
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.group, self.spec = group, spec
+        await self.registry('add', group, spec)
+
+    async def leave(self):
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+        await self.registry('remove', self.group)
+        self.group = None
+
+    async def registry(self, method, group, *args):
+        # unless register_base, the unfiltered group always gets everything and needs no entry
+        if group == self.filters.group_name({}) and not self.register_base:
+            return
+        try:
+            await sync_to_async(getattr(subscriptions.get_registry(self.stream), method))(group, *args)
+        except Exception:
+            logger.warning("Subscription registry unavailable", exc_info=True)
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(subscriptions.REFRESH)
+            if self.group:
+                await self.registry('touch', self.group)
+
+
+class AlertConsumer(FilteredConsumer):
+    """
+    Alert events for the dashboards. A client may filter what it receives,
+    in the query string (ws/alerts/?severity=medium&department=Finance) or by
+    sending {"type": "subscribe", "filters": {...}} at any time; see
+    monitoring.subscriptions for the filter keys.
+
+    A reconnecting client passes the id of the last event it saw
+    (ws/alerts/?last_event_id=...) and is first sent the logged events after
+    it, or {"type": "reset"} when the log no longer goes back that far and it
+    should reload the list over HTTP; see monitoring.event_log.
+
+    Events are queued per connection and written by a separate task, so a slow
+    client never holds up the channel layer. When more than
+    MONITORING_WS_MAX_PENDING events wait, the oldest are dropped and the
+    client gets a {"type": "dropped"} summary of what it missed; it can
+    reconnect with its last event id to have them replayed.
+    """
+    FRAME_EVENTS = 200   # events per websocket frame
+    stream = subscriptions.BASE_GROUP
+    filters = subscriptions
+
+    def filter_params(self, params):
+        return {k: v if k != 'severity' else v[0] for k, v in super().filter_params(params).items()}
 
-class AlertConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # If you want only authenticated users:
         user = self.scope.get('user', None)
-        if user is None or user.is_anonymous:
+        if not self.authorized(user):
             # Optionally accept then close, or reject
             await self.close(code=4001)
             return
 
-        await self.channel_layer.group_add('alerts', self.channel_name)
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            spec = self.filters.normalize(self.filter_params(params))
+        except subscriptions.InvalidFilter:
+            await self.close(code=4400)
+            return
+
+        self.max_pending = getattr(settings, 'MONITORING_WS_MAX_PENDING', 1000)
+        self.replayed_until = None
+        self.group = None
+        self.outbox = deque()
+        self.dropped = Counter()
+        self.ready = asyncio.Event()
+        await self.subscribe(spec)
+        await self.accept()
+        last_event_id = params.get('last_event_id', [None])[0]
+        if last_event_id:
+            # live events sent meanwhile wait in this channel until connect returns
+            await self.replay(last_event_id)
+        self.tasks = [asyncio.create_task(self.write_loop()), asyncio.create_task(self.refresh_loop())]
+
+    async def disconnect(self, close_code):
+        for task in getattr(self, 'tasks', []):
+            task.cancel()
+        if getattr(self, 'group', None):
+            await self.leave()
+
+    async def replay(self, last_event_id):
+        try:
+            entries, complete = await sync_to_async(event_log.get_event_log().after)(last_event_id)
+        except ValueError:
+            entries, complete = [], False
+        except Exception:
+            logger.warning("Alert event log unavailable, cannot replay", exc_info=True)
+            entries, complete = [], False
+        if not complete:
+            await self.send(text_data=json.dumps({'type': 'reset'}))
+            return
+        events = [{**event, 'id': event_id} for event_id, event, context in entries
+                  if context is None or subscriptions.matches(self.spec, context)]
+        for start in range(0, len(events), self.FRAME_EVENTS):
+            await self.send(text_data=json.dumps({'type': 'batch', 'events': events[start:start + self.FRAME_EVENTS]}))
+        if entries:
+            self.replayed_until = event_log.sort_key(entries[-1][0])
+
+    async def alerts_batch(self, event):
+        events = event['events']
+        if self.replayed_until is not None:
+            # skip what the replay already sent
+            events = [e for e in events if 'id' not in e or event_log.sort_key(e['id']) > self.replayed_until]
+            if events:
+                self.replayed_until = None
+        self.outbox.extend(events)
+        while len(self.outbox) > self.max_pending:
+            dropped = self.outbox.popleft()
+            self.dropped[dropped['type']] += 1
+        self.ready.set()
+
+    async def write_loop(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.outbox or self.dropped:
+                if self.dropped:
+                    summary, self.dropped = dict(self.dropped), Counter()
+                    await self.send(text_data=json.dumps({
+                        'type': 'dropped', 'count': sum(summary.values()), 'events': summary,
+                    }))
+                events = [self.outbox.popleft() for _ in range(min(self.FRAME_EVENTS, len(self.outbox)))]
+                if events:
+                    await self.send(text_data=json.dumps({'type': 'batch', 'events': events}))
+
+
+class AuditTailConsumer(FilteredConsumer):
+    """
+    Live tail of the audit log, for staff only. A client may filter by user
+    id, department and action category, in the query string
+    (ws/audit/?category=auth,download&department=Finance) or with a subscribe
+    message; see monitoring.audit_tail.
+
+    Each interval's summary arrives as one frame:
+
+        {"type": "audit.batch", "events": [...], "matched": 48210, "sent": 120,
+         "by_category": {...}, "rate_limited": 80}
+
+    The server has already sampled the events down per filter; on top of that
+    each connection may be sent at most MONITORING_AUDIT_TAIL_RATE events a
+    second on average (a token bucket holding one second's worth), and the
+    events over budget are sampled away and counted in rate_limited. The
+    counts always cover every matching event, sampled or not.
+    """
+    stream = audit_tail.BASE_GROUP
+    filters = audit_tail
+    register_base = True   # the tail only does work while someone watches
+    staff_only = True
+
+    async def connect(self):
+        user = self.scope.get('user', None)
+        if not self.authorized(user):
+            await self.close(code=4003 if user is not None and not user.is_anonymous else 4001)
+            return
+
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            spec = self.filters.normalize(self.filter_params(params))
+        except subscriptions.InvalidFilter:
+            await self.close(code=4400)
+            return
+
+        self.rate = getattr(settings, 'MONITORING_AUDIT_TAIL_RATE', 50)
+        self.tokens = float(self.rate)
+        self.refilled = time.monotonic()
+        self.group = None
+        await self.subscribe(spec)
         await self.accept()
+        self.tasks = [asyncio.create_task(self.refresh_loop())]
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard('alerts', self.channel_name)
+        for task in getattr(self, 'tasks', []):
+            task.cancel()
+        if getattr(self, 'group', None):
+            await self.leave()
+
+    def take(self, wanted):
+        now = time.monotonic()
+        self.tokens = min(float(self.rate), self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
 
-    # Handler for messages sent to group
-    async def alert_created(self, event):
-        # event will contain serialized alert data
+    async def audit_batch(self, event):
+        events = event['events']
+        allowed = self.take(len(events))
+        if allowed < len(events):
+            events = sorted(random.sample(events, allowed), key=lambda e: e['timestamp'])
         await self.send(text_data=json.dumps({
-            'type': 'alert.created',
-            'alert': event['alert'],
+            'type': 'audit.batch',
+            'events': events,
+            'matched': event['matched'],
+            'sent': len(events),
+            'by_category': event['by_category'],
+            'rate_limited': event['sent'] - len(events),
         }))
@@ -0,0 +1,240 @@
+# monitoring/detectors.py
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import timedelta
+from django.db.models import Count, F, Max
+from django.db.models.functions import TruncMinute
+from users import actions
+from users.models import AuditLog
+from monitoring.alerts import bucket_start
+from monitoring.rules import RuleSet, SEQUENCE_RULES
+
+# Detectors are incremental: each run is handed only the AuditLog rows added since
+# its checkpoint plus the JSON state it left behind last time, and returns the
+# Findings for the actors that tripped it. Rows read are added to stats['rows'].
+# A scan calls check_deadline(stats) between rows, so the engine can stop a run
+# that overran stats['deadline'] instead of leaving it behind.
+#
+# A detector declares its inputs (source), its window and the alert it raises
+# (name, severity, description), and joins the engine with @register.
+
+# spec: the detector or rule the alert is raised for (name, severity, description)
+# at:   epoch of the event or bucket that tripped it
+Finding = namedtuple('Finding', 'spec actor_id count at')
+
+REGISTRY = {}
+
+
+class DetectorTimeout(Exception):
+    pass
+
+
+def check_deadline(stats):
+    deadline = stats.get('deadline')
+    if deadline is not None and time.monotonic() > deadline:
+        raise DetectorTimeout()
+
+
+def register(cls):
+    REGISTRY[cls.name] = cls()
+    return cls
+
+def _counts_by_actor(spec, qs, stats):
+    rows = list(qs.filter(actor__isnull=False).values('actor_id')
+                  .annotate(n=Count('id'), last=Max('timestamp')))
+    stats['rows'] += sum(r['n'] for r in rows)
+    check_deadline(stats)
+    return [Finding(spec, r['actor_id'], r['n'], r['last'].timestamp()) for r in rows]
+
+
+class Detector(ABC):
+    name = None              # alert action and checkpoint key
+    severity = 'medium'
+    description = ''
+    window = None            # timedelta; None means the detector needs no history
+    dedupe_window = None     # one alert per user per bucket of this size (default: window, else a day)
+    timeout = None           # seconds; None uses MONITORING_DETECTOR_TIMEOUT
+
+    def __init__(self):
+        if self.dedupe_window is None:
+            self.dedupe_window = self.window or timedelta(days=1)
+
+    def source(self):
+        return AuditLog.objects.all()
+
+    def specs(self):
+        # the alert kinds this detector can raise
+        return [self]
+
+    @abstractmethod
+    def scan(self, qs, state, now, stats):
+        """Findings for the rows of `qs`, carrying what later rows need over in `state`."""
+
+
+class WindowCountDetector(Detector):
+    """
+    Flags actors with more than `threshold` matching rows inside `window`.
+    New rows are grouped into per-minute buckets in SQL; the buckets still inside
+    the window are carried over in the checkpoint state as {actor_id: {epoch: n}}.
+    """
+    threshold = 5
+    bucket_seconds = 60
+
+    @abstractmethod
+    def matches(self, action):
+        """The predicate of source(), applied to a single event by the streaming path."""
+
+    def scan(self, qs, state, now, stats):
+        rows = qs.filter(actor__isnull=False) \
+                 .annotate(bucket=TruncMinute('timestamp')) \
+                 .values('actor_id', 'bucket').annotate(n=Count('id'))
+        touched = {}
+        for r in rows:
+            check_deadline(stats)
+            stats['rows'] += r['n']
+            actor, epoch = str(r['actor_id']), str(int(r['bucket'].timestamp()))
+            buckets = state.setdefault(actor, {})
+            buckets[epoch] = buckets.get(epoch, 0) + r['n']
+            touched.setdefault(actor, set()).add(int(epoch))
+
+        span = self.window.total_seconds()
+        flagged = []
+        for actor, epochs in touched.items():
+            buckets = {int(e): n for e, n in state[actor].items()}
+            reported = set()
+            for epoch in sorted(epochs):
+                # one finding per dedup bucket: a backfill chunk spans many of them
+                if bucket_start(epoch, self.dedupe_window) in reported:
+                    continue
+                total = sum(n for e, n in buckets.items() if epoch - span < e <= epoch)
+                if total > self.threshold:
+                    reported.add(bucket_start(epoch, self.dedupe_window))
+                    flagged.append(Finding(self, int(actor), total, epoch))
+
+        cutoff = now.timestamp() - span - self.bucket_seconds
+        for actor in list(state):
+            state[actor] = {e: n for e, n in state[actor].items() if int(e) > cutoff}
+            if not state[actor]:
+                del state[actor]
+        return flagged
+
+
+@register
+class FailedOtpBruteforce(WindowCountDetector):
+    name = 'otp_failed'
+    severity = 'high'
+    description = "More than 5 failed OTP attempts in last 15 minutes: {count}"
+    window = timedelta(minutes=15)
+
+    def source(self):
+        return AuditLog.objects.filter(action_type=actions.code('otp_failed'))
+
+    def matches(self, action):
+        return action == 'otp_failed'
+
+
+@register
+class RapidLogins(WindowCountDetector):
+    name = 'rapid_login'
+    description = "User {email} logged in more than threshold times in short period"
+    window = timedelta(minutes=10)
+
+    def source(self):
+        return AuditLog.objects.filter(action_type=actions.code('login'))
+
+    def matches(self, action):
+        return action == 'login'
+
+
+@register
+class ExcessiveDownloads(WindowCountDetector):
+    name = 'excessive_downloads'
+    severity = 'high'
+    description = "User {email} downloaded many files in a short period"
+    window = timedelta(minutes=5)
+
+    def source(self):
+        return AuditLog.objects.filter(action_type__in=actions.codes(actions.DOWNLOAD))
+
+    def matches(self, action):
+        return actions.category(action) == actions.DOWNLOAD
+
+
+@register
+class ExcessiveDeletes(WindowCountDetector):
+    name = 'excessive_deletes'
+    severity = 'high'
+    description = "User {email} deleted many resources in a short period"
+    window = timedelta(minutes=10)
+
+    def source(self):
+        return AuditLog.objects.filter(action_type__in=actions.codes(actions.DELETE))
+
+    def matches(self, action):
+        return actions.category(action) == actions.DELETE
+
+
+@register
+class UnusualHoursLogin(Detector):
+    name = 'unusual_login_hour'
+    description = "User {email} logged in during unusual hours"
+    start_hour, end_hour = 0, 6
+
+    def source(self):
+        return AuditLog.objects.filter(action_type=actions.code('login'), timestamp__hour__gte=self.start_hour,
+                                       timestamp__hour__lt=self.end_hour)
+
+    def scan(self, qs, state, now, stats):
+        return _counts_by_actor(self, qs, stats)
+
+
+@register
+class UnauthorizedAccess(Detector):
+    name = 'unauthorized_access'
+    severity = 'high'
+    description = "User {email} accessed resource outside allowed scope"
+
+    def source(self):
+        # reading or downloading a resource owned by another department
+        return AuditLog.objects.filter(action_type__in=actions.codes(actions.READ, actions.DOWNLOAD),
+                                       actor__department__isnull=False,
+                                       resource__department__isnull=False) \
+                               .exclude(actor__department_id=F('resource__department_id'))
+
+    def scan(self, qs, state, now, stats):
+        return _counts_by_actor(self, qs, stats)
+
+
+@register
+class SequenceRules(Detector):
+    """
+    Runs every rule in monitoring.rules.SEQUENCE_RULES in one ordered pass over
+    the new rows; partial matches are carried over in the checkpoint state.
+    """
+    name = 'sequence_rules'
+    ruleset = RuleSet(SEQUENCE_RULES)
+    window = ruleset.window
+
+    def specs(self):
+        return self.ruleset.rules
+
+    def scan(self, qs, state, now, stats):
+        fields = ['actor_id', 'action_type_id', 'timestamp']
+        if self.ruleset.needs_context:
+            fields += ['actor__department_id', 'resource__department_id']
+        rows = qs.filter(actor__isnull=False).order_by('id').values_list(*fields)
+        names = actions.names()
+        flagged = []
+        for row in rows.iterator(chunk_size=2000):
+            check_deadline(stats)
+            stats['rows'] += 1
+            actor_id, code, ts = row[:3]
+            action = names[code]
+            cross = len(row) > 3 and None not in row[3:] and row[3] != row[4]
+            epoch = ts.timestamp()
+            for rule in self.ruleset.feed(state, actor_id, action, epoch, cross):
+                flagged.append(Finding(rule, actor_id, 1, epoch))
+        self.ruleset.prune(state, now.timestamp())
+        return flagged
+
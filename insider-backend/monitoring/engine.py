@@ -0,0 +1,255 @@
+# monitoring/engine.py
+"""
+Detection engine: runs the registered detectors concurrently on a thread pool,
+each against its own checkpoint, then writes every alert and checkpoint in one
+transaction and records a DetectorRun per detector (wall time, rows scanned,
+alerts created, status).
+
+A detector that exceeds its timeout stops at its next deadline check (and on
+PostgreSQL, a statement that overruns is cancelled by statement_timeout). Its
+checkpoint is not advanced, so the same rows are picked up again on the next
+run. The pass waits for every worker thread, so a stopped detector never runs
+alongside its next pass. The timeout counts from when the detector starts
+running; time queued behind other detectors for a pool thread is not its own.
+
+The watermark is the highest id seen, but ids below it may still be in flight:
+on PostgreSQL concurrent writers (the buffered flusher, ingest, the tailer)
+commit out of id order. The ids missing from a scanned range are therefore
+kept in the checkpoint as pending ranges and scanned on later passes once
+they commit. An id still missing after GAP_GRACE seconds belonged to a
+rolled-back insert and is given up.
+"""
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from monitoring.detectors import REGISTRY, DetectorTimeout
+from monitoring.alerts import broadcast_new_alerts, dedup_key, upsert_alerts
+from monitoring.models import Alert, DetectorCheckpoint, DetectorRun
+from users import actions
+from users.models import AuditLog
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# Each run only reads AuditLog rows past the detector's watermark, capped so that
+# catching up after downtime is spread over several runs instead of one huge pass.
+MAX_IDS_PER_RUN = 100_000
+RUN_HISTORY_DAYS = 7
+GAP_GRACE = 600
+MAX_PENDING_RANGES = 100
+
+
+def _bootstrap_watermark(detector, now):
+    # a new detector starts at its window; windowless detectors start at the beginning
+    if detector.window is None:
+        return 0
+    first = AuditLog.objects.filter(timestamp__gte=now - detector.window) \
+                            .order_by('id').values_list('id', flat=True).first()
+    return first - 1 if first else AuditLog.objects.aggregate(m=Max('id'))['m'] or 0
+
+
+def _ranges_q(ranges):
+    q = Q()
+    for first, last in ranges:
+        q |= Q(id__gte=first, id__lte=last)
+    return q
+
+
+def _absent(first, last, pending):
+    """
+    The id ranges ([first, last], inclusive) with no visible AuditLog row, out
+    of the new range first..last and the pending ranges of earlier passes.
+    """
+    absent = []
+
+    def walk(ranges, ids):
+        ids = iter(ids)
+        current = next(ids, None)
+        for lo, hi in ranges:
+            expected = lo
+            while current is not None and current <= hi:
+                if current > expected:
+                    absent.append([expected, current - 1])
+                expected = current + 1
+                current = next(ids, None)
+            if expected <= hi:
+                absent.append([expected, hi])
+
+    if pending:
+        walk(pending, AuditLog.objects.filter(_ranges_q(pending)).order_by('id').values_list('id', flat=True))
+    if last >= first:
+        new = AuditLog.objects.filter(id__gte=first, id__lte=last)
+        if new.count() != last - first + 1:   # usually no holes: one index-only count
+            walk([[first, last]], new.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000))
+    return absent
+
+
+def _limit_statements(seconds):
+    # the setting lives as long as the pool thread's connection, closed after the job
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('statement_timeout', %s, false)", [str(int(seconds * 1000))])
+
+
+def _timed_out(exc):
+    if isinstance(exc, DetectorTimeout):
+        return True
+    # PostgreSQL query_canceled, raised when statement_timeout fires
+    cause = exc.__cause__
+    return isinstance(exc, OperationalError) and \
+        (getattr(cause, 'pgcode', None) or getattr(cause, 'sqlstate', None)) == '57014'
+
+
+def write_alerts(findings):
+    """findings: [Finding] -> the Alerts actually inserted (one per user and dedup bucket)"""
+    user_ids = {f.actor_id for f in findings}
+    if not user_ids:
+        return []
+    users = User.objects.in_bulk(user_ids)
+    return upsert_alerts([
+        Alert(user=users[f.actor_id], action=f.spec.name, severity=f.spec.severity,
+              description=f.spec.description.format(email=users[f.actor_id].email, count=f.count),
+              dedup_key=dedup_key(f.spec.name, f.actor_id, f.at, f.spec.dedupe_window))
+        for f in findings if f.actor_id in users
+    ])
+
+
+def scan_range(detector, start, end):
+    """
+    Re-run a detector over [start, end) with fresh state, as a backfill does.
+    Rows from one window before `start` only warm up the state; findings are
+    reported for events inside the range.
+    """
+    stats = {'rows': 0}
+    state = {}
+    if detector.window is not None:
+        warmup = detector.source().filter(timestamp__gte=start - detector.window, timestamp__lt=start)
+        detector.scan(warmup, state, start, stats)
+    qs = detector.source().filter(timestamp__gte=start, timestamp__lt=end)
+    findings = detector.scan(qs, state, end, stats)
+    return findings, stats['rows']
+
+
+class _Job:
+    def __init__(self, detector, checkpoint, upper, limit):
+        self.detector = detector
+        self.checkpoint = checkpoint
+        self.upper = upper
+        self.limit = limit
+        self.stats = {'rows': 0}
+        self.findings = []
+        self.started = None
+        self.wall_ms = 0.0
+        self.status = 'ok'
+        self.error = ''
+        self.pending = checkpoint.pending_ids
+
+    def __call__(self, now):
+        self.started = time.monotonic()
+        self.stats['deadline'] = self.started + self.limit
+        try:
+            _limit_statements(self.limit)
+            cp = self.checkpoint
+            pending = [r[:2] for r in cp.pending_ids]
+            targets = pending + ([[cp.last_log_id + 1, self.upper]] if self.upper > cp.last_log_id else [])
+            if targets:
+                # holes are found before the scan: a row committing in between is
+                # then scanned next pass rather than both now and next pass
+                absent = _absent(cp.last_log_id + 1, self.upper, pending)
+                qs = self.detector.source().filter(_ranges_q(targets))
+                if absent:
+                    qs = qs.exclude(_ranges_q(absent))
+                self.findings = self.detector.scan(qs, cp.state, now, self.stats)
+                self.pending = self.still_pending(absent, now.timestamp())
+        finally:
+            self.wall_ms = (time.monotonic() - self.started) * 1000
+            connection.close()   # each pool thread holds its own connection
+        return self
+
+    def still_pending(self, absent, now):
+        kept = []
+        for first, last in absent:
+            # a hole inside an earlier pending range keeps that range's age
+            at = next((t for lo, hi, t in self.checkpoint.pending_ids if lo <= first <= hi), now)
+            if now - at < GAP_GRACE:
+                kept.append([first, last, at])
+        return kept[-MAX_PENDING_RANGES:]
+
+
+def run_detectors(names=None, workers=None, timeout=None, broadcast=True):
+    """Run the registered detectors (or just `names`) once; return the new alerts."""
+    now = timezone.now()
+    started_at = now
+    workers = workers or getattr(settings, 'MONITORING_DETECTION_WORKERS', 4)
+    default_timeout = timeout or getattr(settings, 'MONITORING_DETECTOR_TIMEOUT', 30)
+    detectors = [REGISTRY[n] for n in names] if names else list(REGISTRY.values())
+
+    high = AuditLog.objects.aggregate(m=Max('id'))['m'] or 0
+    # after reading `high`: every action of a committed row up to it is registered by now
+    actions.reload()
+    checkpoints = {c.detector: c for c in DetectorCheckpoint.objects.filter(
+        detector__in=[d.name for d in detectors])}
+
+    jobs = []
+    for detector in detectors:
+        cp = checkpoints.get(detector.name)
+        if cp is None:
+            cp = DetectorCheckpoint(detector=detector.name,
+                                    last_log_id=_bootstrap_watermark(detector, now))
+        jobs.append(_Job(detector, cp, min(high, cp.last_log_id + MAX_IDS_PER_RUN),
+                         detector.timeout or default_timeout))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detector') as pool:
+        futures = {pool.submit(job, now): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            exc = future.exception()
+            if exc is None:
+                continue
+            if _timed_out(exc):
+                job.status = 'timeout'
+                logger.error("Detector %s timed out after %ss", job.detector.name, job.limit)
+            else:
+                job.status = 'error'
+                job.error = ''.join(traceback.format_exception(exc))
+                logger.error("Detector %s failed: %s", job.detector.name, exc)
+
+    finished = [job for job in jobs if job.status == 'ok']
+    for job in finished:
+        job.checkpoint.last_log_id = max(job.checkpoint.last_log_id, job.upper)
+        job.checkpoint.last_timestamp = now
+        job.checkpoint.pending_ids = job.pending
+
+    with transaction.atomic():
+        created = write_alerts([f for job in finished for f in job.findings])
+        DetectorCheckpoint.objects.bulk_create([j.checkpoint for j in finished if j.checkpoint.pk is None])
+        DetectorCheckpoint.objects.bulk_update([j.checkpoint for j in finished if j.checkpoint.pk is not None],
+                                               ['last_log_id', 'last_timestamp', 'state', 'pending_ids'])
+
+        raised_by = {}
+        for job in finished:
+            for f in job.findings:
+                raised_by[f.spec.name] = job.detector.name
+        per_detector = {}
+        for alert in created:
+            name = raised_by.get(alert.action)
+            per_detector[name] = per_detector.get(name, 0) + 1
+        DetectorRun.objects.bulk_create([DetectorRun(
+            detector=job.detector.name, started_at=started_at, wall_ms=job.wall_ms,
+            rows_scanned=job.stats['rows'], alerts_created=per_detector.get(job.detector.name, 0),
+            status=job.status, error=job.error,
+        ) for job in jobs])
+        DetectorRun.objects.filter(started_at__lt=now - timedelta(days=RUN_HISTORY_DAYS)).delete()
+
+    for alert in created:
+        logger.warning(f"Alert created for user {alert.user.email} - {alert.action}")
+    if broadcast:
+        broadcast_new_alerts(created)
+    return created
@@ -0,0 +1,103 @@
+# monitoring/event_log.py
+"""
+Bounded, ordered log of the alert events sent to the websocket, so that a
+client that reconnects can be sent only what it missed.
+
+monitoring.broadcast appends every flushed batch before sending it, and each
+event carries the id it got here. A client reconnects with
+ws/alerts/?last_event_id=<id>; AlertConsumer replays the logged events after
+that id that pass its filter, then goes on with live events. If the log no
+longer reaches back to that id, the client is told to reload instead.
+
+The log keeps the newest MONITORING_EVENT_LOG_SIZE events, in one of two
+backends:
+  memory  this process only (consumers and broadcaster in one process)
+  redis   a Redis stream trimmed with MAXLEN, shared by every process (default)
+Event ids are opaque to clients; sort_key() orders them.
+"""
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def sort_key(event_id):
+    """'5' (memory) or '1767225600000-3' (redis stream) -> comparable tuple; ValueError if malformed."""
+    return tuple(int(part) for part in str(event_id).split('-', 1))
+
+
+class MemoryEventLog:
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=size)   # (id, event, context)
+        self._next = 1
+
+    def append(self, items):
+        """Log [(event, context)] and return their ids, in order."""
+        with self._lock:
+            ids = [str(n) for n in range(self._next, self._next + len(items))]
+            self._next += len(items)
+            self._entries.extend((i, event, context) for i, (event, context) in zip(ids, items))
+        return ids
+
+    def after(self, last_id):
+        """([(id, event, context)] newer than last_id, whether the log still reaches back that far)."""
+        last = sort_key(last_id)[0]
+        with self._lock:
+            if last >= self._next:
+                return [], False   # an id from before this process started
+            first = int(self._entries[0][0]) if self._entries else self._next
+            if first > last + 1:
+                return [], False
+            return [e for e in self._entries if int(e[0]) > last], True
+
+
+class RedisEventLog:
+    KEY = 'monitoring:events'
+
+    def __init__(self, url, size):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self.size = size
+
+    def append(self, items):
+        pipe = self._redis.pipeline(transaction=False)
+        for event, context in items:
+            pipe.xadd(self.KEY, {'e': json.dumps([event, context], cls=DjangoJSONEncoder)},
+                      maxlen=self.size, approximate=True)
+        return [i.decode() for i in pipe.execute()]
+
+    def after(self, last_id):
+        ms, seq = (sort_key(last_id) + (0,))[:2]
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.xrange(self.KEY, '-', '+', count=1)
+        pipe.xrange(self.KEY, f'({ms}-{seq}', '+', count=self.size)
+        oldest, newer = pipe.execute()
+        # stream ids are not contiguous: once last_id itself has been trimmed, assume a gap
+        if not oldest or sort_key(oldest[0][0].decode()) > (ms, seq):
+            return [], False
+        entries = []
+        for entry_id, fields in newer:
+            event, context = json.loads(fields[b'e'])
+            entries.append((entry_id.decode(), event, context))
+        return entries, True
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_event_log():
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                size = getattr(settings, 'MONITORING_EVENT_LOG_SIZE', 10000)
+                if getattr(settings, 'MONITORING_EVENT_LOG_BACKEND', 'redis') == 'redis':
+                    _log = RedisEventLog(getattr(settings, 'MONITORING_EVENT_LOG_REDIS_URL',
+                                                 'redis://localhost:6379/0'), size)
+                else:
+                    _log = MemoryEventLog(size)
+    return _log
@@ -0,0 +1,187 @@
+# monitoring/incidents.py
+"""
+Incident correlation: alerts for the same user that arrive close together are
+grouped into one Incident, so triage, the websocket and the dashboard deal
+with one item per burst instead of one per detector finding.
+
+correlate() runs right after alerts are inserted (upsert_alerts for the bulk
+writers, the Alert post_save signal otherwise). An alert joins the user's open
+incident when it is at most MONITORING_INCIDENT_WINDOW seconds after the
+incident's last alert; otherwise it opens a new incident.
+
+Open incidents are looked up in an in-process index (user id -> incident id,
+last alert time), so a burst of alerts for a user costs no incident SELECT
+after the first. The database stays the source of truth: the index only
+remembers incidents it has seen, a miss falls back to one query for all missed
+users, and an entry whose incident was closed or rolled back elsewhere is
+noticed when its guarded UPDATE matches no row, then dropped.
+
+Two workers correlating alerts for the same user at once would both miss and
+both open an incident, so correlate() first locks the users' rows (SELECT ...
+FOR NO KEY UPDATE, in id order) until its transaction ends; the second worker
+then finds the incident the first one opened. The lock does not conflict with
+the FOR KEY SHARE locks taken by inserts referencing the user (audit rows,
+alerts), so those keep going while it is held.
+"""
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from monitoring.models import Alert, Incident
+from users.models import User
+
+SEVERITY_RANK = {'low': 0, 'medium': 1, 'high': 2}
+MAX_INDEXED = 50000   # users kept in the index before expired entries are pruned
+
+
+def _window():
+    return timedelta(seconds=getattr(settings, 'MONITORING_INCIDENT_WINDOW', 1800))
+
+
+def _severity(*severities):
+    return max(severities, key=lambda s: SEVERITY_RANK.get(s, 0))
+
+
+class OpenIncidents:
+    """user id -> (incident id, last_seen) for recently active open incidents."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, user_id):
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def put(self, user_id, incident_id, last_seen):
+        with self._lock:
+            if len(self._entries) >= MAX_INDEXED and user_id not in self._entries:
+                cutoff = timezone.now() - _window()
+                self._entries = {u: e for u, e in self._entries.items() if e[1] >= cutoff}
+            self._entries[user_id] = (incident_id, last_seen)
+
+    def discard(self, user_id, incident_id=None):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and incident_id in (None, entry[0]):
+                del self._entries[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+index = OpenIncidents()
+
+
+def _lookup(users, since):
+    """The latest open incident active since `since` for each of users, from the database."""
+    found = {}
+    rows = (Incident.objects.filter(user_id__in=users, status='open', last_seen__gte=since)
+            .order_by('user_id', '-last_seen').values_list('user_id', 'pk', 'last_seen'))
+    for user_id, pk, last_seen in rows:
+        found.setdefault(user_id, (pk, last_seen))
+    return found
+
+
+def _extend(incident_id, alerts):
+    """Add alerts to an open incident; False if it is no longer open (or no longer exists)."""
+    severity = _severity(*(a.severity for a in alerts))
+    if severity == 'high':
+        raise_to = Value('high')
+    elif severity == 'medium':
+        raise_to = Case(When(severity='high', then=Value('high')), default=Value('medium'))
+    else:
+        raise_to = F('severity')
+    return bool(Incident.objects.filter(pk=incident_id, status='open').update(
+        alert_count=F('alert_count') + len(alerts),
+        last_seen=Greatest(F('last_seen'), Value(alerts[-1].timestamp)),
+        severity=raise_to,
+    ))
+
+
+def correlate(alerts):
+    """
+    Attach saved alerts to incidents. Sets alert.incident_id on each and
+    alert.opened_incident on the first alert of every new incident; returns
+    {incident id: [alerts]}.
+    """
+    if not alerts or not getattr(settings, 'MONITORING_INCIDENT_CORRELATION', True):
+        return {}
+    by_user = defaultdict(list)
+    for alert in alerts:
+        by_user[alert.user_id].append(alert)
+    with transaction.atomic():
+        list(User.objects.select_for_update(no_key=True).filter(pk__in=by_user).order_by('pk')
+             .values_list('pk', flat=True))
+        return _correlate(by_user, _window())
+
+
+def _correlate(by_user, window):
+    current = {}
+    for user_id, items in by_user.items():
+        items.sort(key=lambda a: (a.timestamp, a.pk))
+        entry = index.get(user_id)
+        if entry is not None and items[0].timestamp - entry[1] <= window:
+            current[user_id] = entry
+    missed = [u for u in by_user if u not in current]
+    if missed:
+        since = min(by_user[u][0].timestamp for u in missed) - window
+        for user_id, entry in _lookup(missed, since).items():
+            if by_user[user_id][0].timestamp - entry[1] <= window:
+                current[user_id] = entry
+
+    # split each user's alerts into runs: (incident id or None for a new one, alerts)
+    runs = []
+    for user_id, items in by_user.items():
+        incident_id, last_seen = current.get(user_id, (None, None))
+        run = []
+        for alert in items:
+            if run and alert.timestamp - last_seen > window:
+                runs.append((user_id, incident_id, run))
+                incident_id, run = None, []
+            run.append(alert)
+            last_seen = alert.timestamp if last_seen is None else max(last_seen, alert.timestamp)
+        runs.append((user_id, incident_id, run))
+
+    stale = [(u, i, run) for u, i, run in runs if i is not None and not _extend(i, run)]
+    for user_id, incident_id, _ in stale:
+        index.discard(user_id, incident_id)
+    fresh = [(u, run) for u, i, run in runs if i is None] + [(u, run) for u, _, run in stale]
+    created = Incident.objects.bulk_create([
+        Incident(user_id=user_id, first_seen=run[0].timestamp, last_seen=run[-1].timestamp,
+                 alert_count=len(run), severity=_severity(*(a.severity for a in run)))
+        for user_id, run in fresh
+    ])
+    stale_ids = {id(run) for _, _, run in stale}
+    attached = {i: run for _, i, run in runs if i is not None and id(run) not in stale_ids}
+    for incident, (_, run) in zip(created, fresh):
+        attached[incident.pk] = run
+        run[0].opened_incident = True
+
+    for incident_id, run in attached.items():
+        Alert.objects.filter(pk__in=[a.pk for a in run]).update(incident_id=incident_id)
+        for alert in run:
+            alert.incident_id = incident_id
+        entry = index.get(run[0].user_id)
+        if entry is None or entry[1] <= run[-1].timestamp:
+            index.put(run[0].user_id, incident_id, run[-1].timestamp)
+    return attached
+
+
+def close(incident):
+    """Close an incident, clear its open alerts, and stop correlating into it."""
+    from monitoring.alerts import clear_alerts
+
+    with transaction.atomic():
+        Incident.objects.filter(pk=incident.pk).update(status='closed', closed_at=timezone.now())
+        cleared = clear_alerts(incident.alerts.all())
+    index.discard(incident.user_id, incident.pk)
+    incident.refresh_from_db()
+    return cleared
@@ -0,0 +1,365 @@
+# monitoring/kpis.py
+"""
+Counters behind the dashboard summary.
+
+The summary (open alerts by severity, alerts and audit events in the last
+24 hours, total events, riskiest users) is read from counters, never from the
+tables, so it costs the same at any data volume. The counters move with the
+writes:
+  alerts_created()  from upsert_alerts and the Alert post_save signal
+  alert_cleared()   from the Alert post_save signal when cleared flips
+  events_written()  from the audit writers and the bulk ingest path
+Recent activity is kept in BUCKET-sized time buckets and the last 24 hours
+are the sum of the newest buckets.
+
+reconcile() recomputes everything from the database and replaces the
+counters, so anything a counter missed (a queryset.update, a crashed worker)
+heals on its own. Increments made while it reads the database are journaled
+and applied again on top of the new values instead of being overwritten; one
+whose write committed during the read may be counted twice until the next run.
+Celery beat runs it every few minutes. summary() never runs it on the request
+path: counters that were never reconciled or are stale are served as they are,
+flagged 'stale', and a reconcile is queued for the worker. Counters that
+cannot be read at all (Redis is down) are served as empty and stale.
+
+Two backends hold the counters:
+  redis   shared by every web and Celery process (default)
+  memory  this process only, for a single worker and the tests
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BUCKET = 300            # seconds per activity bucket
+DAY = 24 * 3600
+SEVERITY_WEIGHT = {'low': 1, 'medium': 3, 'high': 5}
+TOP_USERS = 10
+
+
+def _bucket(epoch):
+    return int(epoch // BUCKET) * BUCKET
+
+
+def _window(now):
+    """Bucket starts covering the 24 hours up to now."""
+    last = _bucket(now)
+    return list(range(last - DAY + BUCKET, last + BUCKET, BUCKET))
+
+
+class MemoryCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._journal = None   # increments since begin(), while a reconcile reads
+        self.reset()
+
+    def begin(self):
+        with self._lock:
+            self._journal = []
+
+    def reset(self, state=None):
+        state = state or {}
+        with self._lock:
+            self._open = Counter(state.get('open', {}))
+            self._risk = Counter(state.get('risk', {}))
+            self._alerts = Counter(state.get('alerts', {}))
+            self._events = Counter(state.get('events', {}))
+            self._total = state.get('events_total', 0)
+            self._reconciled = state.get('reconciled_at')
+            journal, self._journal = self._journal or [], None
+            for kind, args in journal:
+                getattr(self, f'_add_{kind}')(*args)
+
+    def add_alerts(self, open_by_severity, risk_by_user, by_bucket):
+        with self._lock:
+            self._add_alerts(open_by_severity, risk_by_user, by_bucket)
+            if self._journal is not None:
+                self._journal.append(('alerts', (open_by_severity, risk_by_user, by_bucket)))
+
+    def _add_alerts(self, open_by_severity, risk_by_user, by_bucket):
+        self._open.update(open_by_severity)
+        self._risk.update(risk_by_user)
+        self._alerts.update(by_bucket)
+
+    def add_events(self, by_bucket):
+        with self._lock:
+            self._add_events(by_bucket)
+            if self._journal is not None:
+                self._journal.append(('events', (by_bucket,)))
+
+    def _add_events(self, by_bucket):
+        self._events.update(by_bucket)
+        self._total += sum(by_bucket.values())
+
+    def read(self, now):
+        window = _window(now)
+        with self._lock:
+            for counter in (self._alerts, self._events):
+                for stale in [b for b in counter if b < window[0]]:
+                    del counter[stale]
+            return {
+                'open': {s: n for s, n in self._open.items() if n},
+                'alerts_24h': sum(self._alerts[b] for b in window),
+                'events_24h': sum(self._events[b] for b in window),
+                'events_total': self._total,
+                'top': [(u, s) for u, s in self._risk.most_common(TOP_USERS) if s > 0],
+                'reconciled_at': self._reconciled,
+            }
+
+
+class RedisCounters:
+    PREFIX = 'monitoring:kpi:'
+    JOURNAL_TTL = 600   # a reconcile that dies half way stops journaling after this long
+    # push the increment onto the journal only while a reconcile has begun
+    JOURNAL_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('rpush', KEYS[2], ARGV[1])
+    redis.call('expire', KEYS[2], ARGV[2])
+end"""
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self._journal = self._redis.register_script(self.JOURNAL_SCRIPT)
+
+    def _key(self, name):
+        return self.PREFIX + name
+
+    def begin(self):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key('journal'))
+        pipe.set(self._key('reconciling'), 1, ex=self.JOURNAL_TTL)
+        pipe.execute()
+
+    def _record(self, pipe, kind, *args):
+        entry = json.dumps([kind, [{str(k): v for k, v in arg.items()} for arg in args]])
+        self._journal(keys=[self._key('reconciling'), self._key('journal')],
+                      args=[entry, self.JOURNAL_TTL], client=pipe)
+
+    def reset(self, state):
+        pipe = self._redis.pipeline()   # MULTI/EXEC: readers never see half a reset
+        # take the journal in the same transaction, then apply it on top of the new values
+        pipe.lrange(self._key('journal'), 0, -1)
+        pipe.delete(self._key('journal'), self._key('reconciling'))
+        for name in ('open', 'risk', 'events_total', 'reconciled_at'):
+            pipe.delete(self._key(name))
+        if state['open']:
+            pipe.hset(self._key('open'), mapping=state['open'])
+        if state['risk']:
+            pipe.zadd(self._key('risk'), state['risk'])
+        pipe.set(self._key('events_total'), state['events_total'])
+        for kind in ('alerts', 'events'):
+            for bucket in _window(time.time()):
+                pipe.set(self._key(f'{kind}:{bucket}'), state[kind].get(bucket, 0), ex=DAY + BUCKET)
+        pipe.set(self._key('reconciled_at'), state['reconciled_at'])
+        for kind, args in (json.loads(entry) for entry in pipe.execute()[0]):
+            if kind == 'alerts':
+                open_, risk, buckets = args
+                self.add_alerts(open_, {int(u): n for u, n in risk.items()},
+                                {int(b): n for b, n in buckets.items()})
+            else:
+                self.add_events({int(b): n for b, n in args[0].items()})
+
+    def add_alerts(self, open_by_severity, risk_by_user, by_bucket):
+        pipe = self._redis.pipeline(transaction=False)
+        for severity, n in open_by_severity.items():
+            pipe.hincrby(self._key('open'), severity, n)
+        for user_id, score in risk_by_user.items():
+            pipe.zincrby(self._key('risk'), score, user_id)
+        for bucket, n in by_bucket.items():
+            pipe.incrby(self._key(f'alerts:{bucket}'), n)
+            pipe.expire(self._key(f'alerts:{bucket}'), DAY + BUCKET)
+        if any(score < 0 for score in risk_by_user.values()):
+            pipe.zremrangebyscore(self._key('risk'), '-inf', 0)
+        self._record(pipe, 'alerts', open_by_severity, risk_by_user, by_bucket)
+        pipe.execute()
+
+    def add_events(self, by_bucket):
+        pipe = self._redis.pipeline(transaction=False)
+        for bucket, n in by_bucket.items():
+            pipe.incrby(self._key(f'events:{bucket}'), n)
+            pipe.expire(self._key(f'events:{bucket}'), DAY + BUCKET)
+        pipe.incrby(self._key('events_total'), sum(by_bucket.values()))
+        self._record(pipe, 'events', by_bucket)
+        pipe.execute()
+
+    def read(self, now):
+        window = _window(now)
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hgetall(self._key('open'))
+        pipe.mget([self._key(f'alerts:{b}') for b in window])
+        pipe.mget([self._key(f'events:{b}') for b in window])
+        pipe.get(self._key('events_total'))
+        pipe.zrevrange(self._key('risk'), 0, TOP_USERS - 1, withscores=True)
+        pipe.get(self._key('reconciled_at'))
+        open_, alerts, events, total, top, reconciled = pipe.execute()
+        return {
+            'open': {k.decode(): int(v) for k, v in open_.items() if int(v)},
+            'alerts_24h': sum(int(v) for v in alerts if v),
+            'events_24h': sum(int(v) for v in events if v),
+            'events_total': int(total or 0),
+            'top': [(int(u), s) for u, s in top if s > 0],
+            'reconciled_at': float(reconciled) if reconciled else None,
+        }
+
+
+_counters = None
+_counters_lock = threading.Lock()
+
+
+def get_counters():
+    global _counters
+    if _counters is None:
+        with _counters_lock:
+            if _counters is None:
+                if getattr(settings, 'MONITORING_KPI_BACKEND', 'redis') == 'redis':
+                    _counters = RedisCounters(getattr(settings, 'MONITORING_KPI_REDIS_URL',
+                                                      'redis://localhost:6379/0'))
+                else:
+                    _counters = MemoryCounters()
+    return _counters
+
+
+def _safely(fn, *args):
+    # counters are advisory: a failure here must never break the write it follows
+    try:
+        fn(*args)
+    except Exception:
+        logger.warning("KPI counter update failed", exc_info=True)
+
+
+def alerts_created(alerts):
+    """Count newly inserted alerts once the surrounding transaction commits."""
+    open_, risk, buckets = Counter(), Counter(), Counter()
+    for a in alerts:
+        buckets[_bucket(a.timestamp.timestamp())] += 1
+        if not a.cleared:
+            open_[a.severity] += 1
+            risk[a.user_id] += SEVERITY_WEIGHT.get(a.severity, 1)
+    if buckets:
+        transaction.on_commit(lambda: _safely(get_counters().add_alerts, open_, risk, buckets))
+
+
+def alert_cleared(alert, cleared=True):
+    """An open alert was cleared (or a cleared one reopened, with cleared=False)."""
+    sign = -1 if cleared else 1
+    open_ = {alert.severity: sign}
+    risk = {alert.user_id: sign * SEVERITY_WEIGHT.get(alert.severity, 1)}
+    transaction.on_commit(lambda: _safely(get_counters().add_alerts, open_, risk, {}))
+
+
+def alerts_cleared(groups, cleared):
+    """A bulk clear: groups are (severity, user_id, count) of the open alerts it matched."""
+    open_, risk = Counter(), Counter()
+    for severity, user_id, n in groups:
+        open_[severity] -= n
+        risk[user_id] -= n * SEVERITY_WEIGHT.get(severity, 1)
+    if sum(n for _, _, n in groups) != cleared:
+        # alerts changed between the count and the UPDATE; recount rather than guess
+        transaction.on_commit(lambda: _safely(reconcile))
+    elif cleared:
+        transaction.on_commit(lambda: _safely(get_counters().add_alerts, open_, risk, {}))
+
+
+def events_written(timestamps):
+    buckets = Counter(_bucket(t.timestamp()) for t in timestamps)
+    if buckets:
+        transaction.on_commit(lambda: _safely(get_counters().add_events, buckets))
+
+
+def reconcile(now=None):
+    """Recompute every counter from the database and replace the stored values."""
+    from monitoring.models import Alert, AuditArchive
+    from users.models import AuditLog
+
+    now = now or timezone.now()
+    since = datetime.fromtimestamp(_window(now.timestamp())[0], tz=dt_timezone.utc)
+    counters = get_counters()
+    counters.begin()
+
+    open_alerts = Alert.objects.filter(cleared=False)
+    open_ = dict(open_alerts.values_list('severity').annotate(n=Count('id')).order_by())
+    risk = defaultdict(int)
+    for user_id, severity, n in (open_alerts.values_list('user_id', 'severity')
+                                 .annotate(n=Count('id')).order_by()):
+        risk[user_id] += n * SEVERITY_WEIGHT.get(severity, 1)
+
+    def by_bucket(timestamps):
+        return dict(Counter(_bucket(t.timestamp()) for t in timestamps))
+
+    alerts = by_bucket(Alert.objects.filter(timestamp__gte=since).values_list('timestamp', flat=True)
+                       .iterator(chunk_size=5000))
+    # group raw events per minute in the database, then fold minutes into buckets
+    events = Counter()
+    for minute, n in (AuditLog.objects.filter(timestamp__gte=since).annotate(m=TruncMinute('timestamp'))
+                      .values_list('m').annotate(n=Count('id')).order_by()):
+        events[_bucket(minute.timestamp())] += n
+    archived = AuditArchive.objects.aggregate(n=Sum('rows'))['n'] or 0
+
+    state = {
+        'open': open_,
+        'risk': dict(risk),
+        'alerts': alerts,
+        'events': dict(events),
+        'events_total': AuditLog.objects.count() + archived,
+        'reconciled_at': time.time(),
+    }
+    counters.reset(state)
+    return state
+
+
+def _request_reconcile(max_age):
+    # at most one request per max_age across all processes, and never a wait on the database
+    cache = caches['monitoring' if 'monitoring' in settings.CACHES else 'default']
+    try:
+        if not cache.add('monitoring:kpi:reconcile_requested', True, timeout=max_age):
+            return
+    except Exception:
+        # without the cache every request would queue one; the beat schedule still runs it
+        logger.warning("Could not queue a KPI reconcile", exc_info=True)
+        return
+    try:
+        from monitoring.tasks import reconcile_kpis_task
+        reconcile_kpis_task.delay()
+    except Exception:
+        logger.warning("Could not queue a KPI reconcile", exc_info=True)
+
+
+def summary(now=None):
+    """The dashboard summary, from the counters; flagged 'stale' when they are missing or stale."""
+    from users.models import User
+
+    now = now or timezone.now()
+    try:
+        data = get_counters().read(now.timestamp())
+    except Exception:
+        logger.warning("KPI counters unavailable, serving empty ones", exc_info=True)
+        data = MemoryCounters().read(now.timestamp())
+    max_age = 2 * getattr(settings, 'MONITORING_KPI_RECONCILE_SECONDS', 300)
+    stale = data['reconciled_at'] is None or time.time() - data['reconciled_at'] > max_age
+    if stale:
+        _request_reconcile(max_age)
+
+    emails = dict(User.objects.filter(pk__in=[u for u, _ in data['top']]).values_list('pk', 'email'))
+    open_ = {s: data['open'].get(s, 0) for s in SEVERITY_WEIGHT}
+    return {
+        'open_alerts': {**open_, 'total': sum(open_.values())},
+        'alerts_24h': data['alerts_24h'],
+        'events_24h': data['events_24h'],
+        'events_total': data['events_total'],
+        'top_risky_users': [{'user_id': u, 'email': emails.get(u), 'risk_score': int(s)} for u, s in data['top']],
+        'reconciled_at': (datetime.fromtimestamp(data['reconciled_at'], tz=dt_timezone.utc).isoformat()
+                          if data['reconciled_at'] else None),
+        'stale': stale,
+    }
@@ -0,0 +1,102 @@
+import json
+import platform
+import subprocess
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from monitoring import bench
+from users.models import AuditLog
+
+SUITES = ('detectors', 'ml', 'rbac', 'endpoints')
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the detectors, ML inference, RBAC checks and list endpoints, optionally after '
+            'loading synthetic audit logs, and write the results as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, metavar='ROWS', help='first load this many synthetic audit rows')
+        parser.add_argument('--users', type=int, default=500, help='synthetic users to create (with --generate)')
+        parser.add_argument('--resources', type=int, default=2000, help='synthetic resources (with --generate)')
+        parser.add_argument('--days', type=int, default=30, help='days the synthetic rows are spread over')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', help='remove synthetic data and exit')
+        parser.add_argument('--suite', action='append', choices=SUITES, help='only run this suite (repeatable)')
+        parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark')
+        parser.add_argument('--span-hours', type=float, default=24, help='history each detector scans')
+        parser.add_argument('--output', default='bench-results.json', help='where to write the JSON results')
+        parser.add_argument('--compare', help='previous results file to compare against')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = bench.clear()
+            self.stdout.write(self.style.SUCCESS(f"Removed synthetic data ({deleted} objects)."))
+            return
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        if options['generate']:
+            self.stdout.write(f"Generating {options['generate']} audit rows...")
+            loaded = bench.generate(options['generate'], users=options['users'], resources=options['resources'],
+                                    days=options['days'], seed=options['seed'], stdout=self.stdout)
+            self.stdout.write(self.style.SUCCESS(f"Loaded {loaded}"))
+
+        suites = options['suite'] or SUITES
+        repeat = options['repeat']
+        results = []
+        if 'detectors' in suites:
+            results += bench.bench_detectors(timedelta(hours=options['span_hours']), repeat)
+        if 'ml' in suites:
+            results += bench.bench_ml(15, repeat)
+        if 'rbac' in suites:
+            results += bench.bench_rbac(200, repeat, seed=options['seed'])
+        if 'endpoints' in suites:
+            results += bench.bench_endpoints(repeat)
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'revision': _git_revision(),
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'audit_rows': AuditLog.objects.count(),
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+        previous = {}
+        if options['compare']:
+            try:
+                with open(options['compare']) as fh:
+                    previous = {r['name']: r for r in json.load(fh)['results']}
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        for row in results:
+            if 'skipped' in row:
+                self.stdout.write(f"{row['name']:<34} skipped: {row['skipped']}")
+                continue
+            line = f"{row['name']:<34} {row['median_ms']:>10.1f} ms {row['queries']:>6} queries"
+            before = previous.get(row['name'])
+            if before and before.get('median_ms'):
+                change = row['median_ms'] / before['median_ms'] - 1
+                line += f"  {change:+.0%} vs {before['median_ms']:.1f} ms"
+                if before.get('queries') != row['queries']:
+                    line += f", queries {before.get('queries')} -> {row['queries']}"
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring import rollups
+from monitoring.management.commands.run_detection import _parse_when
+
+
+class Command(BaseCommand):
+    help = ('Roll raw audit logs up into hourly aggregates and archive rows past the retention '
+            'horizon to compressed files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rollup', action='store_true', help='only roll up')
+        parser.add_argument('--archive', action='store_true', help='only archive')
+        parser.add_argument('--since', help='recompute rollups from this date/time (default: where the last run stopped)')
+        parser.add_argument('--retention-days', type=int, help='keep this many days of raw rows (default: settings)')
+
+    def handle(self, *args, **options):
+        both = not options['rollup'] and not options['archive']
+        if options['since'] and options['archive'] and not options['rollup']:
+            raise CommandError('--since only applies to the rollup')
+
+        if options['rollup'] or both:
+            since = _parse_when(options['since']) if options['since'] else None
+            hours, rows = rollups.rollup(start=since)
+            self.stdout.write(f"Rolled up {hours} hour(s) into {rows} aggregate row(s).")
+
+        if options['archive'] or both:
+            archives = rollups.archive(retention_days=options['retention_days'])
+            for a in archives:
+                self.stdout.write(f"  {a.day}: {a.rows} rows -> {a.path}")
+            self.stdout.write(self.style.SUCCESS(
+                f"Archived {sum(a.rows for a in archives)} row(s) into {len(archives)} file(s)."))
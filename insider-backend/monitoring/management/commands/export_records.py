@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
+
+from monitoring import export
+
+
+class Command(BaseCommand):
+    help = ('Stream audit logs or alerts to a CSV or NDJSON file (optionally gzipped) '
+            'without loading them into memory.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('audit-logs', 'alerts'))
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', '-o', help='file to write (default: stdout)')
+        parser.add_argument('--filter', action='append', default=[], metavar='KEY=VALUE',
+                            help='same filters as the API, e.g. actor=jane@corp.com, category=download, '
+                                 'since=2026-01-01, fields=id,user,action (repeatable)')
+
+    def handle(self, *args, **options):
+        params = QueryDict(mutable=True)
+        for item in options['filter']:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'--filter expects KEY=VALUE, got {item!r}')
+            params.appendlist(key, value)
+        rows = export.audit_rows if options['kind'] == 'audit-logs' else export.alert_rows
+        try:
+            fields, rows = rows(params)
+        except ValidationError as e:
+            raise CommandError(e.detail)
+
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for piece in export.render(fields, rows, options['format'], options['gzip']):
+                out.write(piece)
+                written += len(piece)
+        finally:
+            if options['output']:
+                out.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written / 1e6:.1f} MB to {options['output']}"))
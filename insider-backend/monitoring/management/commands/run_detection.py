@@ -1,217 +1,132 @@
-from django.core.management.base import BaseCommand
-from monitoring.models import Alert
-from users.models import AuditLog 
-from datetime import timedelta
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.utils import timezone
-from django.contrib.auth import get_user_model
-import logging
-from collections import defaultdict
-
-logger = logging.getLogger(__name__)
-User = get_user_model()
-
-def detect_failed_otp_bruteforce():
-    window_start = timezone.now() - timedelta(minutes=15)
-    users = AuditLog.objects.filter(action='otp_failed', timestamp__gte=window_start).values('actor').distinct()
-
-    for user_data in users:
-        user_id = user_data['actor']
-        count = AuditLog.objects.filter(actor_id=user_id, action='otp_failed', timestamp__gte=window_start).count()
-
-        if count > 5:
-            alert_exists = Alert.objects.filter(
-                user_id=user_id,
-                action='otp_failed',
-                timestamp__gte=window_start
-            ).exists()
-
-            if not alert_exists:
-                Alert.objects.create(
-                    user_id=user_id,
-                    action='otp_failed',
-                    description=f"More than 5 failed OTP attempts in last 15 minutes: {count}",
-                    severity='high'
-                )
-                logger.warning(f"Alert created for user {user_id} - failed OTP brute force")
-
-def detect_rapid_logins(threshold=5, period_minutes=10):
-    now = timezone.now()
-    window_start = now - timedelta(minutes=period_minutes)
-    recent_logins = AuditLog.objects.filter(action='login', timestamp__gte=window_start)
-
-    user_login_counts = defaultdict(int)
-    for log in recent_logins:
-        user_email = log.actor.email if log.actor else "unknown"
-        user_login_counts[user_email] += 1
-
-    flagged_users = [user for user, count in user_login_counts.items() if count > threshold]
-    return flagged_users
-
-def detect_unusual_hours_login(start_hour=0, end_hour=6):
-    logs = AuditLog.objects.filter(action='login')
-    flagged_users = []
-
-    for log in logs:
-        if start_hour <= log.timestamp.hour < end_hour:
-            user_email = log.actor.email if log.actor else "unknown"
-            flagged_users.append(user_email)
-
-    return flagged_users
-
-def detect_excessive_downloads(threshold=5, interval_minutes=5):
-    now = timezone.now()
-    interval_start = now - timedelta(minutes=interval_minutes)
-
-    download_logs = AuditLog.objects.filter(
-        action__icontains='downloaded',
-        timestamp__gte=interval_start
-    )
-
-    user_download_counts = defaultdict(int)
-    for log in download_logs:
-        user = log.actor.email if log.actor else 'unknown'
-        user_download_counts[user] += 1
-
-    flagged_users = [user for user, count in user_download_counts.items() if count > threshold]
-    return flagged_users
-
-def detect_unauthorized_access():
-    suspicious_logs = []
-    access_logs = AuditLog.objects.filter(action__icontains='access')
-
-    for log in access_logs:
-        user = log.actor
-        resource = getattr(log, 'resource', None)
-        if not user or not resource:
-            continue
-
-        if user.department and resource.department and user.department != resource.department:
-            suspicious_logs.append(log)
-            continue
-
-        allowed_groups = getattr(resource, 'allowed_groups', None)
-        if allowed_groups is not None:
-            allowed_groups = allowed_groups.all()
-            user_groups = user.groups.all()
-            if allowed_groups and not set(allowed_groups).intersection(set(user_groups)):
-                suspicious_logs.append(log)
-
-    return suspicious_logs
-
-def detect_suspicious_sequences(time_window_minutes=10):
-    now = timezone.now()
-    interval_start = now - timedelta(minutes=time_window_minutes)
-    logs = AuditLog.objects.filter(timestamp__gte=interval_start).order_by('actor', 'timestamp')
-
-    flagged_users = set()
-    user_actions = defaultdict(list)
-
-    for log in logs:
-        if not log.actor:
-            continue
-        user_email = log.actor.email
-        user_actions[user_email].append((log.action.lower(), log.timestamp))
-
-    for user, actions in user_actions.items():
-        action_names = [a[0] for a in actions]
-        try:
-            i_login = action_names.index('login')
-            i_delete = next(i for i in range(i_login+1, len(action_names)) if 'delete' in action_names[i])
-            i_logout = next(i for i in range(i_delete+1, len(action_names)) if 'logout' in action_names[i])
-            flagged_users.add(user)
-        except (StopIteration, ValueError):
-            pass
-
-    return list(flagged_users)
+from django.utils.dateparse import parse_date, parse_datetime
+
+from monitoring.detectors import REGISTRY, Finding
+from monitoring.alerts import broadcast_new_alerts
+from monitoring.engine import run_detectors, scan_range, write_alerts
+
+CHUNK = timedelta(days=1)
+
+
+def _parse_when(value):
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date/time: {value}")
+        when = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+def window_chunks(detector, since, until):
+    """Split [since, until) into chunks whose size and boundaries are multiples of the detector window."""
+    step = detector.window or CHUNK
+    size = step * max(1, round(CHUNK / step))
+    span = size.total_seconds()
+    epoch = (since.timestamp() // step.total_seconds()) * step.total_seconds()
+    start = datetime.fromtimestamp(epoch, tz=since.tzinfo)
+    while start < until:
+        end = datetime.fromtimestamp(start.timestamp() + span, tz=since.tzinfo)
+        yield max(start, since), min(end, until)
+        start = end
+
+
+def _init_worker():
+    # connections inherited from the parent must not be shared with it
+    connections.close_all()
+
+
+def backfill_chunk(name, start, end):
+    """Process-pool entry point; returns picklable (rule name, actor id, count, epoch) tuples."""
+    findings, rows = scan_range(REGISTRY[name], start, end)
+    return name, [(f.spec.name, f.actor_id, f.count, f.at) for f in findings], rows
+
 
 class Command(BaseCommand):
-    help = 'Run security detection checks on audit logs and create alerts.'
+    help = ('Run security detection checks on audit logs and create alerts. '
+            'With --since the detectors are re-run over historical logs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='backfill start (ISO date or datetime)')
+        parser.add_argument('--until', help='backfill end, exclusive (default: now)')
+        parser.add_argument('--detector', action='append', choices=sorted(REGISTRY),
+                            help='only run this detector (repeatable)')
+        parser.add_argument('--workers', type=int, default=None, help='parallel workers')
+        parser.add_argument('--dry-run', action='store_true', help='report findings without creating alerts')
 
     def handle(self, *args, **options):
-        self.stdout.write("Starting detection checks...")
-
-        detect_failed_otp_bruteforce()
-        self.stdout.write("Checked failed OTP brute force attempts.")
-
-        flagged_rapid_logins = detect_rapid_logins()
-        if flagged_rapid_logins:
-            for user_email in flagged_rapid_logins:
-                try:
-                    user_obj = User.objects.get(email=user_email)
-                except User.DoesNotExist:
-                    continue
-                Alert.objects.get_or_create(
-                    user=user_obj,
-                    action='rapid_login',
-                    defaults={
-                        'description': f"User {user_email} logged in more than threshold times in short period",
-                        'severity': 'medium'
-                    }
-                )
-                self.stdout.write(f"Rapid login alert created for {user_email}")
-
-        flagged_unusual_logins = detect_unusual_hours_login()
-        if flagged_unusual_logins:
-            for user_email in flagged_unusual_logins:
-                try:
-                    user_obj = User.objects.get(email=user_email)
-                except User.DoesNotExist:
-                    continue
-                Alert.objects.get_or_create(
-                    user=user_obj,
-                    action='unusual_login_hour',
-                    defaults={
-                        'description': f"User {user_email} logged in during unusual hours",
-                        'severity': 'medium'
-                    }
-                )
-                self.stdout.write(f"Unusual hour login alert created for {user_email}")
-
-        flagged_downloads = detect_excessive_downloads()
-        if flagged_downloads:
-            for user_email in flagged_downloads:
-                try:
-                    user_obj = User.objects.get(email=user_email)
-                except User.DoesNotExist:
-                    continue
-                Alert.objects.get_or_create(
-                    user=user_obj,
-                    action='excessive_downloads',
-                    defaults={
-                        'description': f"User {user_email} downloaded many files in a short period",
-                        'severity': 'high'
-                    }
-                )
-                self.stdout.write(f"Excessive download alert created for {user_email}")
-
-        suspicious_access_logs = detect_unauthorized_access()
-        if suspicious_access_logs:
-            for log in suspicious_access_logs:
-                self.stdout.write(f"Unauthorized access detected in log ID {log.id}")
-                Alert.objects.get_or_create(
-                    user=log.actor,
-                    action='unauthorized_access',
-                    defaults={
-                        'description': f"User {log.actor.email} accessed resource outside allowed scope",
-                        'severity': 'high'
-                    }
-                )
-
-        flagged_sequences = detect_suspicious_sequences()
-        if flagged_sequences:
-            for user_email in flagged_sequences:
-                try:
-                    user_obj = User.objects.get(email=user_email)
-                except User.DoesNotExist:
-                    continue
-                Alert.objects.get_or_create(
-                    user=user_obj,
-                    action='suspicious_sequence',
-                    defaults={
-                        'description': f"User {user_email} performed suspicious sequence of actions",
-                        'severity': 'high'
-                    }
-                )
-                self.stdout.write(f"Suspicious sequence alert created for {user_email}")
-
-        self.stdout.write("Detection checks complete.")
+        names = options['detector'] or sorted(REGISTRY)
+        if not options['since']:
+            if options['until']:
+                raise CommandError('--until requires --since')
+            if options['dry_run']:
+                raise CommandError('--dry-run is only supported for backfills (--since)')
+            self.stdout.write("Starting detection checks...")
+            created = run_detectors(names=names, workers=options['workers'])
+            for alert in created:
+                self.stdout.write(f"{alert.action} alert created for {alert.user.email}")
+            self.stdout.write("Detection checks complete.")
+            return
+
+        since = _parse_when(options['since'])
+        until = _parse_when(options['until']) if options['until'] else timezone.now()
+        if since >= until:
+            raise CommandError('--since must be before --until')
+        self.backfill(names, since, until, options['workers'] or multiprocessing.cpu_count(), options['dry_run'])
+
+    def backfill(self, names, since, until, workers, dry_run):
+        jobs = [(name, start, end) for name in names for start, end in window_chunks(REGISTRY[name], since, until)]
+        self.stdout.write(f"Backfilling {len(names)} detector(s) over {since:%Y-%m-%d %H:%M} - "
+                          f"{until:%Y-%m-%d %H:%M} in {len(jobs)} chunks with {workers} worker(s)")
+
+        specs = {spec.name: spec for name in names for spec in REGISTRY[name].specs()}
+        started = time.monotonic()
+        findings, rows, done = [], 0, 0
+
+        def collect(result):
+            nonlocal rows, done
+            _, found, scanned = result
+            findings.extend(found)
+            rows += scanned
+            done += 1
+            if done % 50 == 0 or done == len(jobs):
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"  {done}/{len(jobs)} chunks, {rows} rows, {rows / max(elapsed, 1e-9):,.0f} rows/s")
+
+        if workers <= 1:
+            for job in jobs:
+                collect(backfill_chunk(*job))
+        else:
+            connections.close_all()
+            try:
+                context = multiprocessing.get_context('fork')
+            except ValueError:
+                context = None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+                for future in as_completed([pool.submit(backfill_chunk, *job) for job in jobs]):
+                    collect(future.result())
+
+        elapsed = time.monotonic() - started
+        by_rule = {}
+        for rule, *_ in findings:
+            by_rule[rule] = by_rule.get(rule, 0) + 1
+        for rule, count in sorted(by_rule.items()):
+            self.stdout.write(f"  {rule}: {count} finding(s)")
+        self.stdout.write(f"Scanned {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s, "
+                          f"{len(jobs) / max(elapsed, 1e-9):.1f} chunks/s)")
+
+        if dry_run:
+            self.stdout.write("Dry run: no alerts created.")
+            return
+        created = write_alerts([Finding(specs[r], actor, count, at) for r, actor, count, at in findings])
+        broadcast_new_alerts(created)
+        self.stdout.write(self.style.SUCCESS(f"Created {len(created)} alert(s)."))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring import tailer
+
+
+def _source(value):
+    path, _, parser = value.partition(':')
+    return path, parser or 'json'
+
+
+class Command(BaseCommand):
+    help = ('Follow local log files (JSON lines, syslog or a custom parser) and ingest their lines '
+            'into the audit log, resuming from the saved byte offsets.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='append', type=_source, metavar='PATH[:PARSER]',
+                            help='file to follow (repeatable; default: settings.AUDIT_LOG_SOURCES). '
+                                 f'Parsers: {", ".join(sorted(tailer.PARSERS))} or a dotted path')
+        parser.add_argument('--once', action='store_true', help='catch up with every file and exit')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls when idle')
+        parser.add_argument('--batch-size', type=int, help='lines per insert (default: AUDIT_INGEST_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        sources = options['source'] or [(s['path'], s.get('parser', 'json'))
+                                         for s in getattr(settings, 'AUDIT_LOG_SOURCES', [])]
+        if not sources:
+            raise CommandError('no sources; pass --source or set AUDIT_LOG_SOURCES')
+        for _, name in sources:
+            try:
+                tailer.get_parser(name)
+            except ImportError:
+                raise CommandError(f'unknown parser {name!r}')
+
+        def report(tail, consumed, seconds):
+            self.stdout.write(f"{tail.path}: {consumed / 1e6:.1f} MB in {seconds:.2f}s "
+                              f"({consumed / 1e6 / max(seconds, 1e-6):.1f} MB/s), "
+                              f"{tail.accepted} accepted, {tail.rejected} rejected so far")
+
+        try:
+            tails = tailer.follow(sources, interval=options['interval'], once=options['once'],
+                                  batch_size=options['batch_size'], report=report)
+        except KeyboardInterrupt:
+            return
+        total = sum(t.bytes_read for t in tails)
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {total / 1e6:.1f} MB: {sum(t.accepted for t in tails)} accepted, "
+            f"{sum(t.rejected for t in tails)} rejected."))
@@ -1,19 +1,19 @@
 # monitoring/middleware.py
 from urllib.parse import parse_qs
-from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import UntypedToken
 from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from channels.db import database_sync_to_async
+from users.authentication import CachedJWTAuthentication
+
+jwt_auth = CachedJWTAuthentication()
 
 @database_sync_to_async
 def get_user_from_token(token):
     try:
         # Validate token
         validated_token = UntypedToken(token)
-        # get user id
-        jwt_auth = JWTAuthentication()
-        user, _ = jwt_auth.get_user(validated_token)
+        # user from the token's user id, cached across connections
+        user = jwt_auth.get_user(validated_token)
         return user
     except Exception:
         return AnonymousUser()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0003_anomaly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectorCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('detector', models.CharField(max_length=64, unique=True)),
+                ('last_log_id', models.BigIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('state', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0004_detectorcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectorRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('detector', models.CharField(max_length=64)),
+                ('started_at', models.DateTimeField()),
+                ('wall_ms', models.FloatField()),
+                ('rows_scanned', models.BigIntegerField(default=0)),
+                ('alerts_created', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('timeout', 'Timed out'), ('error', 'Error')], default='ok', max_length=10)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['started_at'], name='monitoring__started_3a8bd6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0005_detectorrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='dedup_key',
+            field=models.CharField(blank=True, max_length=128, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0006_alert_dedup_key'),
+        ('users', '0009_auditlog_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('path', models.CharField(max_length=500)),
+                ('format', models.CharField(max_length=10)),
+                ('rows', models.PositiveIntegerField()),
+                ('first_log_id', models.BigIntegerField()),
+                ('last_log_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AuditRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('action', models.CharField(max_length=120)),
+                ('count', models.PositiveIntegerField()),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('resource', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='users.resource')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='monitoring__hour_bb6432_idx'), models.Index(fields=['actor', 'hour'], name='monitoring__actor_i_54593d_idx'), models.Index(fields=['action', 'hour'], name='monitoring__action_93d53c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def categorize(name):
+    # frozen copy of users.actions.categorize as of this migration
+    name = name.lower()
+    if name in ('login', 'logout') or name.startswith('otp_'):
+        return 'auth'
+    if name.startswith('assign_') or 'permission' in name:
+        return 'permission'
+    if 'download' in name:
+        return 'download'
+    if 'delete' in name:
+        return 'delete'
+    if name.startswith(('view_', 'list_', 'access_', 'read_')):
+        return 'read'
+    if name.startswith(('create_', 'update_', 'upload_', 'edit_')):
+        return 'write'
+    return 'other'
+
+
+def link_actions(apps, schema_editor):
+    AuditAction = apps.get_model('users', 'AuditAction')
+    AuditRollup = apps.get_model('monitoring', 'AuditRollup')
+    for name in AuditRollup.objects.values_list('action', flat=True).distinct():
+        action, _ = AuditAction.objects.get_or_create(name=name, defaults={'category': categorize(name)})
+        AuditRollup.objects.filter(action=name).update(action_type=action)
+
+
+def restore_names(apps, schema_editor):
+    AuditAction = apps.get_model('users', 'AuditAction')
+    AuditRollup = apps.get_model('monitoring', 'AuditRollup')
+    for action in AuditAction.objects.all():
+        AuditRollup.objects.filter(action_type=action).update(action=action.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0007_audit_rollups_archives'),
+        ('users', '0010_auditaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditrollup',
+            name='action_type',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='+', to='users.auditaction'),
+        ),
+        # nullable first so the migration can be reversed: the names are restored before NOT NULL returns
+        migrations.AlterField(
+            model_name='auditrollup',
+            name='action',
+            field=models.CharField(max_length=120, null=True),
+        ),
+        migrations.RunPython(link_actions, restore_names),
+        migrations.RemoveIndex(
+            model_name='auditrollup',
+            name='monitoring__action_93d53c_idx',
+        ),
+        migrations.RemoveField(
+            model_name='auditrollup',
+            name='action',
+        ),
+        migrations.AlterField(
+            model_name='auditrollup',
+            name='action_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='+', to='users.auditaction'),
+        ),
+        migrations.AddIndex(
+            model_name='auditrollup',
+            index=models.Index(fields=['action_type', 'hour'], name='monitoring__action__3b095b_idx'),
+        ),
+    ]
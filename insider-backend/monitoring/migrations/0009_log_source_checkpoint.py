@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0008_auditrollup_action_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogSourceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('device', models.BigIntegerField(default=0)),
+                ('inode', models.BigIntegerField(default=0)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('fingerprint', models.CharField(blank=True, max_length=48)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
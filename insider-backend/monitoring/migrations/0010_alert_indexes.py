@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0009_log_source_checkpoint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['cleared', 'timestamp'], name='monitoring__cleared_99df6b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['severity', 'cleared', 'timestamp'], name='monitoring__severit_c0c88f_idx'),
+        ),
+    ]
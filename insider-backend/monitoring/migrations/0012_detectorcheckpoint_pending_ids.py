@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0011_incidents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectorcheckpoint',
+            name='pending_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0012_detectorcheckpoint_pending_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyRollupHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(unique=True)),
+            ],
+        ),
+    ]
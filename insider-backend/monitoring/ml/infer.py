@@ -2,8 +2,11 @@
 import os
 import joblib
 import pandas as pd
+from datetime import timedelta
 from django.utils import timezone
+from monitoring.alerts import broadcast_new_alerts, dedup_key, upsert_alerts
 from monitoring.models import Anomaly, Alert
+from users import actions
 from users.models import AuditLog, User
 from django.db import transaction
 
@@ -19,7 +22,9 @@ def build_feature_df_for_recent_window(window_minutes=15):
     now = timezone.now()
     start = now - pd.Timedelta(minutes=window_minutes)
     qs = AuditLog.objects.filter(timestamp__gte=start)
-    logs = list(qs.values('actor_id', 'action', 'resource_id', 'timestamp'))
+    names = actions.names()
+    logs = [dict(r, action=names[r.pop('action_type_id')])
+            for r in qs.values('actor_id', 'action_type_id', 'resource_id', 'timestamp')]
     if not logs:
         return pd.DataFrame()
     df = pd.DataFrame(logs)
@@ -49,7 +54,10 @@ def infer_and_record(window_minutes=15, threshold=None):
     # convert to positive anomaly score: -score
     anomaly_scores = -scores
 
-    results = []
+    users = User.objects.in_bulk([int(u) for u in df['actor_id']])
+    now = timezone.now()
+    window = timedelta(minutes=window_minutes)
+    anomalies, alerts, results = [], [], []
     for i, row in df.iterrows():
         user_id = int(row['actor_id'])
         score = float(anomaly_scores[i])
@@ -62,28 +70,27 @@ def infer_and_record(window_minutes=15, threshold=None):
             pred = pipe.named_steps['iso'].predict(X[i].reshape(1, -1))[0]
             is_anom = pred == -1
 
-        # Create Anomaly row
-        user_obj = None
-        try:
-            user_obj = User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            pass
-
-        an = Anomaly.objects.create(
+        user_obj = users.get(user_id)
+        anomalies.append(Anomaly(
             actor=user_obj,
             score=score,
             is_anomaly=is_anom,
             reason='isolation_forest_window',
             related_logs=[],
-        )
+        ))
 
-        # If anomalous → create Alert
-        if is_anom:
-            Alert.objects.create(
+        # If anomalous → alert, at most once per user per inference window
+        if is_anom and user_obj is not None:
+            alerts.append(Alert(
                 user=user_obj,
                 action='ml_anomaly',
                 description=f"ML anomaly score {score:.4f} in last {window_minutes}m",
-                severity='high' if score > 1.0 else 'medium'
-            )
+                severity='high' if score > 1.0 else 'medium',
+                dedup_key=dedup_key('ml_anomaly', user_id, now, window),
+            ))
         results.append({'user_id': user_id, 'score': score, 'is_anomaly': is_anom})
+
+    Anomaly.objects.bulk_create(anomalies)
+    created = upsert_alerts(alerts)
+    broadcast_new_alerts(created)   # sent once the caller's transaction commits
     return results
@@ -8,6 +8,7 @@ from sklearn.ensemble import IsolationForest
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 from django.utils import timezone
+from users import actions
 from users.models import AuditLog  # ensure import path correct
 
 MODEL_DIR = Path(__file__).resolve().parent / "models"
@@ -19,7 +20,9 @@ def extract_features_from_queryset(qs):
     if qs is None:
         return pd.DataFrame()
     if hasattr(qs, 'values'):
-        logs = list(qs.values('actor_id', 'action', 'resource_id', 'timestamp'))
+        names = actions.names()
+        logs = [dict(r, action=names[r.pop('action_type_id')])
+                for r in qs.values('actor_id', 'action_type_id', 'resource_id', 'timestamp')]
     else:
         logs = list(qs)
     if not logs:
@@ -38,16 +41,51 @@ def extract_features_from_queryset(qs):
     agg['total_actions'] = agg.select_dtypes('number').sum(axis=1)
     return agg
 
+def extract_features_from_rollups(period_start):
+    """
+    Same frame as extract_features_from_queryset, built from the hourly rollups
+    plus the raw rows of the hours not rolled up yet. period_start is rounded
+    down to the hour, the rollup grain.
+    """
+    from monitoring.models import AuditRollup
+    from monitoring.rollups import rolled_up_until
+
+    period_start = period_start.replace(minute=0, second=0, microsecond=0)
+    rolled = rolled_up_until()
+    if rolled is None or rolled <= period_start:
+        return extract_features_from_queryset(AuditLog.objects.filter(timestamp__gte=period_start))
+    rows = list(AuditRollup.objects.filter(hour__gte=period_start)
+                .values('actor_id', 'action_type_id', 'resource_id', 'hour', 'count'))
+    tail = AuditLog.objects.filter(timestamp__gte=rolled).values('actor_id', 'action_type_id', 'resource_id', 'timestamp')
+    rows += [dict(r, hour=r.pop('timestamp'), count=1) for r in tail]
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows)
+    df['action'] = df['action_type_id'].map(actions.names())
+    df['date'] = pd.to_datetime(df['hour']).dt.floor('D')
+    # the raw frame counts rows with a resource, so do the same
+    df['n'] = df['count'].where(df['resource_id'].notna(), 0)
+    action_counts = df.pivot_table(index=['actor_id','date'],
+                                   columns='action',
+                                   values='n',
+                                   aggfunc='sum',
+                                   fill_value=0)
+    unique_res = df.groupby(['actor_id','date'])['resource_id'].nunique().rename('unique_resources')
+    agg = action_counts.join(unique_res, how='left').fillna(0)
+    agg.reset_index(inplace=True)
+    agg['total_actions'] = agg.select_dtypes('number').sum(axis=1)
+    return agg
+
 def train_and_save(qs=None, contamination=0.01, random_state=42):
     """
-    If qs is None, train on the last 30 days of AuditLog entries.
+    If qs is None, train on the last 30 days of activity, read from the hourly
+    rollups where they exist.
     Saves model to monitoring/ml/models/iso_forest.joblib
     """
     if qs is None:
-        period_start = timezone.now() - pd.Timedelta(days=30)
-        qs = AuditLog.objects.filter(timestamp__gte=period_start)
-
-    Xdf = extract_features_from_queryset(qs)
+        Xdf = extract_features_from_rollups(timezone.now() - pd.Timedelta(days=30))
+    else:
+        Xdf = extract_features_from_queryset(qs)
     if Xdf.empty:
         raise ValueError("No training data available for the given queryset/window")
 
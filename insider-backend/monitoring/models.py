@@ -17,10 +17,51 @@ class Alert(models.Model):
     description = models.TextField()
     severity = models.CharField(max_length=10, choices=SEVERITY_CHOICES, default='medium')
     cleared = models.BooleanField(default=False)  # Add this!
+    # <action>:<user id>:<window bucket>, see monitoring.alerts.dedup_key
+    dedup_key = models.CharField(max_length=128, unique=True, null=True, blank=True)
+    incident = models.ForeignKey('Incident', null=True, blank=True, on_delete=models.SET_NULL, related_name='alerts')
+
+    class Meta:
+        # the alert list reads open alerts newest first, optionally for one severity
+        indexes = [
+            models.Index(fields=['cleared', 'timestamp']),
+            models.Index(fields=['severity', 'cleared', 'timestamp']),
+        ]
 
     def __str__(self):
         return f"{self.timestamp}: {self.user.email} - {self.action} ({self.severity})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # cleared as loaded, so a save can tell a clear from other updates without a query
+        instance._loaded_cleared = instance.__dict__.get('cleared')
+        return instance
+
+class Incident(models.Model):
+    """Alerts for one user close together in time, see monitoring.incidents."""
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('closed', 'Closed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    severity = models.CharField(max_length=10, choices=Alert.SEVERITY_CHOICES, default='low')   # highest alert's
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+    alert_count = models.PositiveIntegerField(default=0)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'first_seen']),
+            models.Index(fields=['user', 'status', 'last_seen']),
+        ]
+
+    def __str__(self):
+        return f"Incident {self.pk} user={self.user_id} {self.severity} x{self.alert_count} ({self.status})"
+
 class Anomaly(models.Model):
     actor = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
     score = models.FloatField()           # anomaly score (higher = more anomalous for some detectors)
@@ -31,3 +72,84 @@ class Anomaly(models.Model):
 
     def __str__(self):
         return f"Anomaly {self.pk} user={self.actor} score={self.score:.3f}"
+
+class DetectorCheckpoint(models.Model):
+    detector = models.CharField(max_length=64, unique=True)
+    last_log_id = models.BigIntegerField(default=0)        # highest AuditLog.id already processed
+    last_timestamp = models.DateTimeField(null=True, blank=True)  # when the detector last ran
+    state = models.JSONField(default=dict, blank=True)      # window state carried between runs
+    pending_ids = models.JSONField(default=list, blank=True)  # [first, last, since] id ranges not committed yet
+
+    def __str__(self):
+        return f"{self.detector} @ {self.last_log_id}"
+
+class DetectorRun(models.Model):
+    STATUS_CHOICES = [
+        ('ok', 'OK'),
+        ('timeout', 'Timed out'),
+        ('error', 'Error'),
+    ]
+
+    detector = models.CharField(max_length=64)
+    started_at = models.DateTimeField()
+    wall_ms = models.FloatField()
+    rows_scanned = models.BigIntegerField(default=0)
+    alerts_created = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='ok')
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [models.Index(fields=['started_at'])]
+
+    def __str__(self):
+        return f"{self.detector} {self.started_at:%Y-%m-%d %H:%M:%S} {self.status} {self.wall_ms:.0f}ms"
+
+class AuditRollup(models.Model):
+    """Hourly AuditLog counts per actor, action and resource, see monitoring.rollups."""
+    hour = models.DateTimeField()
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    action_type = models.ForeignKey('users.AuditAction', on_delete=models.PROTECT, related_name='+', db_index=False)
+    resource = models.ForeignKey('users.Resource', null=True, blank=True, on_delete=models.SET_NULL)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hour']),
+            models.Index(fields=['actor', 'hour']),
+            models.Index(fields=['action_type', 'hour']),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.actor_id} {self.action_type_id} x{self.count}"
+
+class DirtyRollupHour(models.Model):
+    """An hour that got raw AuditLog rows after it may have been rolled up, see monitoring.rollups."""
+    hour = models.DateTimeField(unique=True)
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00}"
+
+class AuditArchive(models.Model):
+    """One compressed file holding a day of raw AuditLog rows removed from the hot table."""
+    day = models.DateField(db_index=True)
+    path = models.CharField(max_length=500)
+    format = models.CharField(max_length=10)   # 'ndjson' (gzip) or 'parquet'
+    rows = models.PositiveIntegerField()
+    first_log_id = models.BigIntegerField()
+    last_log_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.day} {self.rows} rows -> {self.path}"
+
+class LogSourceCheckpoint(models.Model):
+    """How far the log tailer has read a file, see monitoring.tailer."""
+    path = models.CharField(max_length=1024, unique=True)
+    device = models.BigIntegerField(default=0)
+    inode = models.BigIntegerField(default=0)
+    offset = models.BigIntegerField(default=0)   # byte just after the last ingested line
+    fingerprint = models.CharField(max_length=48, blank=True)   # hash of the first bytes, see Tail._head
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path} @ {self.offset} (inode {self.inode})"
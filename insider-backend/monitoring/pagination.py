@@ -0,0 +1,52 @@
+# monitoring/pagination.py
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from users.audit_query import decode_cursor, encode_cursor
+from users.query_params import int_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first keyset pages on (field, id), as in users.audit_query.
+
+    The body stays a plain list, so existing clients keep working. The next page
+    is announced in a `Link: <...>; rel="next"` header, the way GitHub's API does it.
+    """
+    field = 'timestamp'
+    page_size = 100
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        params = request.query_params
+        limit = int_param(params, 'limit')
+        limit = self.page_size if limit is None else limit
+        if not 0 < limit <= self.max_page_size:
+            raise ValidationError({'limit': f'Expected 1 to {self.max_page_size}.'})
+        if params.get('cursor'):
+            timestamp, pk = decode_cursor(params['cursor'])
+            queryset = (queryset.filter(**{f'{self.field}__lte': timestamp})
+                        .exclude(**{self.field: timestamp, 'id__gte': pk}))
+        rows = list(queryset.order_by(f'-{self.field}', '-id')[:limit + 1])
+        last = rows[limit - 1] if len(rows) > limit else None
+        self.next_cursor = encode_cursor(getattr(last, self.field), last.pk) if last else None
+        return rows[:limit]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), 'cursor', self.next_cursor)
+
+    def get_paginated_response(self, data):
+        headers = {}
+        if self.next_cursor is not None:
+            headers['Link'] = f'<{self.get_next_link()}>; rel="next"'
+        return Response(data, headers=headers)
+
+
+class IncidentPagination(KeysetPagination):
+    # first_seen never changes, so pages stay stable while incidents grow
+    field = 'first_seen'
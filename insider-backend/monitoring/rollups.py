@@ -0,0 +1,265 @@
+# monitoring/rollups.py
+"""
+Compaction of the raw audit log.
+
+rollup() folds raw AuditLog rows into AuditRollup, one row per hour, actor,
+action and resource. Hours are recomputed as a whole, so re-running a range
+is idempotent. Only hours that ended ROLLUP_GRACE ago are rolled up, which
+gives buffered audit writes time to land.
+
+Rows still arrive for hours already rolled up (ingest, the tailer, spool
+replay). Every writer calls mark_late() in the transaction of its insert,
+which records the hours that are already over in DirtyRollupHour, and each
+rollup() run recomputes those hours first.
+
+archive() moves raw rows older than AUDIT_RETENTION_DAYS (and already rolled
+up) out of the hot table. Each day is written to
+    <AUDIT_ARCHIVE_DIR>/date=YYYY-MM-DD/auditlog-<first id>-<last id>.<ext>
+as gzip NDJSON, or as Parquet when AUDIT_ARCHIVE_FORMAT = 'parquet' and
+pyarrow is installed. The directory layout is hive-style, so DuckDB, Spark
+or pandas can query the archive directly. The rows are only deleted after
+the file has been written and recorded in AuditArchive. A day is not archived
+while one of its hours is still marked dirty, so no row leaves the table
+before it is counted. Rows that arrive for a day already archived are
+archived in a later file, and their counts are added to the rollups in the
+same transaction that deletes them.
+"""
+import gzip
+import json
+import logging
+import os
+from array import array
+from datetime import datetime, time as dtime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from monitoring import analytics
+from monitoring.models import AuditArchive, AuditRollup, DirtyRollupHour
+from users import actions
+from users.models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_GRACE = timedelta(minutes=5)
+HOUR = timedelta(hours=1)
+
+
+def _floor_hour(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def _floor_day(when):
+    return when.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rolled_up_until():
+    """End of the last hour present in AuditRollup, or None."""
+    last = AuditRollup.objects.aggregate(m=Max('hour'))['m']
+    return last + HOUR if last else None
+
+
+def _archived_until():
+    last = AuditArchive.objects.aggregate(m=Max('day'))['m']
+    if last is None:
+        return None
+    return datetime.combine(last + timedelta(days=1), dtime.min, tzinfo=dt_timezone.utc)
+
+
+def mark_late(timestamps, now=None):
+    """Record the hours, already over, that rows with these timestamps were just written to."""
+    current = _floor_hour(now or timezone.now())
+    hours = {_floor_hour(t) for t in timestamps if t < current}
+    if hours:
+        DirtyRollupHour.objects.bulk_create([DirtyRollupHour(hour=h) for h in hours], ignore_conflicts=True)
+
+
+def _roll(start, stop):
+    """Recompute the rollups of [start, stop); returns the rows written."""
+    # clear the marks before reading: a row that lands meanwhile marks its hour again
+    marks = DirtyRollupHour.objects.filter(hour__gte=start, hour__lt=stop)
+    marked = list(marks.values_list('hour', flat=True))
+    marks.delete()
+    rows = (AuditLog.objects.filter(timestamp__gte=start, timestamp__lt=stop)
+            .annotate(hour=TruncHour('timestamp'))
+            .values('hour', 'actor_id', 'action_type_id', 'resource_id')
+            .annotate(n=Count('id')))
+    try:
+        with transaction.atomic():
+            AuditRollup.objects.filter(hour__gte=start, hour__lt=stop).delete()
+            created = AuditRollup.objects.bulk_create([
+                AuditRollup(hour=r['hour'], actor_id=r['actor_id'], action_type_id=r['action_type_id'],
+                            resource_id=r['resource_id'], count=r['n'])
+                for r in rows.iterator(chunk_size=5000)
+            ], batch_size=5000)
+    except Exception:
+        DirtyRollupHour.objects.bulk_create([DirtyRollupHour(hour=h) for h in marked], ignore_conflicts=True)
+        raise
+    analytics.invalidate_events(start, stop)
+    return len(created)
+
+
+def rollup(start=None, end=None, now=None):
+    """Recompute the hourly rollups for [start, end) and the dirty hours; returns (hours, rollup rows) written."""
+    now = now or timezone.now()
+    end = _floor_hour(min(end or now, now - ROLLUP_GRACE))
+    if start is None:
+        start = rolled_up_until()
+        if start is None:
+            first = AuditLog.objects.aggregate(m=Min('timestamp'))['m']
+            if first is None:
+                return 0, 0
+            start = first
+    start = _floor_hour(start)
+    # never recompute hours whose raw rows have been archived away; archive() counts late rows there
+    floor = _archived_until()
+    if floor is not None and start < floor:
+        start = floor
+
+    hours = written = 0
+    dirty = DirtyRollupHour.objects.filter(hour__lt=start).order_by('hour')
+    if floor is not None:
+        dirty = dirty.filter(hour__gte=floor)
+    for hour in list(dirty.values_list('hour', flat=True)):
+        written += _roll(hour, hour + HOUR)
+        hours += 1
+    while start < end:
+        stop = min(start + timedelta(days=1), end)
+        written += _roll(start, stop)
+        hours += int((stop - start) / HOUR)
+        start = stop
+    return hours, written
+
+
+def _add_late_counts(day_rows, ids):
+    """Add the rows `ids` of an archived day to its rollups (they arrived after it was archived)."""
+    counts = (day_rows.filter(id__in=ids).annotate(hour=TruncHour('timestamp'))
+              .values_list('hour', 'actor_id', 'action_type_id', 'resource_id').annotate(n=Count('id')))
+    for hour, actor_id, action_type_id, resource_id, n in counts:
+        updated = AuditRollup.objects.filter(hour=hour, actor_id=actor_id, action_type_id=action_type_id,
+                                             resource_id=resource_id).update(count=F('count') + n)
+        if not updated:
+            AuditRollup.objects.create(hour=hour, actor_id=actor_id, action_type_id=action_type_id,
+                                       resource_id=resource_id, count=n)
+
+
+def _archive_dir():
+    return getattr(settings, 'AUDIT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'audit-archive'))
+
+
+def _archive_format():
+    fmt = getattr(settings, 'AUDIT_ARCHIVE_FORMAT', 'ndjson')
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            logger.warning("AUDIT_ARCHIVE_FORMAT is parquet but pyarrow is not installed; writing NDJSON")
+            return 'ndjson'
+    return fmt
+
+
+def _chunks(qs, batch):
+    """Yield lists of JSON-ready row dicts, reading `batch` rows at a time."""
+    names = actions.names()
+    chunk = []
+    for row in qs.values('id', 'timestamp', 'actor_id', 'action_type_id', 'resource_id', 'ip_address',
+                         'metadata').iterator(chunk_size=batch):
+        row['timestamp'] = row['timestamp'].isoformat()
+        row['action'] = names[row.pop('action_type_id')]   # archives keep the readable name
+        chunk.append(row)
+        if len(chunk) >= batch:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_file(tmp, chunks, fmt):
+    """Stream chunks into `tmp`; return the ids written."""
+    ids = array('q')
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for chunk in chunks:
+                for row in chunk:
+                    row['metadata'] = json.dumps(row['metadata'])
+                table = pa.Table.from_pylist(chunk)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema, compression='zstd')
+                writer.write_table(table)
+                ids.extend(row['id'] for row in chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with gzip.open(tmp, 'wt', encoding='utf-8') as fh:
+            for chunk in chunks:
+                for row in chunk:
+                    fh.write(json.dumps(row, default=str) + '\n')
+                ids.extend(row['id'] for row in chunk)
+    if ids:
+        with open(tmp, 'rb') as fh:
+            os.fsync(fh.fileno())
+    return ids
+
+
+def archive(retention_days=None, now=None, batch=5000):
+    """Archive and delete raw rows older than the retention horizon; returns the AuditArchive rows."""
+    now = now or timezone.now()
+    retention_days = retention_days or getattr(settings, 'AUDIT_RETENTION_DAYS', 90)
+    # days are UTC days, like the rollup hours and the analytics buckets
+    cutoff = _floor_day(now - timedelta(days=retention_days))
+    rolled = rolled_up_until()
+    if rolled is None:
+        return []
+    cutoff = min(cutoff, rolled)   # raw rows must be rolled up before they go
+    rollup(end=cutoff, now=now)    # and so must the rows that arrived late
+    fmt = _archive_format()
+    ext = 'parquet' if fmt == 'parquet' else 'ndjson.gz'
+    archives = []
+    while True:
+        first = AuditLog.objects.filter(timestamp__lt=cutoff).aggregate(m=Min('timestamp'))['m']
+        if first is None:
+            break
+        day_start = _floor_day(first)
+        day_end = min(day_start + timedelta(days=1), cutoff)
+        day_rows = AuditLog.objects.filter(timestamp__gte=day_start, timestamp__lt=day_end)
+        day = day_start.date()
+        directory = os.path.join(_archive_dir(), f'date={day.isoformat()}')
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, f'.auditlog-{os.getpid()}.tmp')
+        late = AuditArchive.objects.filter(day=day).exists()
+        ids = _write_file(tmp, _chunks(day_rows.order_by('id'), batch), fmt)
+        if not ids:
+            # the rows were deleted since `first` was read; the next run starts over
+            if os.path.exists(tmp):   # a Parquet writer only creates the file with its first chunk
+                os.remove(tmp)
+            break
+        hours = DirtyRollupHour.objects.filter(hour__gte=day_start, hour__lt=day_end)
+        # checked after reading the rows: a row written since then is not in the file and stays
+        if not late and hours.exists():
+            os.remove(tmp)
+            logger.info("Not archiving %s yet: rows arrived after it was rolled up", day)
+            break
+        path = os.path.join(directory, f'auditlog-{ids[0]}-{ids[-1]}.{ext}')
+        os.replace(tmp, path)
+
+        with transaction.atomic():
+            archives.append(AuditArchive.objects.create(day=day, path=path, format=fmt, rows=len(ids),
+                                                        first_log_id=ids[0], last_log_id=ids[-1]))
+            if late:
+                for i in range(0, len(ids), batch):
+                    _add_late_counts(day_rows, ids[i:i + batch].tolist())
+                hours.delete()
+            # delete exactly what was written; rows that land meanwhile go in the next file
+            for i in range(0, len(ids), batch):
+                AuditLog.objects.filter(id__in=ids[i:i + batch].tolist()).delete()
+        if late:
+            analytics.invalidate_events(day_start, day_end)
+        logger.info("Archived %s audit rows of %s to %s", len(ids), day, path)
+    return archives
@@ -0,0 +1,149 @@
+# monitoring/rules.py
+"""
+Declarative multi-step sequence rules.
+
+A SequenceRule is an ordered list of Steps that one user has to perform within
+`within`. RuleSet compiles every rule into a transition table keyed by action
+name, so evaluating an event is one dict lookup plus the handful of transitions
+it can advance; the cost of a pass grows with the number of events, not with
+events x rules.
+
+Per-user automaton state is plain JSON so it can live in a DetectorCheckpoint:
+    {actor_id: {rule_name: [None, start_1, ..., start_n-1]}}
+where start_k is the latest start time (epoch) of a partial match that has
+completed k steps. Keeping only the latest start per stage is enough: a later
+start can only make the `within` constraint easier to satisfy.
+"""
+from collections import namedtuple
+from datetime import timedelta
+from users import actions
+
+
+class Step:
+    def __init__(self, action=None, category=None, contains=None, prefix=None, cross_department=False):
+        self.action = action                      # exact action name
+        self.category = category                  # users.actions category
+        self.contains = contains                  # substring of the action name
+        self.prefix = prefix                      # action name prefix
+        self.cross_department = cross_department  # actor and resource departments differ
+
+    def matches_action(self, action):
+        if self.action is not None and action != self.action:
+            return False
+        if self.category is not None and actions.category(action) != self.category:
+            return False
+        if self.contains is not None and self.contains not in action:
+            return False
+        if self.prefix is not None and not action.startswith(self.prefix):
+            return False
+        return True
+
+
+class SequenceRule:
+    def __init__(self, name, steps, within, severity='high', description=''):
+        self.name = name
+        self.steps = steps
+        self.within = within
+        self.severity = severity
+        self.description = description
+        self.dedupe_window = within
+
+
+def repeat(step, times):
+    return [step] * times
+
+
+Transition = namedtuple('Transition', 'rule step last needs_context')
+
+
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.window = max((r.within for r in self.rules), default=timedelta(0))
+        self.needs_context = any(s.cross_department for r in self.rules for s in r.steps)
+        self._transitions = {}
+
+    def transitions(self, action):
+        """Transitions an action name can take, memoized per distinct name."""
+        found = self._transitions.get(action)
+        if found is None:
+            found = []
+            for rule in self.rules:
+                # descending step order so one event never advances a rule twice
+                for idx in range(len(rule.steps) - 1, -1, -1):
+                    step = rule.steps[idx]
+                    if step.matches_action(action):
+                        found.append(Transition(rule, idx, idx == len(rule.steps) - 1,
+                                                step.cross_department))
+            self._transitions[action] = found = tuple(found)
+        return found
+
+    def feed(self, state, actor_id, action, epoch, cross_department=False):
+        """Advance one actor's automata by one event; return the rules it completed."""
+        completed = []
+        transitions = self.transitions(action.lower())
+        if not transitions:
+            return completed
+        actor_state = state.setdefault(str(actor_id), {})
+        for t in transitions:
+            if t.needs_context and not cross_department:
+                continue
+            rule = t.rule
+            starts = actor_state.get(rule.name)
+            if t.step == 0:
+                start = epoch
+            else:
+                start = starts[t.step] if starts else None
+                if start is None or epoch - start > rule.within.total_seconds():
+                    continue
+            if t.last:
+                completed.append(rule)
+                actor_state.pop(rule.name, None)
+                continue
+            if starts is None:
+                starts = actor_state[rule.name] = [None] * len(rule.steps)
+            if starts[t.step + 1] is None or starts[t.step + 1] < start:
+                starts[t.step + 1] = start
+        if not actor_state:
+            del state[str(actor_id)]
+        return completed
+
+    def prune(self, state, now_epoch):
+        """Drop partial matches that can no longer complete."""
+        for actor in list(state):
+            actor_state = state[actor]
+            for rule in self.rules:
+                starts = actor_state.get(rule.name)
+                if starts is None:
+                    continue
+                live = [s if s is not None and now_epoch - s <= rule.within.total_seconds() else None
+                        for s in starts]
+                if any(s is not None for s in live):
+                    actor_state[rule.name] = live
+                else:
+                    del actor_state[rule.name]
+            if not actor_state:
+                del state[actor]
+
+
+SEQUENCE_RULES = [
+    SequenceRule(
+        'suspicious_sequence',
+        [Step(action='login'), Step(category=actions.DELETE), Step(action='logout')],
+        within=timedelta(minutes=10),
+        description="User {email} performed suspicious sequence of actions",
+    ),
+    SequenceRule(
+        'download_then_permission_change',
+        repeat(Step(category=actions.DOWNLOAD), 3)
+        + [Step(category=actions.PERMISSION), Step(action='logout')],
+        within=timedelta(minutes=30),
+        description="User {email} bulk-downloaded files, changed permissions and logged out",
+    ),
+    SequenceRule(
+        'cross_department_delete',
+        [Step(category=actions.READ, cross_department=True), Step(category=actions.DELETE)],
+        within=timedelta(minutes=30),
+        description="User {email} accessed a resource outside their department and then deleted",
+    ),
+]
@@ -1,10 +1,18 @@
 from rest_framework import serializers
-from .models import Alert
+from .models import Alert, Incident
 
 class AlertSerializer(serializers.ModelSerializer):
     user_email = serializers.CharField(source='user.email', read_only=True)
 
     class Meta:
         model = Alert
-        fields = ['id', 'user', 'user_email', 'action', 'timestamp', 'description', 'severity', 'cleared']
-        read_only_fields = ['id', 'user_email', 'timestamp']
+        fields = ['id', 'user', 'user_email', 'action', 'timestamp', 'description', 'severity', 'cleared', 'incident']
+        read_only_fields = ['id', 'user_email', 'timestamp', 'incident']
+
+class IncidentSerializer(serializers.ModelSerializer):
+    user_email = serializers.CharField(source='user.email', read_only=True)
+
+    class Meta:
+        model = Incident
+        fields = ['id', 'user', 'user_email', 'severity', 'status', 'first_seen', 'last_seen', 'alert_count', 'closed_at']
+        read_only_fields = fields
@@ -1,21 +1,36 @@
 # monitoring/signals.py
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from .models import Alert
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from .serializers import AlertSerializer
+from .alerts import broadcast_new_alerts
+from . import analytics, incidents, kpis
+
+@receiver(post_save, sender=Alert)
+def correlate_alert(sender, instance, created, **kwargs):
+    # runs before broadcast_alert; bulk-inserted alerts are correlated by upsert_alerts
+    if created and instance.incident_id is None:
+        incidents.correlate([instance])
+
 
 @receiver(post_save, sender=Alert)
 def broadcast_alert(sender, instance, created, **kwargs):
-    if not created:
-        return
-    channel_layer = get_channel_layer()
-    serialized = AlertSerializer(instance).data
-    async_to_sync(channel_layer.group_send)(
-        'alerts',
-        {
-            'type': 'alert_created',  # maps to AlertConsumer.alert_created
-            'alert': serialized
-        }
-    )
+    # queued and sent after commit, coalesced with other alerts, see monitoring.broadcast
+    if created:
+        broadcast_new_alerts([instance])
+
+
+@receiver(post_delete, sender=Alert)
+def forget_alert_counts(sender, instance, **kwargs):
+    # closed chart buckets are cached; a deleted alert is the only thing that changes one
+    analytics.invalidate_alerts(instance.timestamp)
+
+
+@receiver(post_save, sender=Alert)
+def count_alert(sender, instance, created, **kwargs):
+    # bulk-inserted alerts are counted by upsert_alerts; Alert.from_db keeps the loaded cleared flag
+    was_cleared = getattr(instance, '_loaded_cleared', None)
+    if created:
+        kpis.alerts_created([instance])
+    elif was_cleared is not None and was_cleared != instance.cleared:
+        kpis.alert_cleared(instance, instance.cleared)
+    instance._loaded_cleared = instance.cleared
@@ -0,0 +1,130 @@
+# monitoring/streaming.py
+"""
+Write-time detection. Every audit event written through log_action is pushed,
+once its transaction commits, through per-user sliding windows for the
+windowed detectors, and an Alert is raised as soon as a threshold is crossed
+instead of waiting for the next run_all_detections tick.
+
+Two backends hold the windows:
+  memory  ring buffers in this process (default; exact for a single worker)
+  redis   one sorted set per (detector, user), shared by every worker
+"""
+import logging
+import secrets
+import threading
+import time
+from collections import defaultdict, deque
+from django.conf import settings
+from monitoring.detectors import REGISTRY, WindowCountDetector
+from monitoring.alerts import broadcast_new_alerts, dedup_key, upsert_alerts
+from monitoring.models import Alert
+
+logger = logging.getLogger(__name__)
+
+STREAM_DETECTORS = [d for d in REGISTRY.values() if isinstance(d, WindowCountDetector)]
+
+
+class MemoryWindows:
+    SWEEP_SECONDS = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = defaultdict(deque)   # key -> deque of epochs, at most threshold + 1
+        self._fired = {}                    # key -> epoch of the last alert
+        self._expires = {}                  # key -> epoch its window holds nothing any more
+        self._next_sweep = 0
+
+    def hit(self, key, epoch, window, threshold):
+        """Record one event; return the window count if this event crosses the threshold."""
+        with self._lock:
+            self._sweep(epoch)
+            self._expires[key] = max(self._expires.get(key, 0), epoch + window)
+            ring = self._events[key]
+            ring.append(epoch)
+            while len(ring) > threshold + 1 or (ring and ring[0] <= epoch - window):
+                ring.popleft()
+            if len(ring) <= threshold:
+                return None
+            if self._fired.get(key, 0) > epoch - window:
+                return None
+            self._fired[key] = epoch
+            return len(ring)
+
+    def _sweep(self, now):
+        # forget users idle for a whole window, so the maps stay as small as the active set
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.SWEEP_SECONDS
+        for key in [k for k, until in self._expires.items() if until <= now]:
+            del self._expires[key]
+            self._events.pop(key, None)
+            self._fired.pop(key, None)
+
+
+class RedisWindows:
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    def hit(self, key, epoch, window, threshold):
+        zkey = f'monitoring:stream:{key}'
+        pipe = self._redis.pipeline()
+        pipe.zadd(zkey, {f'{epoch:.6f}:{secrets.token_hex(4)}': epoch})
+        pipe.zremrangebyscore(zkey, '-inf', epoch - window)
+        pipe.zcard(zkey)
+        pipe.expire(zkey, int(window) + 1)
+        count = pipe.execute()[2]
+        if count <= threshold:
+            return None
+        # one alert per key per window, across all workers
+        if not self._redis.set(f'{zkey}:fired', 1, nx=True, ex=int(window)):
+            return None
+        return count
+
+
+_windows = None
+_windows_lock = threading.Lock()
+
+def get_windows():
+    global _windows
+    if _windows is None:
+        with _windows_lock:
+            if _windows is None:
+                backend = getattr(settings, 'MONITORING_STREAM_BACKEND', 'memory')
+                if backend == 'redis':
+                    _windows = RedisWindows(getattr(settings, 'MONITORING_STREAM_REDIS_URL',
+                                                    'redis://localhost:6379/0'))
+                else:
+                    _windows = MemoryWindows()
+    return _windows
+
+
+def observe(actor, action, timestamp=None):
+    """Feed one audit event to the streaming detectors. Never raises."""
+    if actor is None or not getattr(settings, 'MONITORING_STREAM_DETECTION', True):
+        return []
+    epoch = timestamp.timestamp() if timestamp else time.time()
+    raised = []
+    try:
+        windows = get_windows()
+        for detector in STREAM_DETECTORS:
+            if not detector.matches(action):
+                continue
+            # windows count whole buckets, as WindowCountDetector.scan does, so both
+            # paths cross the threshold in the same bucket and agree on the dedup key
+            at = epoch // detector.bucket_seconds * detector.bucket_seconds
+            count = windows.hit(f'{detector.name}:{actor.pk}', at,
+                                detector.window.total_seconds(), detector.threshold)
+            if count is None:
+                continue
+            raised.append(Alert(
+                user=actor, action=detector.name, severity=detector.severity,
+                description=detector.description.format(email=actor.email, count=count),
+                dedup_key=dedup_key(detector.name, actor.pk, at, detector.dedupe_window),
+            ))
+        if raised:
+            raised = upsert_alerts(raised)
+            broadcast_new_alerts(raised)
+    except Exception:
+        logger.exception("Streaming detection failed for %s/%s", getattr(actor, 'pk', None), action)
+    return raised
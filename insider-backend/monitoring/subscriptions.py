@@ -0,0 +1,175 @@
+# monitoring/subscriptions.py
+"""
+Filtered subscriptions to the alert stream.
+
+A websocket client subscribes with a filter:
+  severity    lowest severity to receive (low, medium, high)
+  department  department names
+  action      alert actions (detector names)
+  user        user ids
+Every distinct filter is one channel layer group, named after a hash of the
+normalized filter, and the empty filter is the plain 'alerts' group. Sockets
+with the same filter share the group, so monitoring.broadcast picks the
+matching events once per group and the channel layer serializes each message
+once per group, not once per socket.
+
+The broadcaster has to know which filters are in use, and it may run in
+another process (a Celery worker) than the sockets. The registry of active
+groups (one per stream: 'alerts' here, 'audit' for monitoring.audit_tail)
+is therefore kept, like the streaming windows, in one of two backends:
+  memory  this process only (consumers and broadcaster in one process)
+  redis   shared by every web and Celery process (default)
+Consumers refresh their entry every REFRESH seconds, so a group left behind
+by a crashed process is ignored after EXPIRY seconds.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+
+SEVERITY_RANK = {'low': 0, 'medium': 1, 'high': 2}
+FILTER_KEYS = ('severity', 'department', 'action', 'user')
+BASE_GROUP = 'alerts'
+REFRESH = 60
+EXPIRY = 3 * REFRESH
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def _values(raw):
+    """'a,b', ['a', 'b'] or ['a,b'] (a repeated query parameter) -> ['a', 'b']"""
+    if raw in (None, ''):
+        return []
+    items = raw if isinstance(raw, (list, tuple)) else [raw]
+    values = {v.strip() for item in items for v in str(item).split(',')}
+    values.discard('')
+    return sorted(values)
+
+
+def normalize(raw):
+    """A client filter (dict of strings or lists) -> canonical filter dict, empty keys dropped."""
+    unknown = set(raw) - set(FILTER_KEYS)
+    if unknown:
+        raise InvalidFilter(f"Unknown filter: {', '.join(sorted(unknown))}.")
+    spec = {}
+    severity = raw.get('severity')
+    if severity:
+        if severity not in SEVERITY_RANK:
+            raise InvalidFilter(f"severity must be one of {', '.join(SEVERITY_RANK)}.")
+        if severity != 'low':   # low is everything
+            spec['severity'] = severity
+    for key in ('department', 'action'):
+        values = _values(raw.get(key))
+        if values:
+            spec[key] = values
+    users = _values(raw.get('user'))
+    if users:
+        try:
+            spec['user'] = sorted(int(u) for u in users)
+        except ValueError:
+            raise InvalidFilter('user must be a list of user ids.')
+    return spec
+
+
+def group_name(spec, base=BASE_GROUP):
+    if not spec:
+        return base
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:20]
+    return f'{base}.{digest}'
+
+
+def matches(spec, context):
+    """
+    Whether an event with context {'severity', 'action', 'user_id', 'department'}
+    passes the filter. A None in the context (say, the action of an incident)
+    only passes filters that do not constrain that key.
+    """
+    if 'severity' in spec and SEVERITY_RANK.get(context.get('severity'), -1) < SEVERITY_RANK[spec['severity']]:
+        return False
+    for key, field in (('department', 'department'), ('action', 'action'), ('user', 'user_id')):
+        if key in spec and context.get(field) not in spec[key]:
+            return False
+    return True
+
+
+class MemorySubscriptions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}   # group -> [filter, sockets]
+
+    def add(self, group, spec):
+        with self._lock:
+            self._groups.setdefault(group, [spec, 0])[1] += 1
+
+    def remove(self, group):
+        with self._lock:
+            entry = self._groups.get(group)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._groups[group]
+
+    def touch(self, group):
+        pass
+
+    def active(self):
+        with self._lock:
+            return {group: spec for group, (spec, _) in self._groups.items()}
+
+
+class RedisSubscriptions:
+    PREFIX = 'monitoring:subs:'
+
+    def __init__(self, url, stream):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+        self.stream = stream
+
+    def _key(self, name):
+        return f'{self.PREFIX}{self.stream}:{name}'
+
+    def add(self, group, spec):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._key('filters'), group, json.dumps(spec))
+        pipe.hincrby(self._key('sockets'), group, 1)
+        pipe.zadd(self._key('seen'), {group: time.time()})
+        pipe.execute()
+
+    def remove(self, group):
+        if self._redis.hincrby(self._key('sockets'), group, -1) <= 0:
+            pipe = self._redis.pipeline()
+            pipe.hdel(self._key('sockets'), group)
+            pipe.hdel(self._key('filters'), group)
+            pipe.zrem(self._key('seen'), group)
+            pipe.execute()
+
+    def touch(self, group):
+        self._redis.zadd(self._key('seen'), {group: time.time()})
+
+    def active(self):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hgetall(self._key('filters'))
+        pipe.zrangebyscore(self._key('seen'), time.time() - EXPIRY, '+inf')
+        filters, live = pipe.execute()
+        live = set(live)
+        return {group.decode(): json.loads(spec) for group, spec in filters.items() if group in live}
+
+
+_registries = {}
+_registry_lock = threading.Lock()
+
+
+def get_registry(stream=BASE_GROUP):
+    if stream not in _registries:
+        with _registry_lock:
+            if stream not in _registries:
+                if getattr(settings, 'MONITORING_SUBSCRIPTION_BACKEND', 'redis') == 'redis':
+                    _registries[stream] = RedisSubscriptions(
+                        getattr(settings, 'MONITORING_SUBSCRIPTION_REDIS_URL', 'redis://localhost:6379/0'), stream)
+                else:
+                    _registries[stream] = MemorySubscriptions()
+    return _registries[stream]
@@ -0,0 +1,274 @@
+# monitoring/tailer.py
+"""
+Tail local log files into AuditLog.
+
+Each configured source is a path plus a parser name. A Tail keeps the file
+open and reads new complete lines through mmap, which covers both the initial
+catch-up over a large backlog and the small increments seen while following
+the file (the file is polled with os.stat; no inotify binding is needed).
+Lines are parsed into ingest records and written in batches through
+users.ingest.Ingestor.
+
+Every batch is inserted in the same transaction that moves the source's
+LogSourceCheckpoint (device, inode, byte offset) past it, so a restart resumes
+exactly after the last committed line. Rotation is detected by a change of
+inode under the path: the old file is read to its end before switching to the
+new one, and if the process was down across a rotation the old file is looked
+up by inode among its rotated siblings (app.log.1, app.log-20260101, ...).
+A file that is truncated or rewritten in place (copytruncate) is noticed by its
+size dropping below the offset or by a changed hash of its first bytes, and is
+read again from the start.
+
+Parsers are registered with @parser(name); a source may also name a dotted
+path to any callable taking a line (bytes) and returning an ingest record
+dict, or None to skip the line.
+
+The syslog parser maps sshd logins and sudo commands to actions of their own
+and every other program to the single action 'syslog', with the program in
+metadata. Their actor is a unix username, which only resolves to a user when
+AUDIT_LOG_USER_DOMAIN is set: 'jane' then becomes jane@<domain>. Without it,
+and for names that match no user's email, the event is stored without an
+actor (the name is kept in metadata) and the per-user detectors do not see it.
+"""
+import glob
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from monitoring.models import LogSourceCheckpoint
+from users.ingest import Ingestor, Rejected
+
+logger = logging.getLogger(__name__)
+
+PARSERS = {}
+FINGERPRINT_BYTES = 256
+
+
+def parser(name):
+    def wrap(fn):
+        PARSERS[name] = fn
+        return fn
+    return wrap
+
+
+def get_parser(name):
+    return PARSERS[name] if name in PARSERS else import_string(name)
+
+
+@parser('json')
+def parse_json(line):
+    return json.loads(line)
+
+
+SYSLOG_RE = re.compile(
+    rb'^(?:<\d+>(?:1 )?)?'
+    rb'(?P<ts>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\S+)\s+'
+    rb'(?P<host>\S+)\s+(?P<prog>[^\s:\[]+)(?:\[(?P<pid>\d+)\])?:\s?(?P<msg>.*)$'
+)
+SSH_RE = re.compile(r'^(?P<result>Accepted|Failed) \S+ for (?:invalid user )?(?P<user>\S+) from (?P<ip>\S+)')
+SUDO_RE = re.compile(r'^\s*(?P<user>\S+) : .*COMMAND=(?P<command>.*)$')
+
+
+def _syslog_time(raw):
+    if raw[:1].isdigit():
+        return raw   # RFC 5424 / ISO 8601, parsed by ingest
+    now = timezone.localtime()
+    try:
+        at = datetime.strptime(f"{now.year} {raw}", '%Y %b %d %H:%M:%S')
+    except ValueError:
+        raise Rejected('bad syslog timestamp')
+    if at > now.replace(tzinfo=None) + timedelta(days=1):
+        at = at.replace(year=now.year - 1)   # RFC 3164 has no year; December lines read in January
+    return timezone.make_aware(at).isoformat()
+
+
+def _unix_user(name):
+    domain = getattr(settings, 'AUDIT_LOG_USER_DOMAIN', None)
+    return f'{name}@{domain}' if domain and '@' not in name else name
+
+
+@parser('syslog')
+def parse_syslog(line):
+    m = SYSLOG_RE.match(line)
+    if m is None:
+        raise Rejected('not a syslog line')
+    prog = m['prog'].decode('utf-8', 'replace')
+    msg = m['msg'].decode('utf-8', 'replace')
+    record = {
+        'action': 'syslog',
+        'timestamp': _syslog_time(m['ts'].decode()),
+        'source': 'syslog',
+        'metadata': {'host': m['host'].decode('utf-8', 'replace'), 'program': prog, 'message': msg[:1000]},
+    }
+    if prog == 'sshd' and (ssh := SSH_RE.match(msg)):
+        record.update(action='login' if ssh['result'] == 'Accepted' else 'login_failed',
+                      actor=_unix_user(ssh['user']), ip=ssh['ip'])
+    elif prog == 'sudo' and (sudo := SUDO_RE.match(msg)):
+        record.update(action='sudo_command', actor=_unix_user(sudo['user']))
+    return record
+
+
+def _identity(st):
+    return st.st_dev, st.st_ino
+
+
+class Tail:
+    """One followed file and its checkpoint."""
+
+    def __init__(self, path, parse, batch_size=None):
+        self.path = os.path.abspath(path)
+        self.parse = parse
+        self.batch_size = batch_size
+        self.checkpoint, _ = LogSourceCheckpoint.objects.get_or_create(path=self.path)
+        self.fh = None
+        self.offset = 0
+        self.bytes_read = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def _open(self, path, offset):
+        self.close()
+        self.fh = open(path, 'rb')
+        self.identity = _identity(os.fstat(self.fh.fileno()))
+        self.offset = offset
+
+    def _head(self, size=FINGERPRINT_BYTES):
+        """'<length>:<sha1>' of the file's first bytes (fewer while the file is short)."""
+        self.fh.seek(0)
+        data = self.fh.read(size)
+        return f'{len(data)}:{hashlib.sha1(data).hexdigest()}'
+
+    def _rewritten(self, size):
+        fingerprint = self.checkpoint.fingerprint
+        if size < self.offset:
+            return True
+        return bool(fingerprint) and self._head(int(fingerprint.split(':')[0])) != fingerprint
+
+    def _rotated_file(self, identity):
+        """The file that used to be self.path, found by inode among its rotated siblings."""
+        for candidate in glob.glob(glob.escape(self.path) + '?*'):
+            try:
+                if _identity(os.stat(candidate)) == identity:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def _resume(self, st):
+        cp = self.checkpoint
+        saved = (cp.device, cp.inode)
+        if not cp.inode or saved == _identity(st):
+            self._open(self.path, cp.offset)
+            if self._rewritten(st.st_size):
+                self.offset = 0
+            return
+        old = self._rotated_file(saved)
+        if old is not None:
+            self._open(old, cp.offset)
+            self._drain(final=True)
+        else:
+            logger.warning("%s was rotated while stopped and the old file is gone; "
+                           "lines after offset %s were not ingested", self.path, cp.offset)
+        self._open(self.path, 0)
+
+    def poll(self):
+        """Read whatever is new; return the number of bytes consumed."""
+        before = self.bytes_read
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None   # between rotate and create; keep reading the open file
+        if self.fh is None:
+            if st is None:
+                return 0
+            self._resume(st)
+        elif st is not None and _identity(st) != self.identity:
+            self._drain(final=True)
+            self._open(self.path, 0)
+        elif st is not None and self._rewritten(st.st_size):
+            logger.info("%s was truncated, reading from the start", self.path)
+            self.offset = 0
+        self._drain()
+        return self.bytes_read - before
+
+    def _lines(self, final):
+        """(line, end offset) for each complete line after self.offset."""
+        size = os.fstat(self.fh.fileno()).st_size
+        if size <= self.offset:
+            return
+        with mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = self.offset
+            while pos < size:
+                end = mm.find(b'\n', pos, size)
+                if end < 0:
+                    if final:   # a rotated file will not get the rest of its last line
+                        yield mm[pos:size], size
+                    return
+                yield mm[pos:end], end + 1
+                pos = end + 1
+
+    def _drain(self, final=False):
+        ingestor = Ingestor(self.batch_size, parse=self.parse)
+        start = self.offset
+        for line, end in self._lines(final):
+            ingestor.feed(end, line)
+            self.offset = end
+            if ingestor.full:
+                self._commit(ingestor)
+        cp = self.checkpoint
+        if ingestor.pending or self.offset != cp.offset or (cp.device, cp.inode) != self.identity:
+            self._commit(ingestor)
+        self.bytes_read += self.offset - start
+        self.accepted += sum(b['accepted'] for b in ingestor.batches)
+        self.rejected += ingestor.rejected
+        for error in ingestor.errors[:5]:
+            logger.warning("%s: line ending at byte %s: %s", self.path, error['line'], error['error'])
+
+    def _commit(self, ingestor):
+        cp = self.checkpoint
+        cp.device, cp.inode = self.identity
+        cp.offset = self.offset
+        cp.fingerprint = self._head()
+        with transaction.atomic():
+            ingestor.write()
+            cp.save(update_fields=['device', 'inode', 'offset', 'fingerprint', 'updated_at'])
+
+
+def follow(sources, interval=1.0, once=False, batch_size=None, report=None):
+    """
+    Tail [(path, parser name)] until interrupted, or until caught up with once=True.
+    report(tail, bytes, seconds) is called after every poll that read something.
+    """
+    tails = [Tail(path, get_parser(name), batch_size) for path, name in sources]
+    try:
+        while True:
+            busy = False
+            for tail in tails:
+                started = time.perf_counter()
+                consumed = tail.poll()
+                if consumed:
+                    busy = True
+                    if report:
+                        report(tail, consumed, time.perf_counter() - started)
+            if once and not busy:
+                return tails
+            if not busy:
+                time.sleep(interval)
+    finally:
+        for tail in tails:
+            tail.close()
@@ -12,3 +12,21 @@ def run_all_detections_task():
         infer_and_record(window_minutes=15)
     except Exception as e:
         import logging; logging.exception("ML inference failed: %s", e)
+
+
+@shared_task(name='monitoring.rollup_audit_logs')
+def rollup_audit_logs_task():
+    from .rollups import rollup
+    return rollup()
+
+
+@shared_task(name='monitoring.archive_audit_logs')
+def archive_audit_logs_task():
+    from .rollups import archive
+    return len(archive())
+
+
+@shared_task(name='monitoring.reconcile_kpis')
+def reconcile_kpis_task():
+    from .kpis import reconcile
+    reconcile()
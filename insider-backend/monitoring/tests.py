@@ -1,3 +1,1203 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from monitoring import (analytics, audit_tail, broadcast, engine, event_log, export, incidents, kpis, rollups,
+                        streaming, subscriptions, tailer)
+from monitoring.alerts import bucket_start, dedup_key, upsert_alerts
+from monitoring.consumers import AlertConsumer, AuditTailConsumer
+from monitoring.detectors import REGISTRY, DetectorTimeout, check_deadline
+from monitoring.event_log import MemoryEventLog, sort_key
+from monitoring.management.commands.run_detection import window_chunks
+from monitoring.models import (Alert, AuditArchive, AuditRollup, DetectorCheckpoint, DetectorRun, DirtyRollupHour,
+                               Incident, LogSourceCheckpoint)
+from monitoring.rules import RuleSet, SequenceRule, Step
+from users import actions, audit
+from users.models import AuditLog, Department, Resource, User
+
+# EXPLAIN output naming an index read, on SQLite and PostgreSQL
+INDEX_MARKERS = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY',
+                 'Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+# one action per category the detectors filter on, so no source() is an empty IN ()
+ACTIONS = ('login', 'logout', 'otp_failed', 'view_resource', 'download_resource',
+           'delete_resource', 'assign_permission')
+# the settings point the shared caches at Redis; tests keep them in the process
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def isolate(test):
+    """Fresh per-process state for one test: vocabulary, incident index, in-memory KPI counters, no websocket."""
+    actions.clear_cache()
+    test.addCleanup(actions.clear_cache)
+    incidents.index.clear()
+    test.addCleanup(incidents.index.clear)
+    for target, name, value in ((broadcast, '_coalescer', mock.Mock()), (kpis, '_counters', kpis.MemoryCounters())):
+        patcher = mock.patch.object(target, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class MonitoringTestCase(TestCase):
+    def setUp(self):
+        isolate(self)
+        # cached once committed, as in production
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ACTIONS:
+                actions.code(name)
+        self.base = timezone.now().replace(second=0, microsecond=0) - timedelta(hours=3)
+
+    def log(self, actor, action, minutes=0, resource=None):
+        return AuditLog.objects.create(actor=actor, action=action, resource=resource,
+                                       timestamp=self.base + timedelta(minutes=minutes))
+
+
+class DetectorQueryPlanTests(MonitoringTestCase):
+    """Each detector reads new rows by id range and backfills by time range through an index."""
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == 'postgresql':
+            # the test tables are empty; ask whether an index can serve the query at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, qs):
+        plan = qs.explain()
+        self.assertTrue(any(marker in plan for marker in INDEX_MARKERS), f'full scan:\n{plan}')
+
+    def test_incremental_reads_use_an_index(self):
+        for name, detector in REGISTRY.items():
+            with self.subTest(detector=name):
+                self.assertUsesIndex(detector.source().filter(id__gt=1000, id__lte=11000))
+
+    def test_backfill_reads_use_an_index(self):
+        end = timezone.now()
+        for name, detector in REGISTRY.items():
+            with self.subTest(detector=name):
+                self.assertUsesIndex(detector.source().filter(timestamp__gte=end - timedelta(days=1),
+                                                              timestamp__lt=end))
+
+
+class WindowCountDetectorTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.detector = REGISTRY['otp_failed']   # more than 5 in 15 minutes
+        self.user = User.objects.create_user('otp@example.com', 'pw')
+        self.stats = {'rows': 0}
+
+    def scan(self, qs, state, now_minutes):
+        return self.detector.scan(qs, state, self.base + timedelta(minutes=now_minutes), self.stats)
+
+    def test_flags_more_than_threshold_inside_the_window(self):
+        for minute in range(5):
+            self.log(self.user, 'otp_failed', minute)
+        self.log(self.user, 'login', 5)
+        self.assertEqual(self.scan(self.detector.source(), {}, 5), [])
+
+        self.log(self.user, 'otp_failed', 6)
+        findings = self.scan(self.detector.source(), {}, 6)
+        self.assertEqual([(f.actor_id, f.count) for f in findings], [(self.user.pk, 6)])
+        self.assertEqual(self.stats['rows'], 11)
+
+    def test_state_carries_counts_between_incremental_scans(self):
+        first = [self.log(self.user, 'otp_failed', m).pk for m in range(3)]
+        state = {}
+        self.assertEqual(self.scan(self.detector.source().filter(pk__in=first), state, 2), [])
+        self.assertEqual(sum(state[str(self.user.pk)].values()), 3)
+
+        later = [self.log(self.user, 'otp_failed', m).pk for m in range(3, 6)]
+        findings = self.scan(self.detector.source().filter(pk__in=later), state, 5)
+        self.assertEqual([f.count for f in findings], [6])
+
+    def test_rows_outside_the_window_do_not_count(self):
+        for minute in (0, 1, 2, 20, 21, 22):
+            self.log(self.user, 'otp_failed', minute)
+        self.assertEqual(self.scan(self.detector.source(), {}, 22), [])
+
+    def test_backfill_reports_every_dedup_bucket_it_crosses(self):
+        for start in (0, 60, 120):
+            for minute in range(6):
+                self.log(self.user, 'otp_failed', start + minute)
+        findings = self.scan(self.detector.source(), {}, 126)
+        keys = {dedup_key(self.detector.name, f.actor_id, f.at, self.detector.dedupe_window) for f in findings}
+        self.assertEqual(len(findings), 3)
+        self.assertEqual(len(keys), 3)
+
+    def test_state_forgets_buckets_older_than_the_window(self):
+        self.log(self.user, 'otp_failed', 0)
+        state = {}
+        self.scan(self.detector.source(), state, 0)
+        self.assertIn(str(self.user.pk), state)
+        self.scan(self.detector.source().none(), state, 17)
+        self.assertEqual(state, {})
+
+
+class BackfillTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('backfill@example.com', 'pw')
+        for start in (0, 60):
+            for minute in range(6):
+                self.log(self.user, 'otp_failed', start + minute)
+
+    def backfill(self, *args):
+        out = StringIO()
+        call_command('run_detection', '--since', self.base.isoformat(), '--workers', '1',
+                     '--detector', 'otp_failed', *args, stdout=out)
+        return out.getvalue()
+
+    def test_backfill_creates_one_alert_per_bucket_once(self):
+        out = self.backfill()
+        self.assertIn('otp_failed: 2 finding(s)', out)
+        self.assertIn('Created 2 alert(s).', out)
+        self.assertEqual(Alert.objects.filter(user=self.user, action='otp_failed').count(), 2)
+        self.assertIn('Created 0 alert(s).', self.backfill())
+
+    def test_dry_run_creates_nothing(self):
+        out = self.backfill('--dry-run')
+        self.assertIn('otp_failed: 2 finding(s)', out)
+        self.assertFalse(Alert.objects.exists())
+
+    def test_dry_run_needs_since(self):
+        with self.assertRaises(CommandError):
+            call_command('run_detection', '--dry-run', stdout=StringIO())
+
+    def test_window_chunks_align_to_the_detector_window(self):
+        detector = REGISTRY['otp_failed']
+        since = self.base + timedelta(seconds=30)
+        until = since + timedelta(days=2)
+        chunks = list(window_chunks(detector, since, until))
+        self.assertEqual((chunks[0][0], chunks[-1][1]), (since, until))
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(chunks, chunks[1:])))
+        step = detector.window.total_seconds()
+        self.assertTrue(all(end.timestamp() % step == 0 for _, end in chunks[:-1]))
+
+
+class AlertWriteTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alerts@example.com', 'pw')
+
+    def alert(self, key, severity='medium'):
+        return Alert(user=self.user, action='rapid_login', description='d', severity=severity, dedup_key=key)
+
+    def test_dedup_key_is_shared_inside_a_bucket(self):
+        window = timedelta(minutes=10)
+        start = bucket_start(self.base, window)
+        self.assertEqual(dedup_key('a', 1, start, window), dedup_key('a', 1, start + 599, window))
+        self.assertNotEqual(dedup_key('a', 1, start, window), dedup_key('a', 1, start + 600, window))
+        self.assertNotEqual(dedup_key('a', 1, start, window), dedup_key('a', 2, start, window))
+        self.assertEqual(dedup_key('a', 1, self.base, window), dedup_key('a', 1, self.base.timestamp(), window))
+
+    def test_upsert_inserts_each_key_once(self):
+        inserted = upsert_alerts([self.alert('k1'), self.alert('k2'), self.alert('k1')])
+        self.assertEqual(sorted(a.dedup_key for a in inserted), ['k1', 'k2'])
+        self.assertTrue(all(a.pk for a in inserted))
+
+        again = upsert_alerts([self.alert('k2'), self.alert('k3')])
+        self.assertEqual([a.dedup_key for a in again], ['k3'])
+        self.assertEqual(Alert.objects.count(), 3)
+
+    def test_upsert_attaches_new_alerts_to_one_incident(self):
+        inserted = upsert_alerts([self.alert('k1', 'low'), self.alert('k2', 'high')])
+        self.assertEqual(len({a.incident_id for a in inserted}), 1)
+        incident = Incident.objects.get()
+        self.assertEqual((incident.alert_count, incident.severity), (2, 'high'))
+
+
+@override_settings(MONITORING_INCIDENT_WINDOW=1800)
+class IncidentCorrelationTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('incident@example.com', 'pw')
+
+    def alerts(self, *minutes, severity='medium'):
+        # bulk_create skips the post_save correlation, so correlate() sees them first
+        made = Alert.objects.bulk_create([
+            Alert(user=self.user, action='rapid_login', description='d', severity=severity) for _ in minutes])
+        for alert, minute in zip(made, minutes):
+            alert.timestamp = self.base + timedelta(minutes=minute)
+            Alert.objects.filter(pk=alert.pk).update(timestamp=alert.timestamp)
+        return made
+
+    def test_alerts_close_together_share_an_incident(self):
+        first = self.alerts(0, 5)
+        incidents.correlate(first)
+        later = self.alerts(20, severity='high')
+        incidents.correlate(later)
+
+        incident = Incident.objects.get()
+        self.assertEqual({a.incident_id for a in first + later}, {incident.pk})
+        self.assertEqual((incident.alert_count, incident.severity), (3, 'high'))
+        self.assertEqual(incident.last_seen, self.base + timedelta(minutes=20))
+        self.assertTrue(first[0].opened_incident)
+
+    def test_a_gap_longer_than_the_window_opens_a_new_incident(self):
+        made = self.alerts(0, 10, 60)
+        attached = incidents.correlate(made)
+        self.assertEqual(sorted(len(run) for run in attached.values()), [1, 2])
+        self.assertEqual(Incident.objects.count(), 2)
+
+    def test_open_incident_is_found_in_the_database_after_a_restart(self):
+        incidents.correlate(self.alerts(0))
+        incidents.index.clear()
+        later = self.alerts(10)
+        incidents.correlate(later)
+        self.assertEqual(Incident.objects.count(), 1)
+        self.assertEqual(later[0].incident_id, Incident.objects.get().pk)
+
+    def test_closed_incident_is_not_extended(self):
+        incidents.correlate(self.alerts(0))
+        Incident.objects.update(status='closed')   # closed elsewhere; the index still has it
+        later = self.alerts(10)
+        incidents.correlate(later)
+        self.assertEqual(Incident.objects.filter(status='open').count(), 1)
+        self.assertTrue(later[0].opened_incident)
+
+    @skipUnless(connection.vendor == 'postgresql', 'row locks are only taken on PostgreSQL')
+    def test_user_rows_are_locked_without_blocking_foreign_key_inserts(self):
+        with CaptureQueriesContext(connection) as queries:
+            incidents.correlate(self.alerts(0))
+        locks = [q['sql'] for q in queries if ' FOR ' in q['sql']]
+        self.assertEqual(len(locks), 1)
+        self.assertIn('FOR NO KEY UPDATE', locks[0])
+
+
+class RuleSetTests(TestCase):
+    def setUp(self):
+        self.rules = RuleSet([
+            SequenceRule('login_delete_logout', [Step(action='login'), Step(category=actions.DELETE),
+                                                 Step(action='logout')], within=timedelta(minutes=10)),
+            SequenceRule('cross_read_delete', [Step(category=actions.READ, cross_department=True),
+                                               Step(category=actions.DELETE)], within=timedelta(minutes=30)),
+        ])
+
+    def feed(self, state, events, cross=False):
+        completed = []
+        for action, epoch in events:
+            completed += [r.name for r in self.rules.feed(state, 7, action, epoch, cross)]
+        return completed
+
+    def test_sequence_completes_within_the_window(self):
+        state = {}
+        done = self.feed(state, [('login', 0), ('view_resource', 60), ('delete_resource', 120), ('logout', 300)])
+        self.assertEqual(done, ['login_delete_logout'])
+        self.assertEqual(state, {})
+
+    def test_sequence_slower_than_the_window_does_not_complete(self):
+        state = {}
+        self.assertEqual(self.feed(state, [('login', 0), ('delete_resource', 60), ('logout', 601)]), [])
+
+    def test_a_later_start_keeps_the_match_alive(self):
+        state = {}
+        done = self.feed(state, [('login', 0), ('login', 500), ('delete_resource', 550), ('logout', 1000)])
+        self.assertEqual(done, ['login_delete_logout'])
+
+    def test_one_event_advances_a_rule_by_one_step(self):
+        rules = RuleSet([SequenceRule('twice', [Step(action='login'), Step(action='login')],
+                                      within=timedelta(minutes=1))])
+        state = {}
+        self.assertEqual(rules.feed(state, 1, 'login', 0), [])
+        self.assertEqual([r.name for r in rules.feed(state, 1, 'login', 10)], ['twice'])
+
+    def test_cross_department_step_needs_the_context(self):
+        state = {}
+        self.assertEqual(self.feed(state, [('view_resource', 0), ('delete_resource', 10)]), [])
+        self.assertEqual(self.feed(state, [('view_resource', 20)], cross=True), [])
+        self.assertEqual(self.feed(state, [('delete_resource', 30)]), ['cross_read_delete'])
+
+    def test_prune_drops_partial_matches_that_cannot_complete(self):
+        state = {}
+        self.feed(state, [('login', 0), ('view_resource', 100)], cross=True)
+        self.rules.prune(state, 700)
+        self.assertEqual(list(state['7']), ['cross_read_delete'])
+        self.rules.prune(state, 100 + 1801)
+        self.assertEqual(state, {})
+
+
+class SequenceRulesDetectorTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.detector = REGISTRY['sequence_rules']
+        finance, hr = Department.objects.create(name='Finance'), Department.objects.create(name='HR')
+        self.user = User.objects.create_user('seq@example.com', 'pw', department=finance)
+        self.own = Resource.objects.create(name='budget.xlsx', path='/finance/budget.xlsx', department=finance)
+        self.other = Resource.objects.create(name='salaries.xlsx', path='/hr/salaries.xlsx', department=hr)
+
+    def scan(self, state, now_minutes):
+        return [(f.spec.name, f.actor_id) for f in
+                self.detector.scan(self.detector.source(), state, self.base + timedelta(minutes=now_minutes),
+                                   {'rows': 0})]
+
+    def test_rules_complete_over_the_logged_rows(self):
+        self.log(self.user, 'login', 0)
+        self.log(self.user, 'delete_resource', 2, self.own)
+        self.log(self.user, 'logout', 4)
+        self.assertEqual(self.scan({}, 4), [('suspicious_sequence', self.user.pk)])
+
+    def test_cross_department_reads_are_told_apart_by_the_resource(self):
+        self.log(self.user, 'view_resource', 0, self.own)
+        self.log(self.user, 'delete_resource', 1, self.own)
+        self.assertEqual(self.scan({}, 1), [])
+        self.log(self.user, 'view_resource', 2, self.other)
+        self.log(self.user, 'delete_resource', 3, self.own)
+        self.assertIn(('cross_department_delete', self.user.pk), self.scan({}, 3))
+
+    def test_partial_matches_carry_over_in_the_state(self):
+        self.log(self.user, 'login', 0)
+        state = {}
+        self.assertEqual(self.scan(state, 0), [])
+        self.assertIn(str(self.user.pk), state)
+        AuditLog.objects.all().delete()
+        self.log(self.user, 'delete_resource', 1, self.own)
+        self.log(self.user, 'logout', 2)
+        self.assertEqual(self.scan(state, 2), [('suspicious_sequence', self.user.pk)])
+
+
+class StreamingTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(streaming, '_windows', streaming.MemoryWindows())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('stream@example.com', 'pw')
+        self.detector = REGISTRY['otp_failed']
+
+    def observe(self, n, action='otp_failed', seconds=0):
+        raised = []
+        for i in range(n):
+            raised += streaming.observe(self.user, action, self.base + timedelta(seconds=seconds + i))
+        return raised
+
+    def test_crossing_the_threshold_raises_one_alert_per_window(self):
+        self.assertEqual(self.observe(5), [])
+        raised = self.observe(1, seconds=10)
+        self.assertEqual([(a.action, a.severity, a.user_id) for a in raised], [('otp_failed', 'high', self.user.pk)])
+        self.assertEqual(raised[0].dedup_key,
+                         dedup_key('otp_failed', self.user.pk, self.base, self.detector.dedupe_window))
+        self.assertEqual(self.observe(3, seconds=20), [])
+        self.assertEqual(Alert.objects.count(), 1)
+
+    def test_the_detection_run_agrees_on_the_alert(self):
+        self.observe(6)
+        for _ in range(6):
+            self.log(self.user, 'otp_failed')
+        findings = self.detector.scan(self.detector.source(), {}, self.base, {'rows': 0})
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(engine.write_alerts(findings), [])
+        self.assertEqual(Alert.objects.count(), 1)
+
+    def test_other_actions_and_events_without_an_actor_are_ignored(self):
+        self.assertEqual(self.observe(10, action='view_resource'), [])
+        self.assertEqual([streaming.observe(None, 'otp_failed') for _ in range(10)], [[]] * 10)
+
+    def test_log_action_observes_the_event_once_committed(self):
+        with mock.patch.object(streaming, 'observe') as observe, \
+                mock.patch.object(audit, '_writer', mock.Mock()) as writer:
+            with self.captureOnCommitCallbacks(execute=True):
+                audit.log_action(self.user, 'otp_failed')
+                observe.assert_not_called()
+        observe.assert_called_once_with(self.user, 'otp_failed', mock.ANY)
+        writer.enqueue.assert_called_once()
+
+    @override_settings(MONITORING_STREAM_DETECTION=False)
+    def test_can_be_switched_off(self):
+        self.assertEqual(self.observe(10), [])
+
+    def test_idle_windows_are_forgotten(self):
+        windows = streaming.MemoryWindows()
+        windows.hit('idle', 0, 60, 5)
+        windows.hit('busy', 100, 60, 5)
+        self.assertEqual(set(windows._events), {'busy'})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RunDetectorsTests(TransactionTestCase):
+    """run_detectors reads on pool threads with their own connections, so the rows must be committed."""
+
+    def setUp(self):
+        isolate(self)
+        for name in ACTIONS:
+            actions.code(name)
+        self.user = User.objects.create_user('engine@example.com', 'pw')
+
+    def otp_failed(self, n=1, **kwargs):
+        return [AuditLog.objects.create(actor=self.user, action='otp_failed', **kwargs) for _ in range(n)]
+
+    def run_otp(self):
+        created = engine.run_detectors(names=['otp_failed'], broadcast=False)
+        return created, DetectorRun.objects.filter(detector='otp_failed').latest('id')
+
+    def test_each_run_reads_only_the_rows_past_the_checkpoint(self):
+        logs = self.otp_failed(6)
+        with self.assertLogs('monitoring.engine', 'WARNING'):
+            created, run = self.run_otp()
+        self.assertEqual([(a.action, a.user_id) for a in created], [('otp_failed', self.user.pk)])
+        self.assertEqual((run.status, run.rows_scanned, run.alerts_created), ('ok', 6, 1))
+        checkpoint = DetectorCheckpoint.objects.get(detector='otp_failed')
+        self.assertEqual(checkpoint.last_log_id, logs[-1].pk)
+
+        created, run = self.run_otp()
+        self.assertEqual((created, run.rows_scanned), ([], 0))
+
+        self.otp_failed()
+        created, run = self.run_otp()
+        # the window state carried the first six over; the alert for this bucket exists already
+        self.assertEqual((created, run.rows_scanned), ([], 1))
+        state = DetectorCheckpoint.objects.get(detector='otp_failed').state
+        self.assertEqual(sum(state[str(self.user.pk)].values()), 7)
+        self.assertEqual(Alert.objects.count(), 1)
+
+    def test_ids_missing_below_the_watermark_are_scanned_once_they_commit(self):
+        first = self.otp_failed()[0]
+        self.otp_failed(id=first.pk + 2)   # first.pk + 1 is still in flight
+        self.run_otp()
+        checkpoint = DetectorCheckpoint.objects.get(detector='otp_failed')
+        self.assertEqual(checkpoint.last_log_id, first.pk + 2)
+        self.assertEqual([r[:2] for r in checkpoint.pending_ids], [[first.pk + 1, first.pk + 1]])
+
+        self.otp_failed(id=first.pk + 1)
+        _, run = self.run_otp()
+        self.assertEqual(run.rows_scanned, 1)
+        self.assertEqual(DetectorCheckpoint.objects.get(detector='otp_failed').pending_ids, [])
+
+    def test_gaps_older_than_the_grace_period_are_given_up(self):
+        first = self.otp_failed()[0]
+        self.otp_failed(id=first.pk + 2)
+        self.run_otp()
+        DetectorCheckpoint.objects.filter(detector='otp_failed').update(
+            pending_ids=[[first.pk + 1, first.pk + 1, timezone.now().timestamp() - engine.GAP_GRACE - 1]])
+        _, run = self.run_otp()
+        self.assertEqual(run.rows_scanned, 0)
+        self.assertEqual(DetectorCheckpoint.objects.get(detector='otp_failed').pending_ids, [])
+
+    def test_a_detector_past_its_timeout_keeps_its_checkpoint(self):
+        self.otp_failed(6)
+        with mock.patch.object(REGISTRY['otp_failed'], 'timeout', 1e-9), \
+                self.assertLogs('monitoring.engine', 'ERROR') as logs:
+            created = engine.run_detectors(names=['otp_failed', 'rapid_login'], broadcast=False)
+        self.assertEqual(created, [])
+        self.assertIn('Detector otp_failed timed out', logs.output[0])
+        runs = dict(DetectorRun.objects.values_list('detector', 'status'))
+        self.assertEqual(runs, {'otp_failed': 'timeout', 'rapid_login': 'ok'})
+        self.assertEqual(list(DetectorCheckpoint.objects.values_list('detector', flat=True)), ['rapid_login'])
+
+        # the next pass picks the same rows up again
+        with self.assertLogs('monitoring.engine', 'WARNING'):
+            created, run = self.run_otp()
+        self.assertEqual((len(created), run.status, run.rows_scanned), (1, 'ok', 6))
+
+    def test_a_failing_detector_records_its_error(self):
+        self.otp_failed()
+        with mock.patch.object(REGISTRY['otp_failed'], 'scan', side_effect=RuntimeError('boom')), \
+                self.assertLogs('monitoring.engine', 'ERROR'):
+            _, run = self.run_otp()
+        self.assertEqual(run.status, 'error')
+        self.assertIn('RuntimeError: boom', run.error)
+        self.assertFalse(DetectorCheckpoint.objects.exists())
+
+
+class DeadlineTests(TestCase):
+    def test_check_deadline_raises_once_the_deadline_has_passed(self):
+        check_deadline({'rows': 0})
+        check_deadline({'deadline': time.monotonic() + 60})
+        with self.assertRaises(DetectorTimeout):
+            check_deadline({'deadline': time.monotonic() - 1})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RollupTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = override_settings(AUDIT_ARCHIVE_DIR=directory)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.directory = directory
+        self.user = User.objects.create_user('rollup@example.com', 'pw')
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=5)
+
+    def at(self, when, action='login', n=1):
+        return [AuditLog.objects.create(actor=self.user, action=action, timestamp=when) for _ in range(n)]
+
+    def counts(self):
+        return {(r.hour, actions.name(r.action_type_id)): r.count for r in AuditRollup.objects.all()}
+
+    def test_rollup_counts_each_hour_and_can_be_rerun(self):
+        self.at(self.hour + timedelta(minutes=10), n=3)
+        self.at(self.hour + timedelta(minutes=70), action='logout')
+        # hours that ended ROLLUP_GRACE before `now`
+        now = self.hour + timedelta(hours=5, minutes=30)
+        self.assertEqual(rollups.rollup(start=self.hour, now=now), (5, 2))
+        expected = {(self.hour, 'login'): 3, (self.hour + timedelta(hours=1), 'logout'): 1}
+        self.assertEqual(self.counts(), expected)
+        self.assertEqual(rollups.rolled_up_until(), self.hour + timedelta(hours=2))
+        rollups.rollup(start=self.hour, now=now)
+        self.assertEqual(self.counts(), expected)
+
+    def test_hours_marked_late_are_recomputed(self):
+        self.at(self.hour + timedelta(minutes=10))
+        rollups.rollup(start=self.hour)
+        late = self.at(self.hour + timedelta(minutes=20))[0]
+        rollups.mark_late([late.timestamp])
+        self.assertEqual(DirtyRollupHour.objects.get().hour, self.hour)
+        rollups.rollup()
+        self.assertEqual(self.counts(), {(self.hour, 'login'): 2})
+        self.assertFalse(DirtyRollupHour.objects.exists())
+
+    def test_archive_moves_old_days_to_files_and_keeps_their_rollups(self):
+        old = (timezone.now() - timedelta(days=100)).replace(hour=12, minute=0, second=0, microsecond=0)
+        logs = self.at(old, n=2) + self.at(old + timedelta(days=1), action='logout')
+        recent = self.at(self.hour)
+        rollups.rollup(start=old)
+        archives = rollups.archive(retention_days=90)
+
+        next_day = (old + timedelta(days=1)).date()
+        self.assertEqual([(a.day, a.rows) for a in archives], [(old.date(), 2), (next_day, 1)])
+        self.assertEqual(list(AuditLog.objects.values_list('id', flat=True)), [recent[0].pk])
+        with gzip.open(archives[0].path, 'rt') as fh:
+            rows = [json.loads(line) for line in fh]
+        self.assertEqual([(r['id'], r['action']) for r in rows], [(logs[0].pk, 'login'), (logs[1].pk, 'login')])
+        self.assertIn(f'date={old.date().isoformat()}', archives[0].path)
+        self.assertEqual(self.counts()[(old, 'login')], 2)
+        self.assertEqual(rollups.archive(retention_days=90), [])
+
+    def test_rows_arriving_for_an_archived_day_are_archived_and_counted_later(self):
+        old = (timezone.now() - timedelta(days=100)).replace(hour=12, minute=0, second=0, microsecond=0)
+        self.at(old)
+        rollups.rollup(start=old)
+        rollups.archive(retention_days=90)
+        late = self.at(old + timedelta(minutes=5))
+        rollups.mark_late([late[0].timestamp])
+        archives = rollups.archive(retention_days=90)
+        self.assertEqual([(a.day, a.rows) for a in archives], [(old.date(), 1)])
+        self.assertEqual(AuditArchive.objects.filter(day=old.date()).count(), 2)
+        self.assertEqual(self.counts()[(old, 'login')], 2)
+        self.assertFalse(AuditLog.objects.filter(timestamp__lt=self.hour).exists())
+
+    def test_archive_stops_when_the_rows_went_away(self):
+        old = (timezone.now() - timedelta(days=100)).replace(hour=12, minute=0, second=0, microsecond=0)
+        self.at(old)
+        rollups.rollup(start=old)
+        with mock.patch.object(rollups, '_chunks', return_value=iter([])):
+            self.assertEqual(rollups.archive(retention_days=90), [])
+        self.assertEqual(AuditLog.objects.count(), 1)
+        self.assertEqual(os.listdir(self.directory), [f'date={old.date().isoformat()}'])
+        self.assertEqual(os.listdir(os.path.join(self.directory, f'date={old.date().isoformat()}')), [])
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_archive_days_are_utc_days(self):
+        # 02:00 UTC is still the previous day in New York
+        old = (timezone.now() - timedelta(days=100)).replace(hour=2, minute=0, second=0, microsecond=0)
+        self.at(old)
+        rollups.rollup(start=old)
+        archives = rollups.archive(retention_days=90)
+        self.assertEqual([a.day for a in archives], [old.date()])
+        self.assertIn(f'date={old.date().isoformat()}', archives[0].path)
+
+
+class TailerTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'app.log')
+        self.user = User.objects.create_user('tail@example.com', 'pw')
+
+    def write(self, path, *actions_, end='\n'):
+        with open(path, 'a') as fh:
+            for action in actions_:
+                fh.write(f'{{"action": "{action}", "actor": "tail@example.com"}}{end}')
+
+    def tail(self):
+        tail = tailer.Tail(self.path, tailer.get_parser('json'))
+        self.addCleanup(tail.close)
+        return tail
+
+    def logged(self):
+        return [log.action for log in AuditLog.objects.order_by('id')]
+
+    def test_reads_complete_lines_and_saves_the_offset(self):
+        self.write(self.path, 'login', 'view_resource')
+        with open(self.path, 'a') as fh:
+            fh.write('{"action": "logout"')   # not terminated yet
+        tail = self.tail()
+        tail.poll()
+        self.assertEqual(self.logged(), ['login', 'view_resource'])
+        with open(self.path, 'a') as fh:
+            fh.write(', "actor": "tail@example.com"}\n')
+        tail.poll()
+        self.assertEqual(self.logged(), ['login', 'view_resource', 'logout'])
+        self.assertEqual(LogSourceCheckpoint.objects.get().offset, os.path.getsize(self.path))
+        self.assertEqual(set(AuditLog.objects.values_list('actor_id', flat=True)), {self.user.pk})
+
+    def test_rotation_drains_the_old_file_first(self):
+        self.write(self.path, 'login')
+        tail = self.tail()
+        tail.poll()
+        self.write(self.path, 'view_resource')        # written just before the rotation
+        os.rename(self.path, self.path + '.1')
+        self.write(self.path, 'logout')
+        tail.poll()
+        self.assertEqual(self.logged(), ['login', 'view_resource', 'logout'])
+
+    def test_restart_after_rotation_finds_the_old_file_by_inode(self):
+        self.write(self.path, 'login')
+        self.tail().poll()
+        self.write(self.path, 'view_resource')
+        os.rename(self.path, self.path + '-20260101')
+        self.write(self.path, 'logout')
+        self.tail().poll()   # a new process, resuming from the checkpoint
+        self.assertEqual(self.logged(), ['login', 'view_resource', 'logout'])
+
+    def test_truncated_file_is_read_from_the_start(self):
+        self.write(self.path, 'login', 'view_resource')
+        tail = self.tail()
+        tail.poll()
+        with open(self.path, 'w'):
+            pass
+        self.write(self.path, 'logout')
+        tail.poll()
+        self.assertEqual(self.logged(), ['login', 'view_resource', 'logout'])
+
+    def test_bad_lines_are_skipped(self):
+        self.write(self.path, 'login')
+        with open(self.path, 'a') as fh:
+            fh.write('not json\n')
+        self.write(self.path, 'logout')
+        tail = self.tail()
+        with self.assertLogs('monitoring.tailer', 'WARNING'):
+            tail.poll()
+        self.assertEqual(self.logged(), ['login', 'logout'])
+        self.assertEqual((tail.accepted, tail.rejected), (2, 1))
+
+    def test_syslog_programs_share_one_action(self):
+        for program in ('cron', 'systemd', 'kernel'):
+            record = tailer.parse_syslog(f'Jan  5 09:12:00 host1 {program}[12]: something happened'.encode())
+            self.assertEqual((record['action'], record['metadata']['program']), ('syslog', program))
+
+    def test_syslog_usernames_resolve_with_the_domain_setting(self):
+        line = (f'{timezone.now().isoformat()} host1 sshd[99]: '
+                f'Accepted publickey for tail from 10.0.0.9 port 22 ssh2').encode()
+        self.assertEqual(tailer.parse_syslog(line)['actor'], 'tail')
+        with override_settings(AUDIT_LOG_USER_DOMAIN='example.com'):
+            record = tailer.parse_syslog(line)
+        self.assertEqual((record['action'], record['actor'], record['ip']), ('login', 'tail@example.com', '10.0.0.9'))
+        with open(self.path, 'a') as fh:
+            fh.write(line.decode() + '\n')
+        tail = tailer.Tail(self.path, tailer.get_parser('syslog'))
+        self.addCleanup(tail.close)
+        with override_settings(AUDIT_LOG_USER_DOMAIN='example.com'):
+            tail.poll()
+        self.assertEqual(AuditLog.objects.get().actor_id, self.user.pk)
+
+
+class ExportTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('export@example.com', 'pw')
+        self.logs = [self.log(self.user, action, minutes) for minutes, action in
+                     enumerate(('login', 'view_resource', 'login', 'logout'))]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin@example.com', 'pw', is_staff=True))
+
+    def download(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        return response, b''.join(response.streaming_content)
+
+    def test_render_sends_the_first_line_at_once(self):
+        pieces = list(export.render(['id', 'at'], iter([(1, self.base), (2, None)]), 'csv'))
+        self.assertEqual(pieces[0], b'id,at\r\n')
+        self.assertEqual(b''.join(pieces), f'id,at\r\n1,{self.base.isoformat()}\r\n2,\r\n'.encode())
+
+    def test_gzip_holds_the_same_bytes(self):
+        rows = [(n, {'n': n}) for n in range(3000)]
+        plain = b''.join(export.render(['id', 'metadata'], iter(rows), 'ndjson'))
+        packed = list(export.render(['id', 'metadata'], iter(rows), 'ndjson', compress=True))
+        self.assertGreater(len(packed), 1)
+        self.assertEqual(gzip.decompress(b''.join(packed)), plain)
+        self.assertEqual(json.loads(plain.splitlines()[1]), {'id': 1, 'metadata': {'n': 1}})
+
+    def test_audit_logs_export_filters_and_selects_fields(self):
+        response, body = self.download('audit-log-export', action='login', fields='id,action,user')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('filename="audit-logs.csv"', response['Content-Disposition'])
+        expected = ['id,action,user'] + [f'{log.pk},login,export@example.com' for log in self.logs[::2]]
+        self.assertEqual(body.decode().splitlines(), expected)
+
+    def test_alerts_export_as_gzipped_ndjson(self):
+        alert = Alert.objects.create(user=self.user, action='rapid_login', description='d', severity='high')
+        Alert.objects.create(user=self.user, action='rapid_login', description='d', severity='low')
+        response, body = self.download('alert-export', output='ndjson', gzip='1', severity='high',
+                                       fields='id,user,severity')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual(rows, [{'id': alert.pk, 'user': 'export@example.com', 'severity': 'high'}])
+
+    def test_bad_requests_are_refused_before_streaming(self):
+        self.assertEqual(self.client.get(reverse('alert-export'), {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('audit-log-export'), {'fields': 'password'}).status_code, 400)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(reverse('audit-log-export')).status_code, 403)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class AnalyticsTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.user = User.objects.create_user('charts@example.com', 'pw')
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        self.until = self.hour + timedelta(hours=3)
+
+    def at(self, hours, action='login'):
+        return AuditLog.objects.create(actor=self.user, action=action, timestamp=self.hour + timedelta(hours=hours))
+
+    def series(self, metric='events', by='action', **kwargs):
+        return analytics.series(metric, by, 'hour', self.hour, self.until, **kwargs)
+
+    def test_events_come_from_rollups_then_raw_rows(self):
+        for hours, action in ((0, 'login'), (0, 'login'), (1, 'logout')):
+            self.at(hours, action)
+        rollups.rollup(start=self.hour, end=self.hour + timedelta(hours=2))
+        self.at(2)   # after the last rollup: counted from AuditLog
+        result = self.series()
+        self.assertEqual(result['series'], {'login': [2, 0, 1], 'logout': [0, 1, 0]})
+        self.assertEqual(result['totals'], {'login': 3, 'logout': 1})
+        self.assertEqual(self.series(by='category')['totals'], {actions.category('login'): 4})
+
+    def test_closed_buckets_are_cached_until_rollup_invalidates_them(self):
+        self.at(0)
+        rollups.rollup(start=self.hour, end=self.hour + timedelta(hours=2))
+        self.assertEqual(self.series()['series'], {'login': [1, 0, 0]})
+        AuditRollup.objects.all().delete()   # bypasses invalidation
+        self.assertEqual(self.series()['series'], {'login': [1, 0, 0]})
+        self.at(0)
+        rollups.rollup(start=self.hour, end=self.hour + timedelta(hours=2))
+        self.assertEqual(self.series()['series'], {'login': [2, 0, 0]})
+
+    def test_deleted_alerts_leave_the_cached_buckets(self):
+        alert = Alert.objects.create(user=self.user, action='rapid_login', description='d', severity='high')
+        Alert.objects.filter(pk=alert.pk).update(timestamp=self.hour + timedelta(minutes=5))
+        self.assertEqual(self.series('alerts', 'severity')['series'], {'high': [1, 0, 0]})
+        Alert.objects.get(pk=alert.pk).delete()
+        self.assertEqual(self.series('alerts', 'severity')['series'], {})
+
+    def test_top_keeps_the_largest_groups(self):
+        for action, n in (('login', 3), ('logout', 2), ('view_resource', 1)):
+            for _ in range(n):
+                self.at(2, action)
+        self.assertEqual(self.series(top=1)['totals'], {'login': 3, 'other': 3})
+
+
+class KpiCounterTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('kpi@example.com', 'pw')
+
+    def test_reconcile_counts_the_tables(self):
+        Alert.objects.bulk_create([
+            Alert(user=self.user, action='a', description='d', severity='high'),
+            Alert(user=self.user, action='b', description='d', severity='low', cleared=True),
+        ])
+        AuditLog.objects.create(actor=self.user, action='login')
+        kpis.reconcile()
+        summary = kpis.summary()
+        self.assertEqual(summary['open_alerts'], {'low': 0, 'medium': 0, 'high': 1, 'total': 1})
+        self.assertEqual((summary['alerts_24h'], summary['events_24h'], summary['events_total']), (2, 1, 1))
+        self.assertEqual(summary['top_risky_users'],
+                         [{'user_id': self.user.pk, 'email': self.user.email, 'risk_score': 5}])
+        self.assertFalse(summary['stale'])
+
+    def test_counters_follow_creates_and_clears_after_commit(self):
+        kpis.reconcile()
+        with self.captureOnCommitCallbacks(execute=True):
+            alert = Alert.objects.create(user=self.user, action='a', description='d', severity='medium')
+        self.assertEqual(kpis.summary()['open_alerts']['medium'], 1)
+
+        alert = Alert.objects.get(pk=alert.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            alert.cleared = True
+            alert.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            alert.save()   # saving again is not a second clear
+        self.assertEqual(kpis.summary()['open_alerts']['total'], 0)
+        self.assertEqual(kpis.summary()['top_risky_users'], [])
+
+    def test_increments_during_a_reconcile_survive_the_reset(self):
+        AuditLog.objects.create(actor=self.user, action='login')
+        bucket = kpis._bucket(timezone.now().timestamp())
+        count = AuditLog.objects.count
+
+        def racing_count():
+            kpis.get_counters().add_events({bucket: 4})   # a write committing while reconcile reads
+            return count()
+
+        with mock.patch.object(AuditLog.objects, 'count', racing_count):
+            kpis.reconcile()
+        self.assertEqual(kpis.summary()['events_total'], 5)
+
+    @mock.patch('monitoring.tasks.reconcile_kpis_task.delay')
+    def test_stale_counters_are_served_and_a_reconcile_is_queued(self, delay):
+        with override_settings(CACHES=LOCAL_CACHES):
+            caches['default'].clear()
+            summary = kpis.summary()
+            kpis.summary()
+        self.assertTrue(summary['stale'])
+        self.assertIsNone(summary['reconciled_at'])
+        delay.assert_called_once_with()
+
+    def test_summary_survives_a_counter_outage(self):
+        broken = mock.Mock(**{'read.side_effect': ConnectionError('redis is down')})
+        failing_cache = mock.Mock(**{'add.side_effect': ConnectionError('redis is down')})
+        with mock.patch.object(kpis, '_counters', broken), \
+                mock.patch.object(kpis, 'caches', {'default': failing_cache, 'monitoring': failing_cache}), \
+                self.assertLogs('monitoring.kpis', 'WARNING') as logs:
+            summary = kpis.summary()
+        self.assertEqual(summary['open_alerts']['total'], 0)
+        self.assertEqual((summary['events_total'], summary['top_risky_users'], summary['stale']), (0, [], True))
+        self.assertEqual(len(logs.records), 2)
+
+
+class AlertPaginationTests(MonitoringTestCase):
+    def test_link_header_walks_every_alert_once(self):
+        admin = User.objects.create_user('admin@example.com', 'pw', is_staff=True)
+        Alert.objects.bulk_create([Alert(user=admin, action='a', description='d') for _ in range(5)])
+        Alert.objects.update(timestamp=self.base)   # equal timestamps, ordered by id
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        seen, url = [], reverse('alert-list') + '?limit=2'
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [a['id'] for a in response.json()]
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        self.assertEqual(seen, sorted(Alert.objects.values_list('id', flat=True), reverse=True))
+
+
+class BroadcastTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        for target, name, value in ((event_log, '_log', MemoryEventLog(100)), (broadcast, '_send', mock.AsyncMock())):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.registry = subscriptions.MemorySubscriptions()
+        patcher = mock.patch.dict(subscriptions._registries, {subscriptions.BASE_GROUP: self.registry})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('ws@example.com', 'pw')
+
+    def alert(self, severity):
+        return Alert.objects.bulk_create([Alert(user=self.user, action='rapid_login', description='d',
+                                                severity=severity)])[0]
+
+    def sent(self):
+        return [message for call in broadcast._send.call_args_list for message in call.args[0]]
+
+    def test_events_are_queued_once_the_transaction_commits(self):
+        alert = self.alert('high')
+        with self.captureOnCommitCallbacks() as callbacks:
+            broadcast.alert_created(alert)
+            broadcast.alerts_cleared(3, [1, 2, 3])
+        broadcast._coalescer.add.assert_not_called()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(broadcast._coalescer.add.call_args_list,
+                         [mock.call(('alert', alert)), mock.call(('cleared', {'count': 3, 'ids': [1, 2, 3]}))])
+
+    def test_flush_numbers_the_events_and_sends_each_group_its_matches(self):
+        high = {'severity': 'high'}
+        finance = {'department': ['Finance']}
+        for spec in (high, finance):
+            self.registry.add(subscriptions.group_name(spec), spec)
+        incident = Incident.objects.create(user=self.user, severity='medium', first_seen=self.base,
+                                           last_seen=self.base, alert_count=2)
+        coalescer = broadcast.Coalescer(1, 500)
+        coalescer._queue.extend([('alert', self.alert('high')), ('alert', self.alert('low')),
+                                 ('incidents', [incident.pk]), ('incidents', [incident.pk]),
+                                 ('cleared', {'count': 2, 'ids': None})])
+        coalescer.flush()
+
+        messages = dict(self.sent())
+        base = messages.pop(subscriptions.BASE_GROUP)['events']
+        self.assertEqual([(e['id'], e['type']) for e in base], [
+            ('1', 'alert.created'), ('2', 'alert.created'), ('3', 'incident.updated'), ('4', 'alerts.cleared')])
+        self.assertEqual(base[0]['alert']['user_email'], 'ws@example.com')
+        self.assertEqual({group: [e['id'] for e in m['events']] for group, m in messages.items()}, {
+            subscriptions.group_name(high): ['1', '4'],
+            subscriptions.group_name(finance): ['4'],   # ws@ has no department
+        })
+
+    def test_flush_sends_one_message_per_batch(self):
+        coalescer = broadcast.Coalescer(1, 2)
+        coalescer._queue.extend(('cleared', {'count': n, 'ids': None}) for n in range(3))
+        coalescer.flush()
+        self.assertEqual(broadcast._send.await_count, 2)
+        self.assertEqual([len(m['events']) for _, m in self.sent()], [2, 1])
+
+
+class SubscriptionFilterTests(TestCase):
+    def test_filters_are_normalized(self):
+        spec = subscriptions.normalize({'severity': 'medium', 'department': ['HR', ' Finance', 'HR'],
+                                        'action': '', 'user': ['7', '3']})
+        self.assertEqual(spec, {'severity': 'medium', 'department': ['Finance', 'HR'], 'user': [3, 7]})
+        self.assertEqual(subscriptions.normalize({'severity': 'low'}), {})
+        self.assertEqual(subscriptions.normalize({'action': ['rapid_login,otp_failed']}),
+                         {'action': ['otp_failed', 'rapid_login']})
+
+    def test_bad_filters_are_refused(self):
+        for raw in ({'severity': 'urgent'}, {'user': ['me']}, {'colour': 'red'}):
+            with self.subTest(raw=raw), self.assertRaises(subscriptions.InvalidFilter):
+                subscriptions.normalize(raw)
+
+    def test_equal_filters_share_a_group(self):
+        a = subscriptions.normalize({'department': ['HR', 'Finance']})
+        b = subscriptions.normalize({'department': ['Finance', 'HR', 'HR']})
+        self.assertEqual(subscriptions.group_name(a), subscriptions.group_name(b))
+        self.assertNotEqual(subscriptions.group_name(a), subscriptions.group_name({'department': ['HR']}))
+        self.assertEqual(subscriptions.group_name({}), subscriptions.BASE_GROUP)
+
+    def test_matches(self):
+        context = {'severity': 'medium', 'action': 'rapid_login', 'user_id': 3, 'department': 'HR'}
+        self.assertTrue(subscriptions.matches({}, context))
+        self.assertTrue(subscriptions.matches({'severity': 'medium', 'department': ['HR'], 'user': [3]}, context))
+        self.assertFalse(subscriptions.matches({'severity': 'high'}, context))
+        self.assertFalse(subscriptions.matches({'action': ['otp_failed']}, context))
+        self.assertFalse(subscriptions.matches({'action': ['otp_failed']}, {**context, 'action': None}))
+
+
+class EventLogTests(TestCase):
+    def test_after_returns_newer_events_in_order(self):
+        log = MemoryEventLog(size=10)
+        ids = log.append([({'n': n}, None) for n in range(3)])
+        events, complete = log.after(ids[0])
+        self.assertTrue(complete)
+        self.assertEqual([e[1]['n'] for e in events], [1, 2])
+        self.assertEqual(log.after(ids[-1]), ([], True))
+
+    def test_after_reports_an_id_the_log_no_longer_reaches(self):
+        log = MemoryEventLog(size=2)
+        ids = log.append([({'n': n}, None) for n in range(5)])
+        self.assertEqual(log.after(ids[0]), ([], False))
+        self.assertEqual([e[0] for e in log.after(ids[2])[0]], ids[3:])
+        self.assertEqual(log.after('99'), ([], False))
+
+    def test_sort_key_orders_memory_and_stream_ids(self):
+        self.assertLess(sort_key('9'), sort_key('10'))
+        self.assertLess(sort_key('1767225600000-3'), sort_key('1767225600000-12'))
+        with self.assertRaises(ValueError):
+            sort_key('abc')
+
+
+class Socket(ApplicationCommunicator):
+    """A websocket client for a consumer (channels.testing needs daphne, which the app does not)."""
+
+    def __init__(self, consumer, path, user):
+        path, _, query = path.partition('?')
+        super().__init__(consumer.as_asgi(), {'type': 'websocket', 'path': path, 'query_string': query.encode(),
+                                              'headers': [], 'subprotocols': [], 'user': user})
+
+    async def connect(self):
+        """(accepted, close code)"""
+        await self.send_input({'type': 'websocket.connect'})
+        response = await self.receive_output(1)
+        return response['type'] == 'websocket.accept', response.get('code')
+
+    async def send_json(self, data):
+        await self.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self):
+        return json.loads((await self.receive_output(1))['text'])
+
+    async def disconnect(self):
+        await self.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.wait(1)
+
+
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS)
+class AlertConsumerTests(TestCase):
+    def setUp(self):
+        self.registry = subscriptions.MemorySubscriptions()
+        patcher = mock.patch.dict(subscriptions._registries, {subscriptions.BASE_GROUP: self.registry})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.log = MemoryEventLog(100)
+        patcher = mock.patch.object(event_log, '_log', self.log)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('socket@example.com', 'pw')
+
+    async def connect(self, query='', user=None):
+        socket = Socket(AlertConsumer, f'/ws/alerts/?{query}', user or self.user)
+        connected, code = await socket.connect()
+        return socket, connected, code
+
+    async def send_to(self, group, *events):
+        await get_channel_layer().group_send(group, {'type': 'alerts_batch', 'events': list(events)})
+
+    async def test_query_string_filter_joins_its_group(self):
+        socket, connected, _ = await self.connect('severity=high&department=Finance')
+        self.assertTrue(connected)
+        group = subscriptions.group_name({'severity': 'high', 'department': ['Finance']})
+        self.assertEqual(self.registry.active(), {group: {'severity': 'high', 'department': ['Finance']}})
+        await self.send_to(group, {'id': '1', 'type': 'alert.created'})
+        self.assertEqual(await socket.receive_json(),
+                         {'type': 'batch', 'events': [{'id': '1', 'type': 'alert.created'}]})
+        await socket.disconnect()
+        self.assertEqual(self.registry.active(), {})
+
+    async def test_query_string_values_may_be_comma_separated_or_repeated(self):
+        socket, connected, _ = await self.connect('department=Finance,HR&department=Legal')
+        self.assertTrue(connected)
+        spec = {'department': ['Finance', 'HR', 'Legal']}
+        self.assertEqual(self.registry.active(), {subscriptions.group_name(spec): spec})
+        await socket.disconnect()
+
+    async def test_subscribe_message_moves_the_socket(self):
+        socket, _, _ = await self.connect('severity=high')
+        await socket.send_json({'type': 'subscribe', 'filters': {'user': [self.user.pk]}})
+        self.assertEqual(await socket.receive_json(), {'type': 'subscribed', 'filters': {'user': [self.user.pk]}})
+        self.assertEqual(list(self.registry.active()), [subscriptions.group_name({'user': [self.user.pk]})])
+
+        await socket.send_json({'type': 'subscribe', 'filters': {'severity': 'urgent'}})
+        self.assertEqual((await socket.receive_json())['type'], 'error')
+        await socket.disconnect()
+
+    async def test_bad_filters_and_anonymous_users_are_closed(self):
+        _, connected, code = await self.connect('severity=urgent')
+        self.assertEqual((connected, code), (False, 4400))
+        _, connected, code = await self.connect(user=AnonymousUser())
+        self.assertEqual((connected, code), (False, 4001))
+
+    async def test_reconnect_replays_the_matching_events_it_missed(self):
+        ids = self.log.append([({'type': 'alert.created', 'n': 0}, {'severity': 'high'}),
+                               ({'type': 'alert.created', 'n': 1}, {'severity': 'low'}),
+                               ({'type': 'alert.created', 'n': 2}, {'severity': 'high'}),
+                               ({'type': 'alerts.cleared', 'n': 3}, None)])
+        socket, _, _ = await self.connect(f'severity=high&last_event_id={ids[0]}')
+        frame = await socket.receive_json()
+        self.assertEqual([(e['id'], e['n']) for e in frame['events']], [(ids[2], 2), (ids[3], 3)])
+
+        # live events the replay already covered are not sent twice
+        group = subscriptions.group_name({'severity': 'high'})
+        await self.send_to(group, {'id': ids[3], 'type': 'alerts.cleared'}, {'id': '5', 'type': 'alert.created'})
+        self.assertEqual([e['id'] for e in (await socket.receive_json())['events']], ['5'])
+        await socket.disconnect()
+
+    async def test_reconnect_past_the_log_asks_for_a_reload(self):
+        self.log.append([({'type': 'alert.created'}, None)])
+        socket, _, _ = await self.connect('last_event_id=99')
+        self.assertEqual(await socket.receive_json(), {'type': 'reset'})
+        await socket.disconnect()
+
+    @override_settings(MONITORING_WS_MAX_PENDING=2)
+    async def test_a_slow_socket_drops_the_oldest_events_and_says_so(self):
+        socket, _, _ = await self.connect()
+        await self.send_to(subscriptions.BASE_GROUP, *[{'id': str(n), 'type': 'alert.created'} for n in range(4)])
+        self.assertEqual(await socket.receive_json(),
+                         {'type': 'dropped', 'count': 2, 'events': {'alert.created': 2}})
+        self.assertEqual([e['id'] for e in (await socket.receive_json())['events']], ['2', '3'])
+        await socket.disconnect()
+
+
+class AuditTailTests(MonitoringTestCase):
+    def setUp(self):
+        super().setUp()
+        hr = Department.objects.create(name='HR')
+        self.alice = User.objects.create_user('alice@example.com', 'pw', department=hr)
+        self.bob = User.objects.create_user('bob@example.com', 'pw')
+        self.rows = [(self.alice.pk, actions.code('login'), None, '10.0.0.1', self.base),
+                     (self.bob.pk, actions.code('download_resource'), 3, None, self.base + timedelta(seconds=1))]
+
+    def test_filters_are_normalized(self):
+        self.assertEqual(audit_tail.normalize({'category': ['auth,download'], 'user': '7,3'}),
+                         {'category': ['auth', 'download'], 'user': [3, 7]})
+        for raw in ({'category': 'file'}, {'severity': 'high'}):
+            with self.subTest(raw=raw), self.assertRaises(subscriptions.InvalidFilter):
+                audit_tail.normalize(raw)
+
+    def test_summaries_count_every_row_and_scale_the_sample(self):
+        groups = {'audit': {}, 'audit.hr': {'department': ['HR']}, 'audit.none': {'user': [0]}}
+        messages = dict(audit_tail.summarize(self.rows, 4, groups, sample=1))
+        self.assertEqual(set(messages), {'audit', 'audit.hr'})
+        everything = messages['audit']
+        self.assertEqual((everything['matched'], everything['sent'], len(everything['events'])), (4, 1, 1))
+        self.assertEqual(everything['by_category'], {actions.AUTH: 2, actions.DOWNLOAD: 2})
+        self.assertEqual(messages['audit.hr']['events'], [{
+            'user': 'alice@example.com', 'actor_id': self.alice.pk, 'action': 'login', 'category': actions.AUTH,
+            'resource_id': None, 'ip': '10.0.0.1', 'timestamp': self.base.isoformat(),
+        }])
+
+    def test_nothing_is_sent_while_no_one_watches(self):
+        registry = subscriptions.MemorySubscriptions()
+        tail = audit_tail.Tail(1, 100, 10)
+        tail._rows, tail._seen = list(self.rows), 2
+        with mock.patch.dict(subscriptions._registries, {audit_tail.BASE_GROUP: registry}), \
+                mock.patch.object(audit_tail, '_send', mock.AsyncMock()) as send:
+            tail.flush()
+            send.assert_not_awaited()
+            registry.add(audit_tail.BASE_GROUP, {})
+            tail._rows, tail._seen = list(self.rows), 2
+            tail.flush()
+        [(group, message)] = send.await_args.args[0]
+        self.assertEqual((group, message['matched']), (audit_tail.BASE_GROUP, 2))
+        self.assertEqual(tail._rows, [])
+
+
+@override_settings(CHANNEL_LAYERS=MEMORY_LAYERS, MONITORING_AUDIT_TAIL_RATE=2)
+class AuditTailConsumerTests(TestCase):
+    def setUp(self):
+        self.registry = subscriptions.MemorySubscriptions()
+        patcher = mock.patch.dict(subscriptions._registries, {audit_tail.BASE_GROUP: self.registry})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.staff = User.objects.create_user('soc@example.com', 'pw', is_staff=True)
+
+    async def test_staff_subscribe_with_comma_separated_categories(self):
+        socket = Socket(AuditTailConsumer, '/ws/audit/?category=auth,download&department=Finance', self.staff)
+        self.assertEqual(await socket.connect(), (True, None))
+        spec = {'category': ['auth', 'download'], 'department': ['Finance']}
+        self.assertEqual(self.registry.active(), {audit_tail.group_name(spec): spec})
+        await socket.disconnect()
+
+    async def test_other_users_and_bad_filters_are_closed(self):
+        user = await sync_to_async(User.objects.create_user)('analyst@example.com', 'pw')
+        self.assertEqual(await Socket(AuditTailConsumer, '/ws/audit/', user).connect(), (False, 4003))
+        self.assertEqual(await Socket(AuditTailConsumer, '/ws/audit/?category=file', self.staff).connect(),
+                         (False, 4400))
+
+    async def test_events_over_the_rate_are_sampled_away_and_counted(self):
+        socket = Socket(AuditTailConsumer, '/ws/audit/', self.staff)
+        await socket.connect()
+        events = [{'action': 'login', 'timestamp': f'2026-01-01T00:00:0{n}'} for n in range(5)]
+        await get_channel_layer().group_send(audit_tail.BASE_GROUP, {
+            'type': 'audit_batch', 'events': events, 'matched': 50, 'sent': 5, 'by_category': {'auth': 50}})
+        frame = await socket.receive_json()
+        self.assertEqual((frame['matched'], frame['sent'], frame['rate_limited']), (50, 2, 3))
+        self.assertEqual(frame['events'], sorted(frame['events'], key=lambda e: e['timestamp']))
+        await socket.disconnect()
@@ -1,7 +1,16 @@
 from django.urls import path
-from .views import AlertListView, AlertClearView
+from .views import (AlertListView, AlertBulkClearView, AlertClearView, AlertExportView, AnalyticsView,
+                    AuditLogExportView, IncidentCloseView, IncidentDetailView, IncidentListView, SummaryView)
 
 urlpatterns = [
     path('alerts/', AlertListView.as_view(), name='alert-list'),
+    path('alerts/clear/', AlertBulkClearView.as_view(), name='alert-bulk-clear'),
     path('alerts/<int:pk>/clear/', AlertClearView.as_view(), name='alert-clear'),
+    path('incidents/', IncidentListView.as_view(), name='incident-list'),
+    path('incidents/<int:pk>/', IncidentDetailView.as_view(), name='incident-detail'),
+    path('incidents/<int:pk>/close/', IncidentCloseView.as_view(), name='incident-close'),
+    path('summary/', SummaryView.as_view(), name='summary'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('export/alerts/', AlertExportView.as_view(), name='alert-export'),
+    path('export/audit-logs/', AuditLogExportView.as_view(), name='audit-log-export'),
 ]
@@ -1,23 +1,29 @@
 from rest_framework import generics, permissions, status
-from .models import Alert
-from .serializers import AlertSerializer
+from .models import Alert, Incident
+from .serializers import AlertSerializer, IncidentSerializer
 from rest_framework import status
 from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.http import QueryDict, StreamingHttpResponse
+from . import analytics, export, incidents, kpis
+from .alerts import clear_alerts
+from .pagination import IncidentPagination, KeysetPagination
+from datetime import timedelta
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from users.query_params import datetime_param, int_param, list_param
 
 class AlertListView(generics.ListAPIView):
     queryset = Alert.objects.all().order_by('-timestamp')
     serializer_class = AlertSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        # optional: filter by severity, cleared, or user
-        qs = Alert.objects.all().order_by('-timestamp')
-        severity = self.request.query_params.get('severity')
-        if severity:
-            qs = qs.filter(severity=severity)
+        # optional: filter by severity, user, action or time range (see export.filter_alerts)
+        qs = export.filter_alerts(self.request.query_params).select_related('user')
         show_cleared = self.request.query_params.get('show_cleared')
         if show_cleared not in ('true', '1', 'yes'):
             qs = qs.filter(cleared=False)
@@ -34,4 +40,139 @@ class AlertClearView(APIView):
         alert.cleared = True
         alert.save()
         serializer = AlertSerializer(alert)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class AlertBulkClearView(APIView):
+    """
+    Clear every open alert matching the JSON body with one UPDATE, e.g.
+    {"severity": ["low", "medium"], "action": "rapid_login", "until": "2026-01-05T00:00"},
+    {"ids": [1, 2, 3]} or {"all": true}.
+    """
+    permission_classes = [IsAdminUser]
+    FILTERS = ('severity', 'user', 'action', 'incident', 'since', 'until')
+
+    def post(self, request):
+        body = request.data if isinstance(request.data, dict) else {}
+        params = QueryDict(mutable=True)
+        for name in self.FILTERS:
+            value = body.get(name)
+            if value not in (None, '', []):
+                params.setlist(name, [str(v) for v in value] if isinstance(value, list) else [str(value)])
+        ids = body.get('ids')
+        if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+            raise ValidationError({'ids': 'Expected a list of alert ids.'})
+        if not params and ids is None and body.get('all') is not True:
+            raise ValidationError({'detail': f"Give ids, a filter ({', '.join(self.FILTERS)}) or all: true."})
+
+        qs = export.filter_alerts(params)
+        if ids is not None:
+            qs = qs.filter(pk__in=ids)
+        return Response({'cleared': clear_alerts(qs)}, status=status.HTTP_200_OK)
+
+class IncidentListView(generics.ListAPIView):
+    serializer_class = IncidentSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = IncidentPagination
+
+    def get_queryset(self):
+        # ?status=open (default), closed or all; ?severity=...; ?user=<id or email>
+        params = self.request.query_params
+        qs = Incident.objects.select_related('user')
+        status_ = params.get('status', 'open')
+        if status_ != 'all':
+            qs = qs.filter(status=status_)
+        severities = list_param(params, 'severity')
+        if severities:
+            qs = qs.filter(severity__in=severities)
+        user = params.get('user')
+        if user:
+            qs = qs.filter(user_id=int(user)) if user.isdigit() else qs.filter(user__email__iexact=user)
+        return qs
+
+class IncidentDetailView(generics.RetrieveAPIView):
+    # the incident's alerts: alerts/?incident=<pk>&show_cleared=true
+    queryset = Incident.objects.select_related('user')
+    serializer_class = IncidentSerializer
+    permission_classes = [IsAdminUser]
+
+class IncidentCloseView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def patch(self, request, pk):
+        incident = get_object_or_404(Incident, pk=pk)
+        cleared = incidents.close(incident)
+        return Response({**IncidentSerializer(incident).data, 'alerts_cleared': cleared}, status=status.HTTP_200_OK)
+
+class ExportView(APIView):
+    """Stream matching rows as CSV or NDJSON (?output=csv|ndjson, ?gzip=1), see monitoring.export."""
+    permission_classes = [IsAdminUser]
+    kind = None
+    rows = None
+
+    def get(self, request):
+        params = request.query_params
+        fmt = params.get('output', 'csv')
+        if fmt not in export.FORMATS:
+            return Response({'output': f"Expected one of {', '.join(export.FORMATS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        compress = params.get('gzip') in ('true', '1', 'yes')
+        fields, rows = self.rows(params)
+        response = StreamingHttpResponse(
+            export.render(fields, rows, fmt, compress),
+            content_type='application/gzip' if compress else
+            ('text/csv' if fmt == 'csv' else 'application/x-ndjson'),
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export.filename(self.kind, fmt, compress)}"'
+        response['X-Accel-Buffering'] = 'no'   # let nginx pass pieces through as they are produced
+        return response
+
+class AuditLogExportView(ExportView):
+    kind = 'audit-logs'
+    rows = staticmethod(export.audit_rows)
+
+class AlertExportView(ExportView):
+    kind = 'alerts'
+    rows = staticmethod(export.alert_rows)
+
+
+class AnalyticsView(APIView):
+    """
+    Bucketed counts for the dashboard charts, see monitoring.analytics.
+
+    ?metric=events|alerts &by=category|action|severity|department|user
+    &granularity=hour|day|week &since= &until= (default: the last 7 days) &top=N
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        metric = params.get('metric', 'events')
+        if metric not in analytics.METRICS:
+            raise ValidationError({'metric': f"Expected one of {', '.join(analytics.METRICS)}."})
+        groups = analytics.METRICS[metric]
+        by = params.get('by', 'category' if metric == 'events' else 'severity')
+        if by not in groups:
+            raise ValidationError({'by': f"For {metric}, expected one of {', '.join(groups)}."})
+        granularity = params.get('granularity', 'day')
+        if granularity not in analytics.GRANULARITIES:
+            raise ValidationError({'granularity': f"Expected one of {', '.join(analytics.GRANULARITIES)}."})
+
+        now = timezone.now()
+        until = datetime_param(params, 'until') or now
+        since = datetime_param(params, 'since') or until - timedelta(days=7)
+        if since >= until:
+            raise ValidationError({'since': 'Must be before until.'})
+        if (until - since) / analytics.GRANULARITIES[granularity] > analytics.MAX_BUCKETS:
+            raise ValidationError({'granularity': f'More than {analytics.MAX_BUCKETS} buckets; use a coarser one.'})
+        top = int_param(params, 'top')
+
+        data = analytics.series(metric, by, granularity, since, until, top=top, now=now)
+        return Response({'metric': metric, 'by': by, 'granularity': granularity, **data})
+
+
+class SummaryView(APIView):
+    """Dashboard KPIs, read from the counters in monitoring.kpis."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(kpis.summary())
@@ -0,0 +1,181 @@
+# users/actions.py
+"""
+Audit action vocabulary.
+
+Every distinct action name gets one AuditAction row with a smallint id and a
+category. AuditLog stores only that id. The mapping is cached per process: it
+is loaded once and read again only when a lookup misses, or at most every
+REFRESH_SECONDS for codes() and names() so that names registered by other
+processes show up; the detection engine reloads it at the start of every run,
+so a new name's rows are never read past. A name seen for the first time costs one insert.
+
+The vocabulary is fed by external sources (bulk ingest, the log tailer), so it
+is bounded: a name must match NAME_PATTERN, and past AUDIT_MAX_ACTIONS
+registered names (or for a malformed name) the event is recorded as UNKNOWN.
+
+Detectors and analytics filter by category (codes(...)), which becomes an
+indexed `action_type_id IN (...)` instead of a substring match on the name.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+AUTH, READ, DOWNLOAD, WRITE, DELETE, PERMISSION, OTHER = (
+    'auth', 'read', 'download', 'write', 'delete', 'permission', 'other')
+
+CATEGORY_CHOICES = [
+    (AUTH, 'Authentication'),
+    (READ, 'Read'),
+    (DOWNLOAD, 'Download'),
+    (WRITE, 'Write'),
+    (DELETE, 'Delete'),
+    (PERMISSION, 'Permission change'),
+    (OTHER, 'Other'),
+]
+
+
+def categorize(name):
+    """Category of an action name that has not been registered yet."""
+    name = name.lower()
+    if name in ('login', 'logout') or name.startswith('otp_'):
+        return AUTH
+    if name.startswith('assign_') or 'permission' in name:
+        return PERMISSION
+    if 'download' in name:
+        return DOWNLOAD
+    if 'delete' in name:
+        return DELETE
+    if name.startswith(('view_', 'list_', 'access_', 'read_')):
+        return READ
+    if name.startswith(('create_', 'update_', 'upload_', 'edit_')):
+        return WRITE
+    return OTHER
+
+
+NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_./:-]{0,119}$')
+UNKNOWN = 'unknown'
+REFRESH_SECONDS = 60
+
+_lock = threading.Lock()
+_by_name = {}   # name -> (code, category)
+_by_code = {}   # code -> (name, category)
+_uncommitted = set()   # names registered by a transaction that may still roll back
+_loaded_at = None
+
+
+def valid(name):
+    return bool(NAME_PATTERN.match(name))
+
+
+def _remember(code, name, category):
+    _by_name[name] = (code, category)
+    _by_code[code] = (name, category)
+
+
+def reload():
+    """Read the whole vocabulary again, e.g. before a pass that must see every registered name."""
+    _load()
+
+
+def _load():
+    global _loaded_at
+    from .models import AuditAction
+    rows = list(AuditAction.objects.values_list('id', 'name', 'category'))
+    with _lock:
+        for code, name, category in rows:
+            if name not in _uncommitted:
+                _remember(code, name, category)
+        _loaded_at = time.monotonic()
+
+
+def _refresh():
+    if _loaded_at is None or time.monotonic() - _loaded_at > REFRESH_SECONDS:
+        _load()
+
+
+def _register(name):
+    from .models import AuditAction
+    action, _ = AuditAction.objects.get_or_create(name=name, defaults={'category': categorize(name)})
+    if connection.in_atomic_block:
+        # cached once committed: after a rollback the cache would point at no row
+        def committed():
+            with _lock:
+                _uncommitted.discard(action.name)
+                _remember(action.pk, action.name, action.category)
+        with _lock:
+            _uncommitted.add(action.name)
+        transaction.on_commit(committed)
+    else:
+        with _lock:
+            _uncommitted.discard(action.name)
+            _remember(action.pk, action.name, action.category)
+    return action.pk
+
+
+def code(name):
+    """Smallint id for an action name, registering the name on first use."""
+    found = _by_name.get(name)
+    if found is not None:
+        return found[0]
+    if not valid(name):
+        return code(UNKNOWN)
+    _refresh()
+    found = _by_name.get(name)
+    if found is not None:
+        return found[0]
+    if name != UNKNOWN and len(_by_code) >= getattr(settings, 'AUDIT_MAX_ACTIONS', 1000):
+        return code(UNKNOWN)
+    return _register(name)
+
+
+def name(action_code):
+    if action_code is None:
+        return None
+    found = _by_code.get(action_code)
+    if found is None:
+        _load()
+        found = _by_code.get(action_code)
+    if found is None:
+        # registered by a transaction that has not committed yet (possibly this one): not cached
+        from .models import AuditAction
+        return AuditAction.objects.values_list('name', flat=True).get(pk=action_code)
+    return found[0]
+
+
+def category(action_name):
+    found = _by_name.get(action_name)
+    return found[1] if found else categorize(action_name)
+
+
+def clear_cache():
+    """Forget the cached vocabulary; the next lookup reloads it (tests roll back the rows behind it)."""
+    global _loaded_at
+    with _lock:
+        _by_name.clear()
+        _by_code.clear()
+        _uncommitted.clear()
+        _loaded_at = None
+
+
+def codes(*categories):
+    """Codes of every registered action in the given categories."""
+    _refresh()
+    with _lock:
+        return sorted(c for c, (_, cat) in _by_code.items() if cat in categories)
+
+
+class _Names(dict):
+    # a code registered since the last refresh is looked up instead of raising KeyError
+    def __missing__(self, action_code):
+        self[action_code] = found = name(action_code)
+        return found
+
+
+def names():
+    """{code: name} for every registered action; codes newer than the cache are looked up on access."""
+    _refresh()
+    with _lock:
+        return _Names((c, n) for c, (n, _) in _by_code.items())
@@ -26,6 +26,7 @@ urlpatterns = [
     path('resource/<int:pk>/update/', views.update_resource, name='update_resource'),
     path('resource/assign-access/', views.assign_resource_access, name='assign_resource_access'),
     path('audit/logs/', views.audit_logs, name='audit_logs'),
+    path('audit/ingest/', views.ingest_audit_logs, name='ingest_audit_logs'),
     path('csrf/', views.csrf_token_view, name='csrf_token'),
     path('groups/', GroupListAPIView.as_view(), name='group-list'),
     path('users/<int:pk>/update/', views.update_user, name='update_user'),
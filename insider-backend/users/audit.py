@@ -0,0 +1,272 @@
+# users/audit.py
+"""
+Buffered audit-log writer behind log_action.
+
+Requests no longer insert their AuditLog row themselves. log_action hands the
+event to a writer and returns. The writer is picked by settings.AUDIT_WRITER:
+  sync    insert immediately (the old behaviour)
+  memory  queue in this process; a background thread bulk-inserts every
+          AUDIT_FLUSH_INTERVAL seconds or as soon as AUDIT_BATCH_SIZE events wait
+  redis   queue in a Redis list shared by all workers; any worker's flusher
+          drains it in batches
+
+If the queue or the database is unavailable, the events are appended as
+NDJSON to AUDIT_SPOOL_PATH. The next successful flush replays them, so audit
+events survive a database outage. Buffered events are also flushed when the
+process exits.
+
+Event timestamps are taken when log_action is called, not when the row is
+written, and the event is only queued once the surrounding transaction
+commits.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import actions
+from .models import AuditLog, Resource, User
+
+logger = logging.getLogger(__name__)
+
+
+def _event(actor, action, resource, ip, metadata, at):
+    return {
+        'actor_id': getattr(actor, 'pk', None),
+        'action_type_id': actions.code(action),
+        'resource_id': getattr(resource, 'pk', None),
+        'ip_address': ip,
+        'metadata': metadata or {},
+        'timestamp': at.isoformat(),
+    }
+
+
+def write_events(events):
+    """
+    Bulk-insert serialized events in one transaction; actors/resources deleted
+    meanwhile become NULL, as on_delete does.
+    """
+    if not events:
+        return 0
+    actor_ids = {e['actor_id'] for e in events if e['actor_id'] is not None}
+    resource_ids = {e['resource_id'] for e in events if e['resource_id'] is not None}
+    actors = set(User.objects.filter(pk__in=actor_ids).values_list('pk', flat=True)) if actor_ids else set()
+    resources = set(Resource.objects.filter(pk__in=resource_ids).values_list('pk', flat=True)) if resource_ids else set()
+    from monitoring import audit_tail, kpis, rollups
+    with transaction.atomic():
+        logs = AuditLog.objects.bulk_create([
+            AuditLog(actor_id=e['actor_id'] if e['actor_id'] in actors else None,
+                     action_type_id=e.get('action_type_id') or actions.code(e['action']),
+                     resource_id=e['resource_id'] if e['resource_id'] in resources else None,
+                     ip_address=e['ip_address'], metadata=e['metadata'],
+                     timestamp=parse_datetime(e['timestamp']))
+            for e in events
+        ], batch_size=getattr(settings, 'AUDIT_BATCH_SIZE', 500))
+        rollups.mark_late([log.timestamp for log in logs])
+    kpis.events_written([log.timestamp for log in logs])
+    audit_tail.events_written([(log.actor_id, log.action_type_id, log.resource_id, log.ip_address, log.timestamp)
+                               for log in logs])
+    return len(events)
+
+
+class Spool:
+    """Append-only NDJSON file holding events that could not be written yet."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, events):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as fh:
+            for e in events:
+                fh.write(json.dumps(e) + '\n')
+
+    def replay(self):
+        if not os.path.exists(self.path):
+            return 0
+        claimed = f'{self.path}.{os.getpid()}.replay'
+        try:
+            with self._lock:
+                os.replace(self.path, claimed)   # only one process gets to replay a given file
+        except FileNotFoundError:
+            return 0
+        batch_size = getattr(settings, 'AUDIT_BATCH_SIZE', 500)
+        events = []
+        written = 0
+        try:
+            with open(claimed, encoding='utf-8', errors='replace') as fh:
+                for number, line in enumerate(fh, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # a line cut short by a crash mid-append
+                        logger.warning("Skipping unreadable line %s of spooled audit events %s", number, self.path)
+            # one transaction per batch: a failure spools back only what is not committed yet
+            for start in range(0, len(events), batch_size):
+                with transaction.atomic():
+                    written += write_events(events[start:start + batch_size])
+        except Exception:
+            self.append(events[written:])
+            raise
+        finally:
+            os.remove(claimed)
+        logger.info("Replayed %s spooled audit events", written)
+        return written
+
+
+class SyncWriter:
+    def __init__(self, spool):
+        self.spool = spool
+
+    def enqueue(self, event):
+        try:
+            self.spool.replay()
+            write_events([event])
+        except Exception:
+            logger.exception("Audit insert failed, spooling event")
+            self.spool.append([event])
+
+    def flush(self):
+        pass
+
+
+class BufferedWriter:
+    """Base for the queued writers: one daemon thread per process flushes on size or time."""
+
+    def __init__(self, spool, batch_size, interval):
+        self.spool = spool
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # start lazily, and again in a forked child where the parent's thread does not exist
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit flush failed")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._flush_lock:
+            self.spool.replay()
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    return
+                try:
+                    write_events(batch)
+                except Exception:
+                    logger.exception("Audit batch insert failed, spooling %s events", len(batch))
+                    self.spool.append(batch)
+                    return
+
+
+class MemoryWriter(BufferedWriter):
+    def __init__(self, spool, batch_size, interval):
+        super().__init__(spool, batch_size, interval)
+        self._queue = deque()
+
+    def enqueue(self, event):
+        self._ensure_thread()
+        self._queue.append(event)
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def _take(self, n):
+        batch = []
+        while self._queue and len(batch) < n:
+            batch.append(self._queue.popleft())
+        return batch
+
+
+class RedisWriter(BufferedWriter):
+    KEY = 'audit:queue'
+
+    def __init__(self, spool, batch_size, interval, url):
+        super().__init__(spool, batch_size, interval)
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    def enqueue(self, event):
+        self._ensure_thread()
+        try:
+            if self._redis.rpush(self.KEY, json.dumps(event)) >= self.batch_size:
+                self._wake.set()
+        except Exception:
+            logger.exception("Audit queue unavailable, spooling event")
+            self.spool.append([event])
+
+    def _take(self, n):
+        try:
+            items = self._redis.lpop(self.KEY, n) or []
+        except Exception:
+            logger.exception("Audit queue unavailable")
+            return []
+        return [json.loads(item) for item in items]
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                spool = Spool(getattr(settings, 'AUDIT_SPOOL_PATH', os.path.join(settings.BASE_DIR, 'audit-spool.ndjson')))
+                kind = getattr(settings, 'AUDIT_WRITER', 'sync')
+                batch_size = getattr(settings, 'AUDIT_BATCH_SIZE', 500)
+                interval = getattr(settings, 'AUDIT_FLUSH_INTERVAL', 1.0)
+                if kind == 'memory':
+                    _writer = MemoryWriter(spool, batch_size, interval)
+                elif kind == 'redis':
+                    _writer = RedisWriter(spool, batch_size, interval,
+                                          getattr(settings, 'AUDIT_REDIS_URL', 'redis://localhost:6379/0'))
+                else:
+                    _writer = SyncWriter(spool)
+                atexit.register(flush)
+    return _writer
+
+
+def flush():
+    """Write out everything this process has queued (also runs at interpreter exit)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def log_action(actor, action, resource=None, ip=None, metadata=None):
+    from monitoring.streaming import observe
+
+    now = timezone.now()
+    event = _event(actor, action, resource, ip, metadata, now)
+
+    def committed():
+        # a rolled-back request leaves neither a row nor a streaming alert
+        get_writer().enqueue(event)
+        observe(actor, action, now)
+
+    transaction.on_commit(committed)
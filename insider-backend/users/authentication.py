@@ -0,0 +1,95 @@
+# users/authentication.py
+"""
+JWT authentication without a user query per request.
+
+simplejwt's JWTAuthentication loads the token's user row on every API
+request, and the websocket middleware did the same on every connect. Here the
+user's columns are kept in the cache for AUTH_USER_CACHE_TTL seconds, keyed by
+user id, so every token of a user shares one entry. The password hash is not
+cached, only its MD5 digest for the revoked-token check (the value simplejwt
+puts in the token itself). The user is rebuilt with the password deferred, so
+reading it loads it from the database and save() leaves it alone. The 'monitoring' alias is used
+when configured, so that all web processes share the entries and an
+invalidation reaches them all. users.signals drops a user's entry whenever
+the row is saved (deactivated, password changed, made staff...) or deleted.
+The TTL bounds how stale an entry can get through a write that bypasses the
+signals (QuerySet.update).
+
+The is_active and revoked-token checks still run on every request, against
+the cached row. A cache outage only makes authentication slower.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+logger = logging.getLogger(__name__)
+
+
+def _cache():
+    return caches['monitoring' if 'monitoring' in settings.CACHES else 'default']
+
+
+def _key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _columns(model):
+    return [f.attname for f in model._meta.concrete_fields if f.attname != 'password']
+
+
+def invalidate(user_id):
+    try:
+        _cache().delete(_key(user_id))
+    except Exception:
+        logger.warning("Auth user cache unavailable", exc_info=True)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving the token's user through the cache."""
+
+    def load_user(self, user_id):
+        """The user, without its password hash loaded; user.password_md5 is the hash's digest."""
+        key = _key(user_id)
+        columns = _columns(self.user_model)
+        try:
+            entry = _cache().get(key)
+        except Exception:
+            logger.warning("Auth user cache unavailable", exc_info=True)
+            entry = None
+        if entry is None:
+            try:
+                row = self.user_model.objects.values(*columns, 'password').get(
+                    **{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            entry = {'columns': [row[c] for c in columns], 'password_md5': get_md5_hash_password(row['password'])}
+            try:
+                _cache().set(key, entry, timeout=getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+            except Exception:
+                logger.warning("Auth user cache unavailable", exc_info=True)
+        user = self.user_model.from_db(self.user_model.objects.db, columns, entry['columns'])
+        user.password_md5 = entry['password_md5']
+        return user
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = self.load_user(user_id)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != user.password_md5:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users import partitioning
+
+
+class Command(BaseCommand):
+    help = ('Partition the audit log by month on PostgreSQL (--convert once), then keep upcoming '
+            'monthly partitions created. Other databases keep the unpartitioned, indexed table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='rebuild users_auditlog as a partitioned table')
+        parser.add_argument('--ahead', type=int, default=3, help='months to create ahead of the current one')
+        parser.add_argument('--keep-old', action='store_true', help='keep the unpartitioned copy after --convert')
+
+    def handle(self, *args, **options):
+        if not partitioning.supported():
+            self.stdout.write("Partitioning needs PostgreSQL; the audit log stays a single indexed table.")
+            return
+        if options['convert']:
+            if partitioning.is_partitioned():
+                self.stdout.write("users_auditlog is already partitioned.")
+            else:
+                self.stdout.write("Converting users_auditlog to monthly partitions (the table is locked meanwhile)...")
+                created = partitioning.convert(ahead=options['ahead'], keep_old=options['keep_old'])
+                self.stdout.write(self.style.SUCCESS(f"Created {len(created)} monthly partitions."))
+        elif not partitioning.is_partitioned():
+            raise CommandError('users_auditlog is not partitioned yet; run with --convert first')
+        partitioning.ensure_partitions(ahead=options['ahead'])
+        for name, bound, rows in partitioning.list_partitions():
+            self.stdout.write(f"  {name:<32} {bound:<60} ~{max(rows, 0)} rows")
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:30
+
+from django.db import DatabaseError, migrations, models, transaction
+
+
+def add_action_trigram_index(apps, schema_editor):
+    # PostgreSQL only: lets action__icontains (UPPER(action) LIKE ...) use an index
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError:
+        return   # extension not available to this role; icontains stays a filter on the id/time range
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS users_auditlog_action_trgm '
+        'ON users_auditlog USING gin (UPPER("action"::text) gin_trgm_ops)'
+    )
+
+
+def drop_action_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS users_auditlog_action_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_auditlog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', 'id'], name='users_audit_action_8530c9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', 'timestamp'], name='users_audit_action_962101_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['actor', 'timestamp'], name='users_audit_actor_i_aed20d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp'], name='users_audit_timesta_45d1d4_idx'),
+        ),
+        migrations.RunPython(add_action_trigram_index, drop_action_trigram_index),
+    ]
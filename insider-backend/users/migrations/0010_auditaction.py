@@ -0,0 +1,108 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+CATEGORY_CHOICES = [
+    ('auth', 'Authentication'),
+    ('read', 'Read'),
+    ('download', 'Download'),
+    ('write', 'Write'),
+    ('delete', 'Delete'),
+    ('permission', 'Permission change'),
+    ('other', 'Other'),
+]
+
+
+def categorize(name):
+    # frozen copy of users.actions.categorize as of this migration
+    name = name.lower()
+    if name in ('login', 'logout') or name.startswith('otp_'):
+        return 'auth'
+    if name.startswith('assign_') or 'permission' in name:
+        return 'permission'
+    if 'download' in name:
+        return 'download'
+    if 'delete' in name:
+        return 'delete'
+    if name.startswith(('view_', 'list_', 'access_', 'read_')):
+        return 'read'
+    if name.startswith(('create_', 'update_', 'upload_', 'edit_')):
+        return 'write'
+    return 'other'
+
+
+def register_actions(apps, schema_editor):
+    AuditAction = apps.get_model('users', 'AuditAction')
+    AuditLog = apps.get_model('users', 'AuditLog')
+    for name in AuditLog.objects.values_list('action', flat=True).distinct():
+        action, _ = AuditAction.objects.get_or_create(name=name, defaults={'category': categorize(name)})
+        AuditLog.objects.filter(action=name).update(action_type=action)
+
+
+def restore_names(apps, schema_editor):
+    AuditAction = apps.get_model('users', 'AuditAction')
+    AuditLog = apps.get_model('users', 'AuditLog')
+    for action in AuditAction.objects.all():
+        AuditLog.objects.filter(action_type=action).update(action=action.name)
+
+
+def drop_action_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS users_auditlog_action_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_auditlog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditAction',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=120, unique=True)),
+                ('category', models.CharField(choices=CATEGORY_CHOICES, default='other', max_length=16)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='action_type',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='+', to='users.auditaction'),
+        ),
+        # nullable first so the migration can be reversed: the names are restored before NOT NULL returns
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action',
+            field=models.CharField(max_length=120, null=True),
+        ),
+        migrations.RunPython(register_actions, restore_names),
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='users_audit_action_8530c9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='users_audit_action_962101_idx',
+        ),
+        migrations.RunPython(drop_action_trigram_index, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='auditlog',
+            name='action',
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='+', to='users.auditaction'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action_type', 'id'], name='users_audit_action__9f3587_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action_type', 'timestamp'], name='users_audit_action__89da69_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_auditaction'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='users_audit_timesta_45d1d4_idx',
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='users_audit_timesta_cab37f_idx'),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 import random
+from . import actions
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
@@ -144,13 +145,44 @@ class ResourceAccess(models.Model):
 # -------------------
 # Audit Log
 # -------------------
+class AuditAction(models.Model):
+    """One row per distinct audit action name; see users.actions for the cached lookup."""
+    id = models.SmallAutoField(primary_key=True)
+    name = models.CharField(max_length=120, unique=True)
+    category = models.CharField(max_length=16, choices=actions.CATEGORY_CHOICES, default=actions.OTHER)
+
+    def __str__(self):
+        return f"{self.name} ({self.category})"
+
 class AuditLog(models.Model):
     actor = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
-    action = models.CharField(max_length=120)  # e.g., login, download, edit
+    action_type = models.ForeignKey(AuditAction, on_delete=models.PROTECT, related_name='+', db_index=False)
     resource = models.ForeignKey(Resource, null=True, blank=True, on_delete=models.SET_NULL)
     ip_address = models.CharField(max_length=45, blank=True, null=True)
     metadata = models.JSONField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the event happens; buffered writers insert it later with this value
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        # shaped after the detector and API queries: incremental scans read
+        # (action, id > watermark), backfills and windows read (action, timestamp range),
+        # per-user views read (actor, timestamp), feeds and ML read by timestamp;
+        # the API pages on (timestamp, id), see users.audit_query
+        indexes = [
+            models.Index(fields=['action_type', 'id']),
+            models.Index(fields=['action_type', 'timestamp']),
+            models.Index(fields=['actor', 'timestamp']),
+            models.Index(fields=['timestamp', 'id']),
+        ]
+
+    # the action name, e.g. login, download_resource; AuditLog(action='login') works too
+    @property
+    def action(self):
+        return actions.name(self.action_type_id)
+
+    @action.setter
+    def action(self, value):
+        self.action_type_id = actions.code(value)
 
     def __str__(self):
         return f"{self.timestamp} - {self.actor} - {self.action}"
@@ -0,0 +1,124 @@
+# users/partitioning.py
+"""
+Optional monthly partitioning of users_auditlog on PostgreSQL.
+
+convert() turns the plain table into a table partitioned by RANGE (timestamp)
+with one partition per month and a default partition, copying the rows across
+in one transaction. Queries keep going through AuditLog.objects unchanged:
+PostgreSQL routes each query to the matching partitions (partition pruning),
+so any query with a timestamp bound only reads the months it covers, and old
+months can be detached or dropped in O(1). ensure_partitions() creates the
+upcoming months ahead of time and runs from Celery beat.
+
+On other databases (SQLite in development) the table stays unpartitioned and
+the composite indexes on AuditLog serve the same queries.
+"""
+from datetime import date
+
+from django.db import connection, transaction
+
+TABLE = 'users_auditlog'
+
+
+def supported():
+    return connection.vendor == 'postgresql'
+
+
+def is_partitioned():
+    if not supported():
+        return False
+    with connection.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE])
+        return cur.fetchone() is not None
+
+
+def _month(day, offset=0):
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year}m{month.month:02d}'
+
+
+def _create_month(cur, month):
+    cur.execute(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" PARTITION OF "{TABLE}" '
+        f'FOR VALUES FROM (%s) TO (%s)', [month.isoformat(), _month(month, 1).isoformat()]
+    )
+
+
+def ensure_partitions(ahead=3, today=None):
+    """Create this month's and the next `ahead` months' partitions; return their names."""
+    if not is_partitioned():
+        return []
+    first = _month(today or date.today())
+    months = [_month(first, i) for i in range(ahead + 1)]
+    with transaction.atomic(), connection.cursor() as cur:
+        for month in months:
+            _create_month(cur, month)
+    return [partition_name(m) for m in months]
+
+
+def list_partitions():
+    with connection.cursor() as cur:
+        cur.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+                    "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname", [TABLE])
+        return cur.fetchall()
+
+
+def convert(ahead=3, keep_old=False):
+    """Rebuild users_auditlog as a monthly partitioned table; return the partitions created."""
+    if not supported():
+        raise RuntimeError('AuditLog partitioning requires PostgreSQL')
+    if is_partitioned():
+        return []
+    old = f'{TABLE}_unpartitioned'
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+        cur.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [TABLE])
+        indexes = [(name, sql) for name, sql in cur.fetchall() if not name.endswith('_pkey')]
+        cur.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                    "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [TABLE])
+        foreign_keys = cur.fetchall()
+        cur.execute(f'SELECT min("timestamp"), max("timestamp") FROM "{TABLE}"')
+        lowest, highest = cur.fetchone()
+        cur.execute("SELECT attidentity = '', pg_get_serial_sequence(%s, 'id') FROM pg_attribute "
+                    "WHERE attrelid = to_regclass(%s) AND attname = 'id'", [TABLE, TABLE])
+        serial, sequence = cur.fetchone()
+
+        cur.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{old}"')
+        for name, _ in indexes:
+            cur.execute(f'DROP INDEX "{name}"')   # names are reused on the new parent
+        for name, _ in foreign_keys:
+            cur.execute(f'ALTER TABLE "{old}" DROP CONSTRAINT "{name}"')
+
+        # the partition key has to be part of the primary key
+        cur.execute(f'CREATE TABLE "{TABLE}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING IDENTITY '
+                    f'INCLUDING CONSTRAINTS) PARTITION BY RANGE ("timestamp")')
+        cur.execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY ("id", "timestamp")')
+        if serial and sequence:
+            # a serial id keeps its sequence; hand it over so dropping the old table leaves it alone
+            cur.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{TABLE}"."id"')
+        for _, sql in indexes:
+            cur.execute(sql)   # read before the rename, so it already targets the new parent
+        for name, definition in foreign_keys:
+            cur.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+
+        today = date.today()
+        first = _month(lowest.date() if lowest else today)
+        last = _month(max(highest.date() if highest else today, today), ahead)
+        months, month = [], first
+        while month <= last:
+            _create_month(cur, month)
+            months.append(month)
+            month = _month(month, 1)
+        cur.execute(f'CREATE TABLE IF NOT EXISTS "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+
+        cur.execute(f'INSERT INTO "{TABLE}" OVERRIDING SYSTEM VALUE SELECT * FROM "{old}"')
+        cur.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    f'COALESCE((SELECT max("id") FROM "{TABLE}"), 0) + 1, false)', [TABLE])
+        if not keep_old:
+            cur.execute(f'DROP TABLE "{old}"')
+    return [partition_name(m) for m in months]
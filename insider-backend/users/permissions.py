@@ -66,3 +66,11 @@ class RoleEnforcer(permissions.BasePermission):
                 return True
 
         return False
+
+
+class CanIngestAudit(permissions.BasePermission):
+    """Staff, or a service account granted users.add_auditlog."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_staff or user.has_perm('users.add_auditlog')))
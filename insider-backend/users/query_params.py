@@ -0,0 +1,42 @@
+# users/query_params.py
+"""
+Parsing of query parameters shared by the audit and monitoring APIs.
+
+Each helper takes a QueryDict and a parameter name, returns None (or [] for
+lists) when the parameter is absent, and raises a ValidationError keyed by the
+parameter name when it is malformed.
+"""
+from datetime import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def list_param(params, name):
+    """Values of a repeatable or comma separated parameter."""
+    return [v.strip() for value in params.getlist(name) for v in value.split(',') if v.strip()]
+
+
+def datetime_param(params, name):
+    """An ISO date or date-time; naive values are taken in the current time zone."""
+    value = params.get(name)
+    if not value:
+        return None
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: 'Expected an ISO date or date-time.'})
+        when = datetime(day.year, day.month, day.day)
+    return timezone.make_aware(when) if timezone.is_naive(when) else when
+
+
+def int_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer.'})
@@ -2,7 +2,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from .models import Department, Role, Resource, ResourceAccess, AuditLog, AccessControl, User
+from .models import Department, Role, Resource, ResourceAccess, AccessControl, User
 from rest_framework import serializers
 
 User = get_user_model()
@@ -127,17 +127,6 @@ class ResourceAccessSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-# Audit Log Serializer
-class AuditLogSerializer(serializers.ModelSerializer):
-    actor = UserSerializer(read_only=True)
-    resource = ResourceSerializer(read_only=True)
-
-    class Meta:
-        model = AuditLog
-        fields = '__all__'
-
-
-
 class AccessControlSerializer(serializers.ModelSerializer):
     class Meta:
         model = AccessControl
@@ -0,0 +1,10 @@
+# users/tasks.py
+from celery import shared_task
+
+from . import partitioning
+
+
+@shared_task(name='users.ensure_auditlog_partitions')
+def ensure_auditlog_partitions_task():
+    # no-op unless the audit log has been converted to monthly partitions
+    return partitioning.ensure_partitions()
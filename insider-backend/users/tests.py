@@ -1,3 +1,328 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users import actions, audit, audit_query
+from users.audit import Spool
+from users.authentication import CachedJWTAuthentication
+from users.ingest import Rejected, ingest, normalize
+from users.models import AuditAction, AuditLog, Department, Resource, User
+
+# the settings point the shared caches at Redis; tests keep them in the process
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def query(**params):
+    q = QueryDict(mutable=True)
+    q.update(params)
+    return q
+
+
+class UsersTestCase(TestCase):
+    def setUp(self):
+        actions.clear_cache()
+        self.addCleanup(actions.clear_cache)
+
+
+class ActionVocabularyTests(UsersTestCase):
+    def test_names_are_registered_once_with_a_category(self):
+        code = actions.code('delete_resource')
+        self.assertEqual(actions.code('delete_resource'), code)
+        self.assertEqual(AuditAction.objects.get(pk=code).category, actions.DELETE)
+        self.assertEqual(actions.name(code), 'delete_resource')
+
+    def test_malformed_names_are_recorded_as_unknown(self):
+        unknown = actions.code(actions.UNKNOWN)
+        for name in ('Drop Table', '1login', 'x' * 121, ''):
+            with self.subTest(name=name):
+                self.assertEqual(actions.code(name), unknown)
+
+    @override_settings(AUDIT_MAX_ACTIONS=3)
+    def test_vocabulary_stops_growing_at_the_limit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = [actions.code(n) for n in ('login', 'logout', 'view_resource')]
+        self.assertEqual(actions.code('vpn_login'), actions.code(actions.UNKNOWN))
+        self.assertEqual([actions.code(n) for n in ('login', 'logout', 'view_resource')], first)
+        self.assertFalse(AuditAction.objects.filter(name='vpn_login').exists())
+
+    def test_names_looks_up_codes_the_cache_has_not_seen(self):
+        names = actions.names()
+        code = actions.code('upload_resource')   # uncommitted here, so not cached
+        self.assertEqual(names[code], 'upload_resource')
+
+
+class AuditQueryTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('query@example.com', 'pw')
+        at = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        # pairs of rows sharing a timestamp, so the cursor has to break ties on id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.logs = [AuditLog.objects.create(actor=self.user, action='login' if i % 3 else 'logout',
+                                                 timestamp=at + timedelta(minutes=i // 2))
+                         for i in range(7)]
+
+    def walk(self, params):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = audit_query.page(query(**params, **({'cursor': cursor} if cursor else {})))
+            seen.append([row['id'] for row in rows])
+            if cursor is None:
+                return seen
+
+    def test_pages_walk_every_row_once_newest_first(self):
+        pages = self.walk({'limit': '3'})
+        self.assertEqual([len(p) for p in pages], [3, 3, 1])
+        newest_first = sorted(self.logs, key=lambda log: (log.timestamp, log.pk), reverse=True)
+        self.assertEqual(sum(pages, []), [log.pk for log in newest_first])
+
+    def test_filters_apply_on_every_page(self):
+        pages = self.walk({'limit': '2', 'action': 'login'})
+        self.assertEqual(sorted(sum(pages, [])), [log.pk for log in self.logs if log.action == 'login'])
+
+    def test_rows_hold_only_the_requested_fields(self):
+        rows, _ = audit_query.page(query(fields='action,user', limit='1'))
+        self.assertEqual(rows, [{'action': self.logs[-1].action, 'user': 'query@example.com'}])
+
+    def test_cursor_round_trips(self):
+        at = self.logs[0].timestamp
+        self.assertEqual(audit_query.decode_cursor(audit_query.encode_cursor(at, 42)), (at, 42))
+
+    def test_bad_parameters_are_validation_errors(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'cursor': audit_query.encode_cursor(timezone.now(), 1)[:-4]},
+                       {'limit': '0'}, {'limit': 'many'}, {'fields': 'password'}, {'category': 'secret'}):
+            with self.subTest(params=params), self.assertRaises(ValidationError):
+                audit_query.page(query(**params))
+
+    def test_view_sends_a_link_to_the_next_page(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('audit_logs'), {'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'cursor={response.data["next"]}', response.headers['Link'])
+
+        response = client.get(reverse('audit_logs'), {'limit': 5, 'cursor': response.data['next']})
+        self.assertEqual(len(response.data['audit_logs']), 2)
+        self.assertNotIn('Link', response.headers)
+
+
+class NormalizeTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def test_fields_are_cleaned(self):
+        event = normalize({'action': ' VPN_Login ', 'actor': ' Jane@Corp.com', 'resource': '42',
+                           'ip': '10.0.0.7', 'source': 'vpn', 'metadata': {'k': 1},
+                           'timestamp': '2026-01-05T09:12:00'}, self.now, self.now - timedelta(days=3650))
+        self.assertEqual(event['action'], 'vpn_login')
+        self.assertEqual(event['actor'], 'Jane@Corp.com')
+        self.assertEqual(event['resource'], 42)
+        self.assertEqual(event['metadata'], {'k': 1, 'source': 'vpn'})
+        self.assertEqual(event['timestamp'].isoformat(), '2026-01-05T09:12:00+00:00')
+
+    def test_missing_timestamp_is_the_ingestion_time(self):
+        self.assertEqual(normalize({'action': 'login'}, self.now)['timestamp'], self.now)
+
+    def test_epoch_timestamps_are_accepted(self):
+        at = normalize({'action': 'login', 'timestamp': self.now.timestamp() - 60}, self.now)['timestamp']
+        self.assertAlmostEqual(at.timestamp(), self.now.timestamp() - 60, places=3)
+
+    @override_settings(AUDIT_INGEST_MAX_AGE_DAYS=30)
+    def test_bad_records_are_rejected(self):
+        cases = {
+            'record must be a JSON object': [1, 2],
+            'action is required': {'actor': 1},
+            'action must start': {'action': 'drop table'},
+            'metadata must be an object': {'action': 'login', 'metadata': [1]},
+            'ip must be': {'action': 'login', 'ip': 7},
+            'actor must be': {'action': 'login', 'actor': {'id': 1}},
+            'not ISO 8601': {'action': 'login', 'timestamp': 'yesterday'},
+            'in the future': {'action': 'login', 'timestamp': (self.now + timedelta(hours=1)).isoformat()},
+            'too far in the past': {'action': 'login', 'timestamp': 0},
+            'out of range': {'action': 'login', 'timestamp': 1e20},
+        }
+        for reason, record in cases.items():
+            with self.subTest(reason=reason), self.assertRaisesRegex(Rejected, reason):
+                normalize(record, self.now)
+
+    @override_settings(AUDIT_INGEST_MAX_AGE_DAYS=30)
+    def test_age_limit_follows_the_setting(self):
+        normalize({'action': 'login', 'timestamp': (self.now - timedelta(days=29)).isoformat()}, self.now)
+        with self.assertRaises(Rejected):
+            normalize({'action': 'login', 'timestamp': (self.now - timedelta(days=31)).isoformat()}, self.now)
+
+
+class IngestTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('ingest@example.com', 'pw')
+        self.resource = Resource.objects.create(name='plan.pdf', path='/shared/plan.pdf',
+                                                department=Department.objects.create(name='Finance'))
+
+    def lines(self, *records):
+        return [(json.dumps(r) if not isinstance(r, str) else r).encode() + b'\n' for r in records]
+
+    def test_events_are_written_in_batches_with_their_references(self):
+        result = ingest(self.lines(
+            {'action': 'vpn_login', 'actor': 'INGEST@example.com'},
+            {'action': 'download_resource', 'actor': self.user.pk, 'resource': '/shared/plan.pdf'},
+            'not json',
+            {'action': 'vpn_login', 'actor': 'ghost@example.com', 'resource': 999},
+        ), batch_size=2)
+        self.assertEqual((result['accepted'], result['rejected']), (3, 1))
+        self.assertEqual([(b['accepted'], b['rejected']) for b in result['batches']], [(2, 0), (1, 1)])
+        self.assertEqual(result['errors'], [{'line': 3, 'error': 'invalid JSON'}])
+
+        logs = list(AuditLog.objects.order_by('id'))
+        self.assertEqual([log.actor_id for log in logs], [self.user.pk, self.user.pk, None])
+        self.assertEqual(logs[1].resource_id, self.resource.pk)
+        self.assertEqual(logs[2].metadata, {'actor': 'ghost@example.com', 'resource': 999})
+        self.assertEqual(logs[0].action, 'vpn_login')
+
+    def test_emails_match_whatever_their_case(self):
+        user = User.objects.create_user('Mixed.Case@Example.com', 'pw')
+        ingest(self.lines({'action': 'login', 'actor': 'mixed.case@EXAMPLE.com'},
+                          {'action': 'login', 'actor': 'Mixed.Case@example.com'}))
+        self.assertEqual(list(AuditLog.objects.values_list('actor_id', flat=True)), [user.pk, user.pk])
+
+    def test_broken_gzip_body_keeps_what_was_read(self):
+        body = gzip.compress(b''.join(self.lines(*[{'action': 'login', 'actor': self.user.pk}] * 50)))
+        stream = gzip.GzipFile(fileobj=io.BytesIO(body[:len(body) // 2]))
+        result = ingest(iter(stream.readline, b''), batch_size=10)
+        self.assertEqual(result['error'], 'body could not be read to the end')
+        self.assertEqual(result['accepted'], AuditLog.objects.count())
+        self.assertLessEqual(result['accepted'], result['lines'])
+        self.assertLess(result['lines'], 50)
+
+    def test_view_answers_400_when_nothing_was_accepted(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('svc@example.com', 'pw', is_staff=True))
+        url = reverse('ingest_audit_logs')
+        response = client.post(url, b''.join(self.lines('{}')), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        response = client.post(url, gzip.compress(b''.join(self.lines({'action': 'login'}))),
+                               content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual((response.status_code, response.data['accepted']), (201, 1))
+        response = client.post(url, b'', content_type='application/x-ndjson')
+        self.assertEqual((response.status_code, response.data['accepted']), (400, 0))
+
+
+class SpoolTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.spool = Spool(os.path.join(directory, 'spool.ndjson'))
+        at = timezone.now().isoformat()
+        self.events = [{'actor_id': None, 'action_type_id': actions.code('login'), 'resource_id': None,
+                        'ip_address': '10.0.0.1', 'metadata': {'n': n}, 'timestamp': at} for n in range(5)]
+
+    def spooled(self):
+        with open(self.spool.path) as fh:
+            return [json.loads(line)['metadata']['n'] for line in fh]
+
+    def test_replay_writes_and_removes_the_spool(self):
+        self.spool.append(self.events)
+        self.assertEqual(self.spool.replay(), 5)
+        self.assertEqual(sorted(log.metadata['n'] for log in AuditLog.objects.all()), [0, 1, 2, 3, 4])
+        self.assertFalse(os.path.exists(self.spool.path))
+        self.assertEqual(self.spool.replay(), 0)
+
+    @override_settings(AUDIT_BATCH_SIZE=2)
+    def test_failed_replay_spools_back_only_the_unwritten_events(self):
+        self.spool.append(self.events)
+        write = audit.write_events
+
+        def fail_on_second_batch(events):
+            if events[0]['metadata']['n'] == 2:
+                raise RuntimeError('database went away')
+            return write(events)
+
+        with mock.patch.object(audit, 'write_events', fail_on_second_batch), self.assertRaises(RuntimeError):
+            self.spool.replay()
+        self.assertEqual(AuditLog.objects.count(), 2)
+        self.assertEqual(self.spooled(), [2, 3, 4])
+        self.assertEqual([f for f in os.listdir(os.path.dirname(self.spool.path))], ['spool.ndjson'])
+
+        self.assertEqual(self.spool.replay(), 3)
+        self.assertEqual(AuditLog.objects.count(), 5)
+
+    def test_replay_skips_a_truncated_line(self):
+        self.spool.append(self.events[:2])
+        with open(self.spool.path, 'a') as fh:
+            fh.write('{"actor_id": null, "action_ty')
+        with self.assertLogs('users.audit', 'WARNING'):
+            self.assertEqual(self.spool.replay(), 2)
+        self.assertEqual(AuditLog.objects.count(), 2)
+        self.assertEqual(os.listdir(os.path.dirname(self.spool.path)), [])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CachedJWTAuthenticationTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.user = User.objects.create_user('jwt@example.com', 'pw')
+        self.auth = CachedJWTAuthentication()
+
+    def authenticate(self, user=None):
+        token = self.auth.get_validated_token(str(AccessToken.for_user(user or self.user)))
+        return self.auth.get_user(token)
+
+    def test_the_user_row_is_read_once(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.email), (self.user.pk, 'jwt@example.com'))
+        self.assertNotIn('password', caches['default'].get(f'auth:user:{self.user.pk}'))
+        self.assertIn('password', user.get_deferred_fields())
+
+    def test_saving_the_user_drops_the_cached_row(self):
+        token = self.auth.get_validated_token(str(AccessToken.for_user(self.user)))
+        self.auth.get_user(token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User is inactive'):
+            self.auth.get_user(token)
+
+    def test_a_password_change_revokes_the_tokens(self):
+        # modules hold on to simplejwt's settings object, so override_settings would not reach them
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            token = self.auth.get_validated_token(str(AccessToken.for_user(self.user)))
+            self.auth.get_user(token)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.set_password('new password')
+                self.user.save()
+            with self.assertRaisesMessage(AuthenticationFailed, 'password has been changed'):
+                self.auth.get_user(token)
+            self.authenticate()
+
+    def test_a_cache_outage_falls_back_to_the_database(self):
+        broken = mock.Mock(**{'get.side_effect': ConnectionError, 'set.side_effect': ConnectionError})
+        with mock.patch('users.authentication._cache', return_value=broken), \
+                self.assertLogs('users.authentication', 'WARNING'):
+            self.assertEqual(self.authenticate().pk, self.user.pk)
+
+    def test_unknown_users_are_refused(self):
+        ghost = User(pk=self.user.pk + 100, email='ghost@example.com')
+        with self.assertRaisesMessage(AuthenticationFailed, 'User not found'):
+            self.authenticate(ghost)
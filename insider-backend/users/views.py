@@ -2,7 +2,7 @@ from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.models import Group
 from django.core.mail import send_mail
-from django.http import FileResponse, Http404, JsonResponse
+from django.http import FileResponse, JsonResponse
 from django.utils.crypto import get_random_string
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from rest_framework import status, permissions, generics, viewsets, serializers
@@ -10,19 +10,25 @@ from datetime import timedelta
 from django.shortcuts import get_object_or_404
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from django.utils import timezone
 from django.middleware.csrf import get_token
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from .models import Resource, AccessControl
-from .serializers import UserSerializer, ResourceSerializer, AccessControlSerializer
-from .models import User, OTP, Resource, AuditLog, Department, Role
+from .serializers import UserSerializer, ResourceSerializer
+from .models import User, OTP, Resource, Department, Role
 from rest_framework.serializers import ModelSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.db.models import Q
-from .permissions import RoleEnforcer
+from .permissions import CanIngestAudit, RoleEnforcer
 from .models import ResourceAccess
 from django.db import transaction
+from .audit import log_action
+from .ingest import ingest
+from . import audit_query
 
+import gzip
+import io
 import os
 import logging
 
@@ -66,8 +72,6 @@ def get_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
     return {'refresh': str(refresh), 'access': str(refresh.access_token)}
 
-def log_action(actor, action, resource=None, ip=None, metadata=None):
-    AuditLog.objects.create(actor=actor, action=action, resource=resource, ip_address=ip, metadata=metadata or {})
 
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([permissions.IsAuthenticated])
@@ -359,16 +363,26 @@ def download_resource(request, pk):
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def audit_logs(request):
-    logs = AuditLog.objects.all().order_by('-timestamp')  # fetch real logs, newest first
-    serializer = AuditLogSerializer(logs, many=True)
-    return Response({"audit_logs": serializer.data})
+    """Newest-first audit logs, filtered and keyset paginated, see users.audit_query."""
+    logs, next_cursor = audit_query.page(request.query_params)
+    headers = {}
+    if next_cursor is not None:
+        # the same Link header as the monitoring lists, so clients follow both the same way
+        headers['Link'] = f'<{replace_query_param(request.build_absolute_uri(), "cursor", next_cursor)}>; rel="next"'
+    return Response({"audit_logs": logs, "next": next_cursor}, headers=headers)
 
-class AuditLogSerializer(serializers.ModelSerializer):
-    user = serializers.CharField(source='actor.email')  # adjust if your AuditLog has an actor FK to User
-
-    class Meta:
-        model = AuditLog
-        fields = ['user', 'action', 'timestamp']  # or your real model fields
+@api_view(['POST'])
+@permission_classes([CanIngestAudit])
+def ingest_audit_logs(request):
+    """Bulk-load NDJSON audit events from external sources, see users.ingest."""
+    # read the body line by line instead of through request.data; an empty body has no stream
+    stream = request.stream or io.BytesIO()
+    if request.META.get('HTTP_CONTENT_ENCODING', '').lower() == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream)
+    # a body that breaks off midway still returns the counts of the batches already committed
+    result = ingest(iter(stream.readline, b''))
+    code = status.HTTP_201_CREATED if result['accepted'] else status.HTTP_400_BAD_REQUEST
+    return Response(result, status=code)
 
 @api_view(['PUT', 'PATCH'])
 @permission_classes([permissions.IsAuthenticated])
@@ -45,7 +45,7 @@ import TopNavBar from '@/app/components/TopNavBar';
 import Sidebar from '../components/SideBar';
 import { createAlertsSocket } from '@/lib/alertsSockets';
 import useSWR from 'swr';
-import { apiGetWithAuth } from '@/lib/api'; 
+import { apiGetAllPages } from '@/lib/api';
 
 const API_BASE =
   typeof window !== 'undefined'
@@ -172,12 +172,11 @@ export default function InsiderThreatDashboard() {
     setLogsLoading(true);
     setLogsError('');
     try {
-      const res = await fetch(`${API_BASE}/api/users/audit/logs/`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      if (!res.ok) throw new Error('Failed to fetch logs');
-      const data = await res.json();
-      const auditLogs = data.audit_logs || data;
+      const auditLogs = await apiGetAllPages(
+        `${API_BASE}/api/users/audit/logs/`,
+        token,
+        (data) => data.audit_logs || data
+      );
       setLogs(auditLogs);
     } catch (e: any) {
       setLogsError(e.message || 'Error loading logs');
@@ -192,7 +191,7 @@ export default function InsiderThreatDashboard() {
       mutate: mutateAlerts,
     } = useSWR(
       token ? `${API_BASE}/api/monitoring/alerts/` : null,
-      (url) => apiGetWithAuth(url, token)
+      (url) => apiGetAllPages(url, token)
   );
 
   useEffect(() => {
@@ -1,15 +1,30 @@
 // lib/alertsSocket.ts
-export function createAlertsSocket(token: string | null, onAlert: (a:any)=>void) {
+
+// id of the last event seen; a new socket resumes after it instead of missing the gap
+let lastEventId: string | null = null;
+
+export function createAlertsSocket(token: string | null, onAlert: (a:any)=>void, onReset?: ()=>void) {
   const protocol = typeof window !== 'undefined' && window.location.protocol === 'https:' ? 'wss' : 'ws';
   const host = process.env.NEXT_PUBLIC_WS_HOST || (typeof window !== 'undefined' ? window.location.host : '');
-  const url = `${protocol}://${host}/ws/alerts/${token ? `?token=${encodeURIComponent(token)}` : ''}`;
+  const params = new URLSearchParams();
+  if (token) params.set('token', token);
+  if (lastEventId) params.set('last_event_id', lastEventId);
+  const query = params.toString();
+  const url = `${protocol}://${host}/ws/alerts/${query ? `?${query}` : ''}`;
   const ws = new WebSocket(url);
 
   ws.onmessage = (ev) => {
     try {
       const data = JSON.parse(ev.data);
-      if (data.type === 'alert.created') onAlert(data.alert);
-      if (data.type === 'alert.updated') onAlert(data.alert);
+      // the server can no longer replay what was missed: reload the list
+      if (data.type === 'reset') onReset?.();
+      // the server coalesces bursts into one frame: { type: 'batch', events: [...] }
+      const events = data.type === 'batch' ? data.events : [data];
+      for (const e of events) {
+        if (e.id) lastEventId = e.id;
+        if (e.type === 'alert.created') onAlert(e.alert);
+        if (e.type === 'alert.updated') onAlert(e.alert);
+      }
     } catch {}
   };
 
@@ -87,3 +87,30 @@ export async function apiGetWithAuth(url: string, token: string | null) {
   });
   return handleResponse(res);
 }
+
+// ----------- PAGINATED GET (follows Link: <...>; rel="next") -----------
+function nextLink(res: Response): string | null {
+  const header = res.headers.get('Link');
+  const match = header?.match(/<([^>]+)>\s*;\s*rel="next"/);
+  return match ? match[1] : null;
+}
+
+// Fetches `url` and every following page, up to maxPages; `rows` picks the items out of a page body.
+export async function apiGetAllPages<T = any>(
+  url: string,
+  token: string | null,
+  rows: (body: any) => T[] = (body) => body,
+  maxPages = 20,
+): Promise<T[]> {
+  const items: T[] = [];
+  let next: string | null = url;
+  for (let page = 0; next && page < maxPages; page++) {
+    const res = await fetch(next, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+      credentials: 'include',
+    });
+    items.push(...rows(await handleResponse(res)));
+    next = nextLink(res);
+  }
+  return items;
+}